@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Autotune - chọn thread / concurrency cho máy này bằng micro-benchmark ngắn trên fixtures tổng hợp
+Đo Whisper intra-op threads, ffmpeg -threads, số render song song và số TTS worker (local TTS
+có latency giả lập), rồi ghi profile vào cpu_config.json; server áp dụng lúc khởi động (/api/tuning)
+
+Usage:
+    python autotune.py [--quick] [--dry-run]                   # Đo tất cả + ghi cpu_config.json
+    python autotune.py --knobs whisper,ffmpeg --whisper-model tiny
+    python autotune.py --tts-latency 0.5 --output tuning.json
+"""
+
+import argparse
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.append('.')
+
+KNOBS = ['whisper', 'ffmpeg', 'render', 'tts']
+
+# Chọn giá trị nhỏ nhất có điểm trong khoảng tolerance so với giá trị tốt nhất:
+# thêm thread / worker mà không nhanh hơn rõ rệt chỉ tốn CPU của các job khác
+TOLERANCE = 0.05
+
+
+def thread_candidates(limit):
+    """1, 2, 4, ... và chính limit"""
+    candidates, n = set(), 1
+    while n < limit:
+        candidates.add(n)
+        n *= 2
+    candidates.add(max(1, limit))
+    return sorted(candidates)
+
+
+def median_seconds(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def choose(scores, higher_is_better, tolerance=TOLERANCE):
+    """scores: {giá trị knob: điểm}; trả về giá trị nhỏ nhất gần tốt nhất"""
+    if higher_is_better:
+        best = max(scores.values())
+        return min(k for k, v in scores.items() if v >= best * (1 - tolerance))
+    best = min(scores.values())
+    return min(k for k, v in scores.items() if v <= best * (1 + tolerance))
+
+
+# === MICRO-BENCHMARKS ===
+
+def whisper_workload(main_app, model_name, precision, fixtures):
+    """Transcribe thật nếu có --whisper-model, nếu không: encoder giống Whisper tiny (4 layer, d=384, 1500 frame)"""
+    torch = main_app.torch
+    if model_name:
+        engine = main_app.get_asr_engine(model_name, precision)
+        audio = main_app.whisper.load_audio(fixtures['speech']).astype(main_app.np.float32)
+        _, options = main_app.get_decode_options('fast')
+        options['verbose'] = None
+        return lambda: engine.transcribe(audio, language='en', **options)
+
+    nn, F = torch.nn, torch.nn.functional
+
+    class EncoderBlock(nn.Module):
+        # Block attention + MLP như whisper.model.ResidualAttentionBlock (Linear thường: quantize_dynamic được)
+        def __init__(self, dims=384, heads=6):
+            super().__init__()
+            self.heads = heads
+            self.attn_ln, self.mlp_ln = nn.LayerNorm(dims), nn.LayerNorm(dims)
+            self.qkv, self.out = nn.Linear(dims, dims * 3), nn.Linear(dims, dims)
+            self.mlp = nn.Sequential(nn.Linear(dims, dims * 4), nn.GELU(), nn.Linear(dims * 4, dims))
+
+        def forward(self, x):
+            batch, frames, dims = x.shape
+            q, k, v = (t.view(batch, frames, self.heads, -1).transpose(1, 2)
+                       for t in self.qkv(self.attn_ln(x)).chunk(3, dim=-1))
+            attention = F.scaled_dot_product_attention(q, k, v).transpose(1, 2).reshape(batch, frames, dims)
+            x = x + self.out(attention)
+            return x + self.mlp(self.mlp_ln(x))
+
+    encoder = nn.Sequential(*[EncoderBlock() for _ in range(4)]).eval()
+    if precision == 'int8':
+        encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+    mel = torch.randn(1, 1500, 384)
+
+    def run():
+        with torch.inference_mode():
+            encoder(mel)
+    return run
+
+
+def tune_whisper(main_app, fixtures, args):
+    torch = main_app.torch
+    precision = main_app.WHISPER_CPU_CONFIG['precision']
+    workload = whisper_workload(main_app, args.whisper_model, precision, fixtures)
+    original = torch.get_num_threads()
+    scores = {}
+    try:
+        for threads in thread_candidates(os.cpu_count() or 1):
+            torch.set_num_threads(threads)
+            scores[threads] = median_seconds(workload, args.repeat)
+            print(f"   🧮 {threads} thread(s): {scores[threads] * 1000:.1f}ms")
+    finally:
+        torch.set_num_threads(original)
+    return choose(scores, higher_is_better=False), scores
+
+
+def tune_ffmpeg_threads(main_app, stage_benchmark, fixtures, spec, workdir, args):
+    """Một lần render cuối (combine + overlay + subtitles) với từng giá trị -threads"""
+    render = stage_benchmark.stage_combine(fixtures, spec, workdir)[0][2]
+    original = main_app.FFMPEG_CONFIG['threads']
+    scores = {}
+    try:
+        for threads in thread_candidates(os.cpu_count() or 1):
+            main_app.FFMPEG_CONFIG['threads'] = threads
+            scores[threads] = median_seconds(render, args.repeat)
+            print(f"   🎬 -threads {threads}: {scores[threads]:.2f}s")
+    finally:
+        main_app.FFMPEG_CONFIG['threads'] = original
+    return choose(scores, higher_is_better=False), scores
+
+
+def tune_render_parallelism(main_app, stage_benchmark, fixtures, spec, workdir, ffmpeg_threads, args):
+    """Throughput (render/phút) khi chạy K render cùng lúc, mỗi render dùng ffmpeg_threads"""
+    limit = max(1, (os.cpu_count() or 1) // max(ffmpeg_threads, 1))
+    original_executor, original_threads = main_app.ffmpeg_executor, main_app.FFMPEG_CONFIG['threads']
+    main_app.FFMPEG_CONFIG['threads'] = ffmpeg_threads
+    scores = {}
+    try:
+        for parallel in thread_candidates(max(2, limit)):
+            job_classes = {name: dict(cls) for name, cls in main_app.FFMPEG_JOB_CLASSES.items()}
+            job_classes['render']['max_concurrent'] = parallel
+            # Executor riêng: semaphore chung / render không được giới hạn phép đo
+            main_app.ffmpeg_executor = main_app.FFmpegExecutor(
+                dict(main_app.FFMPEG_CONFIG, max_processes=parallel * 2), job_classes)
+            renders = []
+            for i in range(parallel):
+                render_dir = os.path.join(workdir, f'render{i}')
+                os.makedirs(render_dir, exist_ok=True)
+                renders.append(stage_benchmark.stage_combine(fixtures, spec, render_dir)[0][2])
+            errors = []
+
+            def worker(render):
+                try:
+                    for _ in range(args.repeat):
+                        render()
+                except Exception as e:
+                    errors.append(e)
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(render,)) for render in renders]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+            scores[parallel] = parallel * args.repeat / (time.perf_counter() - start) * 60
+            print(f"   🎞️ {parallel} parallel render(s): {scores[parallel]:.2f} renders/min")
+    finally:
+        main_app.ffmpeg_executor = original_executor
+        main_app.FFMPEG_CONFIG['threads'] = original_threads
+    return choose(scores, higher_is_better=True), scores
+
+
+def tune_tts_concurrency(main_app, args):
+    """Segment/giây của các TTS worker (như generate_voice_pipelined) với local TTS có latency giả lập"""
+    # Không vượt quá số kết nối đồng thời của provider thật (semaphore theo provider)
+    limit = max(n for provider, n in main_app.TTS_POOL_CONFIG['max_connections'].items()
+                if provider != main_app.TTSProvider.LOCAL_TTS)
+    texts = [f"Câu thoại số {i} dùng để đo số worker tối ưu cho lồng tiếng." for i in range(args.tts_segments)]
+    scores = {}
+    for workers in thread_candidates(limit):
+        mixer = main_app.TimelineMixer(main_app.AUDIO_SAMPLE_RATE, main_app.AUDIO_CHANNELS, 1.0)
+        segment_queue = queue.Queue()
+        for i, text in enumerate(texts):
+            segment_queue.put((i * 5.0, text))
+        failed = []
+
+        def worker():
+            while True:
+                try:
+                    start, text = segment_queue.get_nowait()
+                except queue.Empty:
+                    return
+                output = main_app.TimelineSlot(mixer, start)
+                if not main_app.tts_manager.run(main_app.generate_speech_first_pass(
+                        main_app.tts_manager, text, args.tts_voice, output, 1.0)):
+                    failed.append(text)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        scores[workers] = (len(texts) - len(failed)) / (time.perf_counter() - start)
+        print(f"   🎤 {workers} worker(s): {scores[workers]:.2f} segments/s ({len(failed)} failed)")
+    return choose(scores, higher_is_better=True), scores
+
+
+# === PROFILE ===
+
+def build_profile(existing, chosen, measurements, machine_profile, args):
+    """Gộp kết quả vào cpu_config.json hiện có (giữ các mục khác của optimize_cpu.py)"""
+    profile = dict(existing)
+    if 'whisper' in chosen:
+        profile['whisper_cpu'] = dict(existing.get('whisper_cpu', {}), intra_op_threads=chosen['whisper'])
+    if 'ffmpeg' in chosen:
+        profile['ffmpeg_threads'] = chosen['ffmpeg']
+    if 'render' in chosen:
+        profile['render_parallelism'] = chosen['render']
+        # Tổng số ffmpeg nặng chạy cùng lúc: đủ cho render song song, tổng thread ≈ số core
+        threads = profile.get('ffmpeg_threads') or 1
+        profile['max_concurrent_processes'] = max(chosen['render'], (os.cpu_count() or 1) // threads)
+    if 'tts' in chosen:
+        profile['tts_concurrency'] = chosen['tts']
+    profile['tuning'] = {
+        'autotuned_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine_profile': machine_profile,
+        'cpu_count': os.cpu_count(),
+        'settings': {'quick': args.quick, 'repeat': args.repeat, 'whisper_model': args.whisper_model,
+                     'tts_latency': args.tts_latency, 'tolerance': TOLERANCE},
+        # Key JSON là string: {giá trị knob: điểm}; knob không chạy lại giữ số đo cũ
+        'measurements': {**existing.get('tuning', {}).get('measurements', {}),
+                         **{knob: {str(k): round(v, 4) for k, v in scores.items()} for knob, scores in measurements.items()}}
+    }
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autotune Whisper / TTS / ffmpeg concurrency for this machine")
+    parser.add_argument('--knobs', default=','.join(KNOBS), help=f"Comma-separated knobs ({', '.join(KNOBS)})")
+    parser.add_argument('--quick', action='store_true', help="Small fixtures for a fast run")
+    parser.add_argument('--repeat', type=int, default=3, help="Measured runs per candidate")
+    parser.add_argument('--whisper-model', default=None, help="Use a real Whisper model instead of the synthetic encoder")
+    parser.add_argument('--tts-latency', type=float, default=0.3, help="Simulated provider latency for the TTS knob")
+    parser.add_argument('--tts-segments', type=int, default=24, help="Segments per TTS concurrency candidate")
+    parser.add_argument('--tts-voice', default='local-vi-female', help="Local TTS voice for the TTS knob")
+    parser.add_argument('--config', default=None, help="Profile to update (default: cpu_config.json)")
+    parser.add_argument('--dry-run', action='store_true', help="Measure and print, don't write the profile")
+    parser.add_argument('--output', default=None, help="Also write the profile to this path")
+    args = parser.parse_args()
+
+    knobs = [k.strip() for k in args.knobs.split(',') if k.strip()]
+    unknown = [k for k in knobs if k not in KNOBS]
+    if unknown:
+        parser.error(f"Unknown knob(s): {', '.join(unknown)}")
+
+    # Local TTS phải bật trước khi import main_app (voice được đăng ký lúc khởi tạo TTSManager)
+    os.environ.update(LOCAL_TTS='1', TTS_VOICE_DISCOVERY='0', LOCAL_TTS_LATENCY=str(args.tts_latency),
+                      LOCAL_TTS_LATENCY_JITTER=str(args.tts_latency / 5), LOCAL_TTS_CONCURRENCY='64')
+    import main_app
+    import stage_benchmark
+
+    print("🎛️ AUTOTUNE")
+    print("=" * 60)
+    config_path = args.config or main_app.CPU_CONFIG_PATH
+    machine_profile = stage_benchmark.machine_profile()
+    print(f"🖥️ Machine: {machine_profile} ({os.cpu_count()} CPUs)")
+    print(f"⚙️ Knobs: {', '.join(knobs)} | repeat {args.repeat} | {'quick' if args.quick else 'full'} fixtures")
+
+    main_app.logger.setLevel('WARNING')  # Log INFO của từng job làm nhiễu phép đo
+    spec = stage_benchmark.FIXTURE_SPECS['quick' if args.quick else 'full']
+    fixtures_dir = os.path.join('temp', 'bench_fixtures')
+    workdir = os.path.join(fixtures_dir, 'autotune')
+    os.makedirs(workdir, exist_ok=True)
+    print("📦 Preparing fixtures...")
+    fixtures = stage_benchmark.build_fixtures(spec, fixtures_dir)
+
+    chosen, measurements = {}, {}
+    steps = [
+        ('whisper', "Whisper intra-op threads", lambda: tune_whisper(main_app, fixtures, args)),
+        ('ffmpeg', "ffmpeg -threads (final render)",
+         lambda: tune_ffmpeg_threads(main_app, stage_benchmark, fixtures, spec, workdir, args)),
+        ('render', "Render parallelism",
+         lambda: tune_render_parallelism(main_app, stage_benchmark, fixtures, spec, workdir,
+                                         chosen.get('ffmpeg') or main_app.FFMPEG_CONFIG['threads'] or 1, args)),
+        ('tts', f"TTS concurrency (local TTS, {args.tts_latency}s latency)", lambda: tune_tts_concurrency(main_app, args))
+    ]
+    for knob, title, tune in steps:
+        if knob not in knobs:
+            continue
+        print(f"\n🔄 {title}")
+        try:
+            chosen[knob], measurements[knob] = tune()
+            print(f"   ✅ Chosen: {chosen[knob]}")
+        except Exception as e:
+            print(f"   ❌ {knob} failed: {e}")
+
+    profile = build_profile(main_app.load_cpu_config(config_path), chosen, measurements, machine_profile, args)
+
+    print("\n📋 TUNING PROFILE")
+    print("-" * 60)
+    print(f"   Whisper threads:     {profile.get('whisper_cpu', {}).get('intra_op_threads')}")
+    print(f"   TTS concurrency:     {profile.get('tts_concurrency')}")
+    print(f"   ffmpeg threads:      {profile.get('ffmpeg_threads')}")
+    print(f"   Render parallelism:  {profile.get('render_parallelism')}")
+    print(f"   Max ffmpeg procs:    {profile.get('max_concurrent_processes')}")
+
+    targets = ([] if args.dry_run else [config_path]) + ([args.output] if args.output else [])
+    for path in targets:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Profile saved to {path}")
+    if not args.dry_run:
+        print("💡 Restart the server to apply; active values: GET /api/tuning")
+    return 0 if len(chosen) == len(knobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Benchmark Compare - regression gate cho stage_benchmark.py
+Lưu baseline JSON theo machine profile, chạy lại benchmark và so sánh từng stage:
+latency (median), throughput, CPU và peak memory, có ngưỡng nhiễu thống kê
+
+Usage:
+    python benchmark_compare.py --update-baseline [--quick]      # Ghi baseline cho máy này
+    python benchmark_compare.py [--quick] [--stages timeline_mix] # Chạy lại + so sánh, exit 1 nếu regression
+    python benchmark_compare.py --report bench.json               # So sánh report có sẵn
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+sys.path.append('.')
+from stage_benchmark import STAGES, SCHEMA_VERSION, run_benchmarks
+
+BASELINE_DIR = 'benchmark_baselines'
+
+# Thay đổi chỉ bị coi là regression khi vượt cả ngưỡng tương đối lẫn nhiễu đo
+COMPARE_THRESHOLDS = {
+    'latency': {'relative': 0.10, 'sigmas': 3.0},    # median_seconds tăng > 10% và > 3σ (stdev gộp)
+    'throughput': {'relative': 0.10},                 # throughput giảm > 10% (cùng phép thử nhiễu với latency)
+    'cpu_seconds': {'relative': 0.15, 'absolute': 0.005},
+    'memory': {'relative': 0.15, 'absolute_mb': 5.0}  # peak memory tăng > 15% và > 5 MB
+}
+
+MEMORY_METRICS = ['peak_traced_mb', 'rss_growth_mb', 'subprocess_peak_rss_mb']
+
+
+def baseline_path(profile, quick, folder=BASELINE_DIR):
+    return os.path.join(folder, f"{profile}{'_quick' if quick else ''}.json")
+
+
+def latency_noise(base, current, thresholds):
+    """Ngưỡng nhiễu tuyệt đối (giây): sigmas * stdev gộp của hai lần chạy"""
+    pooled = math.sqrt(base.get('stdev_seconds', 0.0) ** 2 + current.get('stdev_seconds', 0.0) ** 2)
+    return thresholds['latency']['sigmas'] * pooled
+
+
+def classify(change, limit, significant):
+    if not significant:
+        return 'unchanged'
+    if change > limit:
+        return 'regression'
+    if change < -limit:
+        return 'improvement'
+    return 'unchanged'
+
+
+def compare_case(base, current, thresholds):
+    """So sánh một case; trả về {metric: {...}} và verdict tổng"""
+    checks = {}
+
+    # Latency: median, ngưỡng tương đối + nhiễu (stdev gộp)
+    delta = current['median_seconds'] - base['median_seconds']
+    relative = delta / base['median_seconds'] if base['median_seconds'] > 0 else 0.0
+    significant = abs(delta) > latency_noise(base, current, thresholds)
+    checks['latency'] = {
+        'baseline': base['median_seconds'], 'current': current['median_seconds'],
+        'change': round(relative, 4),
+        'status': classify(relative, thresholds['latency']['relative'], significant)
+    }
+
+    # Throughput: giảm là regression (đổi dấu để dùng chung classify)
+    if base.get('throughput') and current.get('throughput'):
+        relative = (current['throughput'] - base['throughput']) / base['throughput']
+        checks['throughput'] = {
+            'baseline': base['throughput'], 'current': current['throughput'], 'change': round(relative, 4),
+            'status': classify(-relative, thresholds['throughput']['relative'], significant)
+        }
+
+    base_cpu, current_cpu = base.get('cpu_seconds'), current.get('cpu_seconds')
+    if base_cpu is not None and current_cpu is not None and base_cpu > 0:
+        relative = (current_cpu - base_cpu) / base_cpu
+        checks['cpu_seconds'] = {
+            'baseline': base_cpu, 'current': current_cpu, 'change': round(relative, 4),
+            'status': classify(relative, thresholds['cpu_seconds']['relative'],
+                               abs(current_cpu - base_cpu) > thresholds['cpu_seconds']['absolute'])
+        }
+
+    for metric in MEMORY_METRICS:
+        base_mb, current_mb = base.get(metric), current.get(metric)
+        if base_mb is None or current_mb is None:
+            continue
+        delta = current_mb - base_mb
+        relative = delta / base_mb if base_mb > 0 else (math.inf if delta > 0 else 0.0)
+        checks[metric] = {
+            'baseline': base_mb, 'current': current_mb,
+            'change': round(relative, 4) if math.isfinite(relative) else None,
+            'status': classify(relative, thresholds['memory']['relative'],
+                               abs(delta) > thresholds['memory']['absolute_mb'])
+        }
+
+    statuses = {check['status'] for check in checks.values()}
+    verdict = 'regression' if 'regression' in statuses else 'improvement' if 'improvement' in statuses else 'unchanged'
+    return checks, verdict
+
+
+def compare_reports(baseline, current, thresholds=None):
+    """So sánh hai report của stage_benchmark.py"""
+    thresholds = thresholds or COMPARE_THRESHOLDS
+    if baseline.get('schema_version') != current.get('schema_version'):
+        raise ValueError(f"Schema mismatch: baseline v{baseline.get('schema_version')} vs current v{current.get('schema_version')}")
+    if baseline['settings']['fixtures'] != current['settings']['fixtures']:
+        raise ValueError("Fixture specs differ (quick vs full?): baseline and current are not comparable")
+
+    cases = {}
+    for name, current_case in current['results'].items():
+        base_case = baseline['results'].get(name)
+        if base_case is None:
+            cases[name] = {'verdict': 'new'}
+        elif base_case.get('status') != 'ok' or current_case.get('status') != 'ok':
+            cases[name] = {'verdict': 'error' if current_case.get('status') == 'error' else 'skipped',
+                           'error': current_case.get('error') or base_case.get('error')}
+        else:
+            checks, verdict = compare_case(base_case, current_case, thresholds)
+            cases[name] = {'verdict': verdict, 'checks': checks}
+    for name in baseline['results']:
+        if name not in current['results']:
+            cases[name] = {'verdict': 'not_run'}  # Stage không nằm trong --stages của lần chạy này
+
+    verdicts = [case['verdict'] for case in cases.values()]
+    return {
+        'machine_profile': current['machine']['profile'],
+        'baseline_created_at': baseline.get('created_at'),
+        'current_created_at': current.get('created_at'),
+        'thresholds': thresholds,
+        'summary': {verdict: verdicts.count(verdict) for verdict in sorted(set(verdicts))},
+        'regressions': [name for name, case in cases.items() if case['verdict'] in ('regression', 'error')],
+        'cases': cases
+    }
+
+
+def print_comparison(comparison):
+    icons = {'regression': '🔴', 'improvement': '🟢', 'unchanged': '⚪', 'new': '🆕',
+             'error': '❌', 'skipped': '⚠️', 'not_run': '⏭️'}
+    print(f"\n📊 COMPARISON vs baseline {comparison['baseline_created_at']} ({comparison['machine_profile']})")
+    print("-" * 60)
+    for name, case in comparison['cases'].items():
+        print(f"{icons.get(case['verdict'], '•')} {name}: {case['verdict']}")
+        for metric, check in case.get('checks', {}).items():
+            if check['status'] == 'unchanged':
+                continue
+            change = f"{check['change'] * 100:+.1f}%" if check['change'] is not None else 'new'
+            print(f"      {metric}: {check['baseline']} → {check['current']} ({change})")
+        if case.get('error'):
+            print(f"      {case['error']}")
+    print("-" * 60)
+    print(f"📋 Summary: {comparison['summary']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark regression gate (baseline theo machine profile)")
+    parser.add_argument('--update-baseline', action='store_true', help="Store the run as this machine's baseline")
+    parser.add_argument('--report', default=None, help="Compare an existing stage_benchmark.py JSON instead of rerunning")
+    parser.add_argument('--baseline', default=None, help="Baseline JSON path (default: per machine profile)")
+    parser.add_argument('--baseline-dir', default=BASELINE_DIR, help="Folder of per-machine baselines")
+    parser.add_argument('--stages', default=None, help=f"Comma-separated stages ({', '.join(STAGES)})")
+    parser.add_argument('--repeat', type=int, default=5, help="Measured runs per case")
+    parser.add_argument('--quick', action='store_true', help="Small fixtures for a fast run")
+    parser.add_argument('--latency-threshold', type=float, default=None, help="Relative latency/throughput threshold (0.10 = 10%%)")
+    parser.add_argument('--memory-threshold', type=float, default=None, help="Relative peak memory threshold")
+    parser.add_argument('--output', default=None, help="Write comparison JSON to this path")
+    args = parser.parse_args()
+
+    print("🚦 BENCHMARK REGRESSION GATE")
+    print("=" * 60)
+
+    if args.report:
+        with open(args.report, encoding='utf-8') as f:
+            current = json.load(f)
+        quick = current['settings']['quick']
+    else:
+        stages = [s.strip() for s in args.stages.split(',') if s.strip()] if args.stages else None
+        current = run_benchmarks(stages, args.repeat, quick=args.quick)
+        quick = args.quick
+
+    profile = current['machine']['profile']
+    path = args.baseline or baseline_path(profile, quick, args.baseline_dir)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if os.path.exists(path) and args.stages:
+            # Chỉ chạy một số stage: giữ kết quả cũ của các stage còn lại
+            with open(path, encoding='utf-8') as f:
+                previous = json.load(f)
+            if previous.get('schema_version') == SCHEMA_VERSION:
+                current['results'] = {**previous['results'], **current['results']}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Baseline saved to {path}")
+        return 0
+
+    if not os.path.exists(path):
+        print(f"❌ No baseline for machine profile '{profile}' at {path}")
+        print("💡 Run with --update-baseline first")
+        return 2
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    thresholds = json.loads(json.dumps(COMPARE_THRESHOLDS))
+    if args.latency_threshold is not None:
+        thresholds['latency']['relative'] = thresholds['throughput']['relative'] = args.latency_threshold
+    if args.memory_threshold is not None:
+        thresholds['memory']['relative'] = args.memory_threshold
+
+    comparison = compare_reports(baseline, current, thresholds)
+    print_comparison(comparison)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(comparison, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Comparison saved to {args.output}")
+
+    if comparison['regressions']:
+        print(f"\n🔴 {len(comparison['regressions'])} regression(s): {', '.join(comparison['regressions'])}")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
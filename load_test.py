@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Load Test - chạy chuỗi endpoint thật với N user đồng thời để biết một node chịu được bao nhiêu tải
+upload → generate_subtitles (hoặc upload_srt) → poll status → generate_voice → create_final_video → download
+
+Báo cáo: throughput, p50/p95/p99 latency theo endpoint, thời gian hoàn thành từng job,
+CPU/RSS của server (cả process con: ffmpeg) theo thời gian
+
+Usage:
+    python load_test.py --spawn-server --users 4 --sessions 2 --srt auto       # Offline: local TTS + SRT có sẵn
+    python load_test.py --url http://localhost:9999 --server-pid 1234 --video clip.mp4 --whisper-model tiny
+    python load_test.py --spawn-server --users 8 --tts-latency 0.3 --tts-failure-rate 0.05 --output load.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.append('.')
+
+# Job chạy nền: trạng thái kết thúc theo từng bước
+TERMINAL_STATUS = {
+    'subtitles': 'subtitles_completed',
+    'voice': 'voice_completed',
+    'final': 'completed'
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE_MB = os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def percentile(values, q):
+    """Percentile nội suy tuyến tính (q trong [0, 1])"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(values):
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 0.5), 4) if values else None,
+        'p95': round(percentile(values, 0.95), 4) if values else None,
+        'p99': round(percentile(values, 0.99), 4) if values else None,
+        'max': round(max(values), 4) if values else None
+    }
+
+
+# === SERVER RESOURCES ===
+
+def _process_tree(root_pid):
+    """root_pid + mọi process con cháu (đọc ppid từ /proc/*/stat)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def _process_usage(pid):
+    """(CPU giây gồm con đã reap, RSS MB) của một process"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # Sau ')': field N của proc(5) ở index N-3 → utime..cstime = 14-17, rss (pages) = 24
+    cpu = sum(int(value) for value in fields[11:15]) / CLOCK_TICKS
+    return cpu, int(fields[21]) * PAGE_SIZE_MB
+
+
+class ResourceSampler:
+    """Lấy mẫu CPU% / RSS của cây process server mỗi interval giây"""
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+
+    def _snapshot(self):
+        cpu = rss = 0.0
+        processes = 0
+        for pid in _process_tree(self.pid):
+            try:
+                pid_cpu, pid_rss = _process_usage(pid)
+            except (OSError, IndexError, ValueError):
+                continue  # Process vừa kết thúc
+            cpu += pid_cpu
+            rss += pid_rss
+            processes += 1
+        return cpu, rss, processes
+
+    def _run(self):
+        start = time.monotonic()
+        last_time, (last_cpu, _, _) = start, self._snapshot()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            cpu, rss, processes = self._snapshot()
+            self.samples.append({
+                't': round(now - start, 2),
+                'cpu_percent': round(max(cpu - last_cpu, 0.0) / (now - last_time) * 100, 1),
+                'rss_mb': round(rss, 1),
+                'processes': processes
+            })
+            last_time, last_cpu = now, cpu
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [s['cpu_percent'] for s in self.samples]
+        return {
+            'mean_cpu_percent': round(sum(cpu) / len(cpu), 1),
+            'p95_cpu_percent': round(percentile(cpu, 0.95), 1),
+            'peak_rss_mb': max(s['rss_mb'] for s in self.samples),
+            'peak_processes': max(s['processes'] for s in self.samples),
+            'cpu_count': os.cpu_count()
+        }
+
+
+def spawn_server(args):
+    """Chạy main_app.py (không debug/reloader) với local TTS (offline) và chờ tới khi nhận request"""
+    env = dict(os.environ, APP_DEBUG='0', LOCAL_TTS='1', TTS_VOICE_DISCOVERY='0',
+               LOCAL_TTS_LATENCY=str(args.tts_latency), LOCAL_TTS_LATENCY_JITTER=str(args.tts_jitter),
+               LOCAL_TTS_FAILURE_RATE=str(args.tts_failure_rate))
+    log = open(args.server_log, 'w')
+    process = subprocess.Popen([sys.executable, 'main_app.py'], env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (see {args.server_log})")
+        try:
+            requests.get(f"{args.url}/api/providers", timeout=2)
+            return process, log
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Server not ready after {args.startup_timeout}s (see {args.server_log})")
+
+
+def stop_server(process, log):
+    # Dừng cả các ffmpeg con còn đang chạy của server
+    for pid in reversed(_process_tree(process.pid)):
+        try:
+            os.kill(pid, 15)
+        except OSError:
+            pass
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    log.close()
+
+
+# === USER SESSION ===
+
+class LoadRecorder:
+    """Gom latency từng request và thời gian từng job (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []   # (endpoint, seconds, status_code)
+        self.jobs = []       # (job, seconds, ok)
+        self.sessions = []   # {'ok', 'seconds', 'error'}
+
+    def request(self, endpoint, seconds, status_code):
+        with self.lock:
+            self.requests.append((endpoint, seconds, status_code))
+
+    def job(self, name, seconds, ok):
+        with self.lock:
+            self.jobs.append((name, seconds, ok))
+
+    def session(self, ok, seconds, error=None):
+        with self.lock:
+            self.sessions.append({'ok': ok, 'seconds': round(seconds, 3), 'error': error})
+
+
+class UserSession:
+    """Một user ảo: chạy toàn bộ chuỗi endpoint trên một video"""
+
+    def __init__(self, args, recorder):
+        self.args = args
+        self.recorder = recorder
+        self.http = requests.Session()
+
+    def call(self, endpoint, method, path, **kwargs):
+        start = time.monotonic()
+        try:
+            response = self.http.request(method, f"{self.args.url}{path}", timeout=self.args.request_timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.request(endpoint, time.monotonic() - start, None)
+            raise
+        self.recorder.request(endpoint, time.monotonic() - start, response.status_code)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{endpoint} → HTTP {response.status_code}: {response.text[:200]}")
+        return response
+
+    def wait_for(self, task_id, job, started):
+        """Poll /api/status tới trạng thái kết thúc của job"""
+        deadline = started + self.args.job_timeout
+        while time.monotonic() < deadline:
+            status = self.call('status', 'GET', f"/api/status/{task_id}").json()
+            if status.get('status') == TERMINAL_STATUS[job]:
+                self.recorder.job(job, time.monotonic() - started, True)
+                return status
+            if status.get('status') == 'error':
+                self.recorder.job(job, time.monotonic() - started, False)
+                raise RuntimeError(f"{job} failed: {status.get('error')}")
+            time.sleep(self.args.poll_interval)
+        self.recorder.job(job, time.monotonic() - started, False)
+        raise TimeoutError(f"{job} not finished after {self.args.job_timeout}s")
+
+    def run(self):
+        args = self.args
+        session_start = time.monotonic()
+        try:
+            with open(args.video, 'rb') as f:
+                task_id = self.call('upload_video', 'POST', '/api/upload_video',
+                                    files={'video': (os.path.basename(args.video), f)}).json()['task_id']
+
+            if args.srt:
+                with open(args.srt, 'rb') as f:
+                    self.call('upload_srt', 'POST', f"/api/upload_srt/{task_id}",
+                              files={'srt': (os.path.basename(args.srt), f)})
+            else:
+                started = time.monotonic()
+                self.call('generate_subtitles', 'POST', f"/api/generate_subtitles/{task_id}",
+                          json={'model': args.whisper_model, 'language': args.language, 'stream': False})
+                self.wait_for(task_id, 'subtitles', started)
+
+            started = time.monotonic()
+            self.call('generate_voice', 'POST', f"/api/generate_voice/{task_id}",
+                      json={'voice_id': args.voice_id, 'language': args.language, 'speech_rate': 1.0})
+            self.wait_for(task_id, 'voice', started)
+
+            started = time.monotonic()
+            self.call('create_final_video', 'POST', f"/api/create_final_video/{task_id}", json={})
+            self.wait_for(task_id, 'final', started)
+
+            download = self.call('download_final', 'GET', f"/api/download/{task_id}/final", stream=True)
+            for _ in download.iter_content(1024 * 1024):
+                pass
+            self.recorder.session(True, time.monotonic() - session_start)
+        except Exception as e:
+            self.recorder.session(False, time.monotonic() - session_start, str(e)[:300])
+
+
+def run_user(args, recorder, user_index):
+    # Ramp-up: user thứ i bắt đầu sau i * ramp_up / users giây
+    time.sleep(args.ramp_up * user_index / max(args.users, 1))
+    session = UserSession(args, recorder)
+    for _ in range(args.sessions):
+        session.run()
+
+
+# === REPORT ===
+
+def build_report(args, recorder, wall_seconds, sampler):
+    endpoints = {}
+    for endpoint, seconds, status_code in recorder.requests:
+        entry = endpoints.setdefault(endpoint, {'latencies': [], 'errors': 0})
+        entry['latencies'].append(seconds)
+        if status_code is None or status_code >= 400:
+            entry['errors'] += 1
+
+    jobs = {}
+    for name, seconds, ok in recorder.jobs:
+        entry = jobs.setdefault(name, {'seconds': [], 'failed': 0})
+        if ok:
+            entry['seconds'].append(seconds)
+        else:
+            entry['failed'] += 1
+
+    completed = [s for s in recorder.sessions if s['ok']]
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'url': args.url, 'users': args.users, 'sessions_per_user': args.sessions, 'ramp_up': args.ramp_up,
+            'video': args.video, 'asr': 'upload_srt' if args.srt else f"whisper:{args.whisper_model}",
+            'voice_id': args.voice_id, 'tts_latency': args.tts_latency, 'tts_failure_rate': args.tts_failure_rate
+        },
+        'wall_seconds': round(wall_seconds, 2),
+        'throughput': {
+            'sessions_per_minute': round(len(completed) / wall_seconds * 60, 3) if wall_seconds else None,
+            'requests_per_second': round(len(recorder.requests) / wall_seconds, 3) if wall_seconds else None
+        },
+        'sessions': {
+            'completed': len(completed),
+            'failed': len(recorder.sessions) - len(completed),
+            'seconds': latency_summary([s['seconds'] for s in completed]),
+            'errors': sorted({s['error'] for s in recorder.sessions if s['error']})
+        },
+        'endpoints': {name: {**latency_summary(e['latencies']), 'errors': e['errors']} for name, e in endpoints.items()},
+        'jobs': {name: {**latency_summary(e['seconds']), 'failed': e['failed']} for name, e in jobs.items()},
+        'server': {'summary': sampler.summary(), 'samples': sampler.samples} if sampler else None
+    }
+
+
+def print_report(report):
+    print(f"\n📊 RESULTS ({report['settings']['users']} users, {report['wall_seconds']}s)")
+    print("-" * 72)
+    print(f"{'endpoint':<22}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}")
+    for name, e in report['endpoints'].items():
+        print(f"{name:<22}{e['count']:>7}{e['p50']:>9.3f}{e['p95']:>9.3f}{e['p99']:>9.3f}{e['errors']:>8}")
+    print("-" * 72)
+    for name, job in report['jobs'].items():
+        if job['count']:
+            print(f"⏱️ Job {name}: p50 {job['p50']:.2f}s, p95 {job['p95']:.2f}s, p99 {job['p99']:.2f}s"
+                  f" ({job['count']} ok, {job['failed']} failed)")
+        else:
+            print(f"⏱️ Job {name}: 0 ok, {job['failed']} failed")
+    sessions = report['sessions']
+    print(f"🎬 Sessions: {sessions['completed']} completed, {sessions['failed']} failed"
+          f" | {report['throughput']['sessions_per_minute']} sessions/min,"
+          f" {report['throughput']['requests_per_second']} req/s")
+    for error in sessions['errors'][:5]:
+        print(f"   ❌ {error}")
+    if report['server'] and report['server']['summary']:
+        server = report['server']['summary']
+        print(f"🖥️ Server: CPU mean {server['mean_cpu_percent']}% / p95 {server['p95_cpu_percent']}%"
+              f" ({server['cpu_count']} cores), peak RSS {server['peak_rss_mb']} MB,"
+              f" peak {server['peak_processes']} processes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load generator for the video pipeline endpoints")
+    parser.add_argument('--url', default='http://localhost:9999', help="Server base URL")
+    parser.add_argument('--users', type=int, default=2, help="Concurrent virtual users")
+    parser.add_argument('--sessions', type=int, default=1, help="Full pipeline runs per user")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="Seconds to start all users")
+    parser.add_argument('--video', default=None, help="Video to upload (default: synthetic fixture)")
+    parser.add_argument('--srt', default=None,
+                        help="Upload this SRT instead of running Whisper ('auto' = fixture SRT, offline)")
+    parser.add_argument('--whisper-model', default='tiny', help="Whisper model for generate_subtitles")
+    parser.add_argument('--language', default='vi', help="Subtitle / voice language")
+    parser.add_argument('--voice-id', default='local-vi-female', help="TTS voice (local-* needs LOCAL_TTS=1 on the server)")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="Status polling interval (seconds)")
+    parser.add_argument('--request-timeout', type=float, default=120.0, help="Per-request timeout (seconds)")
+    parser.add_argument('--job-timeout', type=float, default=1800.0, help="Per-job timeout (seconds)")
+    parser.add_argument('--spawn-server', action='store_true', help="Start main_app.py with local TTS and stop it afterwards")
+    parser.add_argument('--server-pid', type=int, default=None, help="PID of an already running server (CPU/RSS sampling)")
+    parser.add_argument('--server-log', default='temp/load_test_server.log', help="Log file of the spawned server")
+    parser.add_argument('--startup-timeout', type=float, default=180.0, help="Seconds to wait for the spawned server")
+    parser.add_argument('--tts-latency', type=float, default=0.2, help="Spawned server: local TTS latency (seconds)")
+    parser.add_argument('--tts-jitter', type=float, default=0.1, help="Spawned server: local TTS latency jitter")
+    parser.add_argument('--tts-failure-rate', type=float, default=0.0, help="Spawned server: local TTS failure rate")
+    parser.add_argument('--sample-interval', type=float, default=1.0, help="Server CPU/RSS sampling interval")
+    parser.add_argument('--output', default=None, help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    print("🏋️ LOAD TEST")
+    print("=" * 72)
+
+    if args.video is None or args.srt == 'auto':
+        # Fixture tổng hợp của stage_benchmark (video testsrc2 + SRT), cache theo nội dung lệnh
+        from stage_benchmark import FIXTURE_SPECS, build_fixtures
+        fixtures = build_fixtures(FIXTURE_SPECS['quick'], 'temp/bench_fixtures')
+        args.video = args.video or fixtures['video']
+        if args.srt == 'auto':
+            args.srt = fixtures['render_srt']
+    print(f"🎞️ Video: {args.video} | ASR: {'upload_srt ' + args.srt if args.srt else 'whisper ' + args.whisper_model}")
+    print(f"👥 Users: {args.users} x {args.sessions} session(s), ramp-up {args.ramp_up}s | Voice: {args.voice_id}")
+
+    server = None
+    if args.spawn_server:
+        os.makedirs(os.path.dirname(args.server_log) or '.', exist_ok=True)
+        print("🚀 Starting server with local TTS...")
+        server = spawn_server(args)
+        args.server_pid = server[0].pid
+
+    sampler = ResourceSampler(args.server_pid, args.sample_interval) if args.server_pid else None
+    if sampler is None:
+        print("⚠️ No --server-pid / --spawn-server: server CPU/RSS not sampled")
+
+    recorder = LoadRecorder()
+    try:
+        if sampler:
+            sampler.start()
+        start = time.monotonic()
+        users = [threading.Thread(target=run_user, args=(args, recorder, i), name=f'user-{i}')
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        wall_seconds = time.monotonic() - start
+    finally:
+        if sampler:
+            sampler.stop()
+        if server:
+            stop_server(*server)
+
+    report = build_report(args, recorder, wall_seconds, sampler)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report saved to {args.output}")
+
+    return 0 if report['sessions']['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
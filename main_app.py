@@ -5,7 +5,7 @@ AI Video Editor - Professional Video Subtitle & Voice Generation Tool
 Tính năng: Whisper AI, Edge TTS, Timeline Editor, Multi-language Support
 """
 
-from flask import Flask, request, jsonify, render_template, send_file, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_file, send_from_directory, Response
 from flask_cors import CORS
 import whisper
 import torch
@@ -23,6 +23,9 @@ import threading
 import uuid
 import subprocess
 import asyncio
+import concurrent.futures
+import queue
+import wave
 import re
 from datetime import timedelta
 from werkzeug.utils import secure_filename
@@ -32,8 +35,14 @@ import aiohttp
 import openai
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from collections import deque
 from enum import Enum
 import math
+import mimetypes
+import hashlib
+import atexit
+import weakref
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -58,13 +67,1147 @@ app.config.update({
     'OUTPUT_FOLDER': OUTPUT_FOLDER, 
     'TEMP_FOLDER': TEMP_FOLDER,
     'MAX_CONTENT_LENGTH': 10 * 1024 * 1024 * 1024,  # 10GB max file size
-    'PERMANENT_SESSION_LIFETIME': timedelta(hours=24)
+    'PERMANENT_SESSION_LIFETIME': timedelta(hours=24),
+    # Download qua reverse proxy: 'x-sendfile' (Apache/lighttpd) hoặc 'x-accel' (nginx)
+    'SENDFILE_MODE': os.getenv('SENDFILE_MODE'),
+    'SENDFILE_ACCEL_PREFIX': os.getenv('SENDFILE_ACCEL_PREFIX', '/protected-outputs')
 })
+app.config['USE_X_SENDFILE'] = app.config['SENDFILE_MODE'] == 'x-sendfile'
 
 # Global variables
 whisper_models = {}  # Cache for Whisper models
 processing_tasks = {}  # Track processing status
 
+# === METRICS ===
+
+# /metrics theo Prometheus text format: histogram latency từng stage, counter retry/fallback,
+# gauge đọc trạng thái hiện tại lúc scrape
+METRICS_CONFIG = {
+    'namespace': 'video_subtitle',
+    'short_buckets': (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),                 # TTS segment, analysis
+    'long_buckets': (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),            # upload, extract, encode
+    'rate_buckets': (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)       # giây xử lý / phút audio
+}
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = f"{METRICS_CONFIG['namespace']}_{name}"
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        return []
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, key, extra)} {value:g}")
+        return lines
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [('', key, None, value) for key, value in sorted(self.values.items())]
+
+class Gauge(_Metric):
+    """Gauge tính lúc scrape: collect() trả về {label values tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect, labels=()):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} collect failed: {e}")
+            return []
+        return [('', tuple(str(v) for v in key), None, value) for key, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=None):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets or METRICS_CONFIG['short_buckets'])
+        self.values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Context manager / decorator đo thời gian (giây) của một block"""
+        return _HistogramTimer(self, labels)
+
+    def samples(self):
+        rows = []
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    rows.append(('_bucket', key, [('le', f'{bound:g}')], count))
+                rows.append(('_bucket', key, [('le', '+Inf')], series[-1]))
+                rows.append(('_sum', key, None, series[-2]))
+                rows.append(('_count', key, None, series[-1]))
+        return rows
+
+class _HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+        return False
+
+    def __call__(self, func):
+        def wrapper(*args, **kwargs):
+            with _HistogramTimer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, collect, labels=()):
+        return self.register(Gauge(name, help_text, collect, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=None):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+UPLOAD_SECONDS = metrics.histogram('upload_seconds', 'Time to receive and store an uploaded video',
+                                   buckets=METRICS_CONFIG['long_buckets'])
+AUDIO_EXTRACTION_SECONDS = metrics.histogram('audio_extraction_seconds', 'Time to extract audio from a video',
+                                             buckets=METRICS_CONFIG['long_buckets'])
+MODEL_LOAD_SECONDS = metrics.histogram('whisper_model_load_seconds', 'Time to load a Whisper model into memory',
+                                       labels=('backend', 'model'), buckets=METRICS_CONFIG['long_buckets'])
+TRANSCRIPTION_SECONDS_PER_AUDIO_MINUTE = metrics.histogram(
+    'transcription_seconds_per_audio_minute', 'Transcription wall time per minute of audio',
+    labels=('backend', 'model', 'precision'), buckets=METRICS_CONFIG['rate_buckets'])
+TTS_SEGMENT_SECONDS = metrics.histogram('tts_segment_seconds', 'Latency of one successful TTS provider request',
+                                        labels=('provider',))
+TIMELINE_MIX_SECONDS = metrics.histogram('timeline_mix_seconds', 'Time to mix voiced segments into the timeline',
+                                         labels=('method',))
+LOUDNESS_ANALYSIS_SECONDS = metrics.histogram('loudness_analysis_seconds', 'Time to analyze audio levels')
+FINAL_ENCODE_SECONDS = metrics.histogram('final_encode_seconds', 'Time of the final video render',
+                                         buckets=METRICS_CONFIG['long_buckets'])
+FFMPEG_SECONDS = metrics.histogram('ffmpeg_seconds', 'Run time of ffmpeg/ffprobe processes',
+                                   labels=('job_class',), buckets=METRICS_CONFIG['long_buckets'])
+FFMPEG_KILLS_TOTAL = metrics.counter('ffmpeg_kills_total', 'ffmpeg processes killed by the watchdog',
+                                     labels=('job_class', 'reason'))
+RETRIES_TOTAL = metrics.counter('retries_total', 'Retried operations', labels=('kind',))
+FALLBACKS_TOTAL = metrics.counter('fallbacks_total', 'Operations that fell back to a slower path', labels=('kind',))
+
+# === JOB TIMELINE ===
+
+# Waterfall từng task trong processing_tasks[task_id]['timeline']: mỗi stage ghi thời gian,
+# CPU, peak RSS, I/O và số subprocess; giữ lại sau khi task xong để tìm video chậm và lý do
+JOB_TIMELINE_CONFIG = {
+    'rss_sample_interval': 0.5   # Chu kỳ lấy mẫu RSS của process khi có stage đang chạy
+}
+
+_job_context = threading.local()  # Stage hiện tại của worker thread
+_active_job_stages = {}  # id(context) -> context, cho RSS sampler
+_active_job_stages_lock = threading.Lock()
+_rss_sampler = {'thread': None}
+
+def _read_proc_io(path):
+    """(rchar, wchar) từ /proc/.../io: byte đọc/ghi qua syscall, kể cả page cache; (0, 0) nếu không có"""
+    try:
+        with open(path) as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines() if ': ' in line)
+        return int(fields.get('rchar', 0)), int(fields.get('wchar', 0))
+    except (OSError, ValueError):
+        return 0, 0
+
+def _process_peak_rss_mb(pid):
+    """VmHWM của process con (reset khi exec, nên không tính image Python lúc fork); 0 nếu không đọc được"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0.0
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+def _sample_job_rss():
+    while True:
+        time.sleep(JOB_TIMELINE_CONFIG['rss_sample_interval'])
+        with _active_job_stages_lock:
+            stages = list(_active_job_stages.values())
+        if not stages:
+            continue
+        rss = round(_current_rss_mb(), 1)
+        for stage in stages:
+            stage['record']['peak_rss_mb'] = max(stage['record']['peak_rss_mb'], rss)
+
+def _thread_io_path():
+    return f'/proc/self/task/{threading.get_native_id()}/io'
+
+def mark_job_stage(task_id, stage, job=None):
+    """
+    Bắt đầu stage mới của task trên thread hiện tại (stage trước của thread được đóng lại).
+    job: request của stage (generate_subtitles, create_final_video, ...); None = giữ job của stage trước.
+
+    Stage ghi: start/end (giây từ lúc tạo task), cpu_seconds (CPU của thread này),
+    peak_rss_mb (RSS của process, lấy mẫu), read/write_bytes (thread + ffmpeg con),
+    subprocesses và CPU / peak RSS của chúng.
+    """
+    task = processing_tasks.get(task_id)
+    if task is None:
+        return
+    previous = getattr(_job_context, 'stage', None)
+    if job is None:
+        job = previous['record']['job'] if previous else 'job'
+    finish_job_stage()
+    profiler = getattr(_job_context, 'profiler', None)
+    if profiler is not None:
+        profiler.stage_boundary(stage)
+    timeline = task.setdefault('timeline', {'stages': [], 'totals': {}})
+    now = time.time()
+    rss = round(_current_rss_mb(), 1)
+    record = {
+        'job': job,
+        'stage': stage,
+        'status': 'running',
+        'start': round(now - task.get('created_at', now), 3),
+        'end': None,
+        'seconds': None,
+        'cpu_seconds': None,
+        'peak_rss_mb': rss,
+        'read_bytes': 0,
+        'write_bytes': 0,
+        'subprocesses': 0,
+        'subprocess_cpu_seconds': 0.0,
+        'subprocess_peak_rss_mb': 0.0
+    }
+    timeline['stages'].append(record)
+    read_bytes, write_bytes = _read_proc_io(_thread_io_path())
+    context = {
+        'task': task, 'record': record, 'started': now, 'cpu': time.thread_time(),
+        'read_bytes': read_bytes, 'write_bytes': write_bytes
+    }
+    _job_context.stage = context
+    with _active_job_stages_lock:
+        _active_job_stages[id(context)] = context
+        if _rss_sampler['thread'] is None:
+            _rss_sampler['thread'] = threading.Thread(target=_sample_job_rss, daemon=True)
+            _rss_sampler['thread'].start()
+
+def finish_job_stage(error=None):
+    """Đóng stage đang chạy của thread hiện tại (error: stage lỗi)"""
+    context = getattr(_job_context, 'stage', None)
+    if context is None:
+        return
+    _job_context.stage = None
+    with _active_job_stages_lock:
+        _active_job_stages.pop(id(context), None)
+    record = context['record']
+    now = time.time()
+    read_bytes, write_bytes = _read_proc_io(_thread_io_path())
+    record.update({
+        'status': 'error' if error else 'done',
+        'end': round(record['start'] + now - context['started'], 3),
+        'seconds': round(now - context['started'], 3),
+        'cpu_seconds': round(time.thread_time() - context['cpu'], 3),
+        'peak_rss_mb': max(record['peak_rss_mb'], round(_current_rss_mb(), 1)),
+        'read_bytes': record['read_bytes'] + max(0, read_bytes - context['read_bytes']),
+        'write_bytes': record['write_bytes'] + max(0, write_bytes - context['write_bytes'])
+    })
+    if error:
+        record['error'] = str(error)[:200]
+    stages = [s for s in context['task']['timeline']['stages'] if s['seconds'] is not None]
+    context['task']['timeline']['totals'] = {
+        'seconds': round(sum(s['seconds'] for s in stages), 3),
+        'cpu_seconds': round(sum(s['cpu_seconds'] + s['subprocess_cpu_seconds'] for s in stages), 3),
+        'peak_rss_mb': max(s['peak_rss_mb'] for s in stages),
+        'read_bytes': sum(s['read_bytes'] for s in stages),
+        'write_bytes': sum(s['write_bytes'] for s in stages),
+        'subprocesses': sum(s['subprocesses'] for s in stages),
+        'slowest_stage': max(stages, key=lambda s: s['seconds'])['stage']
+    }
+
+def record_job_subprocess(cpu_seconds, peak_rss_mb, read_bytes, write_bytes):
+    """Cộng usage của một process con (ffmpeg) vào stage đang chạy của thread hiện tại"""
+    context = getattr(_job_context, 'stage', None)
+    if context is None:
+        return
+    record = context['record']
+    record['subprocesses'] += 1
+    record['subprocess_cpu_seconds'] = round(record['subprocess_cpu_seconds'] + cpu_seconds, 3)
+    record['subprocess_peak_rss_mb'] = max(record['subprocess_peak_rss_mb'], round(peak_rss_mb, 1))
+    record['read_bytes'] += read_bytes
+    record['write_bytes'] += write_bytes
+
+# === JOB PROFILING ===
+
+# Flag 'profile' trong JSON của generate_subtitles / create_final_video: chạy background thread của job
+# dưới sampling profiler (+ cProfile nếu profile='cprofile') và chụp tracemalloc ở mỗi stage boundary
+PROFILING_CONFIG = {
+    'sample_interval': 0.01,    # Giây giữa hai lần lấy mẫu stack
+    'max_stack_depth': 64,
+    'tracemalloc_frames': 1,    # Chỉ cần dòng cấp phát cho top allocators
+    'top_allocators': 10,       # Số dòng cấp phát nhiều nhất mỗi stage
+    'top_functions': 15         # Số hàm (self samples) trong tóm tắt trên task
+}
+PROFILE_MODES = {'sampling', 'cprofile'}
+
+_tracemalloc_users = {'count': 0, 'owned': False}
+_tracemalloc_lock = threading.Lock()
+
+def _tracemalloc_acquire():
+    import tracemalloc
+    with _tracemalloc_lock:
+        if _tracemalloc_users['count'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_CONFIG['tracemalloc_frames'])
+            _tracemalloc_users['owned'] = True
+        _tracemalloc_users['count'] += 1
+
+def _tracemalloc_release():
+    import tracemalloc
+    with _tracemalloc_lock:
+        _tracemalloc_users['count'] -= 1
+        if _tracemalloc_users['count'] == 0 and _tracemalloc_users['owned']:
+            tracemalloc.stop()
+            _tracemalloc_users['owned'] = False
+
+class JobProfiler:
+    """
+    Profiles one job's background thread.
+
+    - A sampler thread reads sys._current_frames() for the job thread every
+      sample_interval and counts collapsed stacks (flamegraph.pl / speedscope format).
+    - mode='cprofile' additionally runs cProfile in the job thread and dumps pstats.
+    - tracemalloc snapshots at each mark_job_stage boundary give the top allocating
+      lines per stage.
+    """
+
+    def __init__(self, task_id, job, mode='sampling'):
+        self.task_id = task_id
+        self.job = job
+        self.mode = mode
+        self.stacks = {}
+        self.samples = 0
+        self.stage = 'start'
+        self.stage_allocations = []
+        self.stop_event = threading.Event()
+        self.thread_id = None
+        self.cprofile = None
+        self.snapshot = None
+
+    def _frame_label(self, frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+    def _sample(self):
+        interval = PROFILING_CONFIG['sample_interval']
+        while not self.stop_event.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None and len(labels) < PROFILING_CONFIG['max_stack_depth']:
+                labels.append(self._frame_label(frame))
+                frame = frame.f_back
+            key = ';'.join(reversed(labels))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def start(self):
+        """Gọi trong thread của job"""
+        import tracemalloc
+        self.thread_id = threading.get_ident()
+        _tracemalloc_acquire()
+        self.snapshot = tracemalloc.take_snapshot()
+        if self.mode == 'cprofile':
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+        _job_context.profiler = self
+
+    def stage_boundary(self, next_stage):
+        """Snapshot tracemalloc: cấp phát từ boundary trước được tính cho stage vừa kết thúc"""
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        top = [stat for stat in snapshot.compare_to(self.snapshot, 'lineno')
+               if stat.size_diff and stat.traceback[0].filename != tracemalloc.__file__]
+        self.stage_allocations.append({
+            'stage': self.stage,
+            'traced_mb': round(traced / (1024 * 1024), 2),
+            'traced_peak_mb': round(peak / (1024 * 1024), 2),
+            'top_allocators': [{
+                'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size_diff_kb': round(stat.size_diff / 1024, 1),
+                'count_diff': stat.count_diff
+            } for stat in top[:PROFILING_CONFIG['top_allocators']]]
+        })
+        self.snapshot = snapshot
+        self.stage = next_stage
+
+    def stop(self):
+        """Dừng profiler, ghi artifacts cạnh output của task và tóm tắt vào processing_tasks[task_id]['profile']"""
+        _job_context.profiler = None
+        self.stop_event.set()
+        self.sampler.join(timeout=5)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        try:
+            self.stage_boundary(None)
+        finally:
+            _tracemalloc_release()
+
+        prefix = os.path.join(app.config['OUTPUT_FOLDER'], f"{self.task_id}_profile_{self.job}")
+        artifacts = {'profile_stacks': f"{prefix}.collapsed", 'profile_allocations': f"{prefix}_alloc.json"}
+        with open(artifacts['profile_stacks'], 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        with open(artifacts['profile_allocations'], 'w', encoding='utf-8') as f:
+            json.dump(self.stage_allocations, f, indent=2, ensure_ascii=False)
+        if self.cprofile is not None:
+            artifacts['profile_pstats'] = f"{prefix}.pstats"
+            self.cprofile.dump_stats(artifacts['profile_pstats'])
+
+        self_samples = {}
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            self_samples[leaf] = self_samples.get(leaf, 0) + count
+        top_functions = sorted(self_samples.items(), key=lambda item: -item[1])[:PROFILING_CONFIG['top_functions']]
+        task = processing_tasks.get(self.task_id)
+        if task is not None:
+            task.update({f"{key}_path": path for key, path in artifacts.items()})
+            task['profile'] = {
+                'job': self.job,
+                'mode': self.mode,
+                'samples': self.samples,
+                'sample_interval': PROFILING_CONFIG['sample_interval'],
+                'top_functions': [{'function': name, 'samples': count,
+                                   'percent': round(100.0 * count / self.samples, 1) if self.samples else 0.0}
+                                  for name, count in top_functions],
+                'stage_allocations': [{'stage': entry['stage'], 'traced_mb': entry['traced_mb'],
+                                       'traced_peak_mb': entry['traced_peak_mb'],
+                                       'top_allocator': entry['top_allocators'][0] if entry['top_allocators'] else None}
+                                      for entry in self.stage_allocations],
+                'artifacts': {key: os.path.basename(path) for key, path in artifacts.items()}
+            }
+        logger.info(f"🔬 Profile for {self.job} ({self.task_id}): {self.samples} samples, artifacts: {list(artifacts)}")
+
+def resolve_profile_mode(value):
+    """Flag 'profile' của request → None / 'sampling' / 'cprofile'"""
+    if not value:
+        return None
+    # Giá trị truthy khác (True, 1, list...) → sampling; kiểm tra str trước để list/dict không lỗi unhashable
+    if isinstance(value, str) and value in PROFILE_MODES:
+        return value
+    return 'sampling'
+
+def run_profiled(task_id, job, profile_mode, target):
+    """Thread target: chạy target() dưới JobProfiler khi request bật profile"""
+    if not profile_mode:
+        return target()
+    profiler = JobProfiler(task_id, job, profile_mode)
+    profiler.start()
+    try:
+        return target()
+    finally:
+        try:
+            profiler.stop()
+        except Exception as e:
+            logger.error(f"Profiler failed for task {task_id}: {e}")
+
+# === TUNING PROFILE ===
+
+CPU_CONFIG_PATH = 'cpu_config.json'
+
+def load_cpu_config(config_path=CPU_CONFIG_PATH):
+    """Đọc cpu_config.json (optimize_cpu.py / autotune.py, xem cpu_config.example.json), trả về {} nếu không có"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not read {config_path}: {e}")
+        return {}
+
+# Đọc một lần lúc khởi động: ffmpeg_threads, max_concurrent_processes, render_parallelism,
+# tts_concurrency, whisper_cpu được áp dụng vào các config bên dưới (xem /api/tuning)
+CPU_PROFILE = load_cpu_config()
+
+# === FFMPEG EXECUTOR ===
+
+# Mọi lần chạy ffmpeg/ffprobe đi qua run_ffmpeg: đọc -progress để báo % + ETA, chỉ giữ phần cuối stderr
+FFMPEG_CONFIG = {
+    'stderr_tail_lines': 200,   # Số dòng stderr cuối cùng được giữ lại để chẩn đoán
+    'progress_interval': 0.5,   # Cập nhật processing_tasks tối đa 2 lần/giây
+    'watchdog_interval': 1.0,
+    # Giới hạn chung cho các job nặng (class có global_slot)
+    'max_processes': int(os.getenv('FFMPEG_MAX_PROCESSES', CPU_PROFILE.get('max_concurrent_processes',
+                                                                       max(2, (os.cpu_count() or 2) // 2)))),
+    # -threads cho các job nặng (None: để ffmpeg tự chọn theo số core)
+    'threads': CPU_PROFILE.get('ffmpeg_threads')
+}
+
+# Class của job: giới hạn đồng thời, độ ưu tiên CPU (nice), timeout = base + per_media_second * thời lượng,
+# watchdog kill process khi out_time không tăng trong stall_seconds
+FFMPEG_JOB_CLASSES = {
+    # ffprobe: ngắn, không chiếm slot chung để request không phải chờ sau các lần render
+    'probe':       {'max_concurrent': 8, 'nice': 0,  'base_timeout': 30,  'per_media_second': 0.0, 'stall_seconds': None, 'global_slot': False},
+    # Job nhỏ mà request đang chờ (chuyển SRT → ASS, copy, tạo nền im lặng): ưu tiên cao
+    'interactive': {'max_concurrent': 4, 'nice': 0,  'base_timeout': 60,  'per_media_second': 0.5, 'stall_seconds': 30,   'global_slot': False},
+    'audio':       {'max_concurrent': 4, 'nice': 5,  'base_timeout': 60,  'per_media_second': 1.0, 'stall_seconds': 60,   'global_slot': True},
+    'analysis':    {'max_concurrent': 4, 'nice': 5,  'base_timeout': 60,  'per_media_second': 1.0, 'stall_seconds': 60,   'global_slot': True},
+    # Export video cuối: batch, nice thấp nhất để không làm chậm API / TTS (max_concurrent: render_parallelism)
+    'render':      {'max_concurrent': int(CPU_PROFILE.get('render_parallelism', 2)), 'nice': 10, 'base_timeout': 300, 'per_media_second': 8.0, 'stall_seconds': 120,  'global_slot': True}
+}
+
+class FFmpegStalledError(subprocess.TimeoutExpired):
+    """ffmpeg bị watchdog kill vì out_time không tăng (callers bắt TimeoutExpired vẫn xử lý được)"""
+
+# Option của ffmpeg không nhận giá trị (mọi option khác nhận đúng một giá trị)
+FFMPEG_FLAG_OPTIONS = {'-y', '-n', '-nostdin', '-hide_banner', '-nostats', '-stats', '-shortest',
+                       '-an', '-vn', '-sn', '-dn', '-re', '-copyts'}
+
+def _ffmpeg_output_index(cmd):
+    """Index của output cuối cùng trong lệnh ffmpeg (argument không phải option / giá trị option)"""
+    output_index, k = None, 1
+    while k < len(cmd):
+        arg = cmd[k]
+        if arg.startswith('-') and arg != '-':
+            k += 1 if arg in FFMPEG_FLAG_OPTIONS else 2
+        else:
+            output_index = k
+            k += 1
+    return output_index
+
+FFMPEG_DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+class FFmpegResult:
+    """Kết quả của run_ffmpeg (giống CompletedProcess, stderr chỉ là phần cuối)"""
+
+    def __init__(self, args, returncode, stdout, stderr, elapsed, progress=None, queued_seconds=0.0):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.progress = progress or {}
+        self.queued_seconds = queued_seconds
+
+def probe_media_duration(path):
+    """Thời lượng (giây) của file media qua ffprobe; None nếu không đọc được"""
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', path]
+    try:
+        result = run_ffmpeg(cmd, job_class='probe')
+        return float(result.stdout.strip())
+    except (ValueError, subprocess.SubprocessError, OSError):
+        return None
+
+def _first_input_duration(cmd):
+    """Thời lượng input file đầu tiên của lệnh ffmpeg (bỏ qua input lavfi)"""
+    for k, arg in enumerate(cmd[:-1]):
+        if arg == '-i' and not (k >= 2 and cmd[k - 2] == '-f' and cmd[k - 1] == 'lavfi') and os.path.isfile(cmd[k + 1]):
+            return probe_media_duration(cmd[k + 1])
+    return None
+
+def _report_ffmpeg_progress(task_id, progress_range, step, state, duration, elapsed):
+    """Map out_time của ffmpeg lên progress của task, kèm ETA"""
+    out_time = state.get('out_time', 0.0)
+    fraction = min(1.0, out_time / duration) if duration else None
+    speed = state.get('speed')
+    eta = None
+    if fraction is not None and fraction < 1.0:
+        if speed:
+            eta = (duration - out_time) / speed
+        elif fraction > 0:
+            eta = elapsed * (1 - fraction) / fraction
+    info = {
+        'stage': step,
+        'out_time': round(out_time, 2),
+        'duration': round(duration, 2) if duration else None,
+        'fps': state.get('fps'),
+        'speed': speed,
+        'elapsed_seconds': round(elapsed, 1),
+        'eta_seconds': round(eta, 1) if eta is not None else None
+    }
+    update = {'ffmpeg_progress': info}
+    if progress_range and fraction is not None:
+        start, end = progress_range
+        update['progress'] = round(start + (end - start) * fraction, 1)
+        eta_text = f", ETA {format_timestamp(eta)[:8]}" if eta is not None else ''
+        update['current_step'] = f"{step} {fraction * 100:.0f}%{eta_text}"
+    processing_tasks[task_id].update(update)
+
+class FFmpegExecutor:
+    """
+    Runs every ffmpeg/ffprobe process of the app.
+
+    - Concurrency: one semaphore per job class plus a global cap for heavy classes.
+    - Priority: each class has a niceness (batch renders yield CPU to interactive work).
+    - Timeouts scale with media duration instead of fixed 30/300/600 s.
+    - A watchdog kills tracked processes whose progress (out_time) stops advancing.
+    """
+
+    def __init__(self, config=None, job_classes=None):
+        self.config = config or FFMPEG_CONFIG
+        self.job_classes = job_classes or FFMPEG_JOB_CLASSES
+        self.global_slots = threading.BoundedSemaphore(self.config['max_processes'])
+        self.class_slots = {name: threading.BoundedSemaphore(cls['max_concurrent'])
+                            for name, cls in self.job_classes.items()}
+        self.lock = threading.Lock()
+        self.active = {name: 0 for name in self.job_classes}
+        self.queued = {name: 0 for name in self.job_classes}
+        self.counters = {'started': 0, 'failed': 0, 'timeouts': 0, 'stalls': 0}
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'max_processes': self.config['max_processes'],
+                'active': dict(self.active),
+                'queued': dict(self.queued),
+                **self.counters
+            }
+
+    def _timeout_for(self, cls, media_duration):
+        return cls['base_timeout'] + cls['per_media_second'] * (media_duration or 0)
+
+    def run(self, cmd, task_id=None, progress_range=None, step=None, duration=None, timeout=None,
+            input=None, text=True, job_class=None):
+        """
+        Run ffmpeg/ffprobe; ffmpeg gets -progress pipe:1 and reports progress/ETA on a task.
+
+        Args:
+            task_id: task whose progress/current_step/ffmpeg_progress are updated (optional)
+            progress_range: (start, end) task progress mapped onto 0..100% of the encode
+            step: label shown in current_step
+            duration: media duration in seconds (default: ffprobe of the first file input,
+                then the first 'Duration:' line ffmpeg logs)
+            timeout: hard limit override; default is proportional to the media duration
+            input: bytes written to stdin
+            job_class: key of FFMPEG_JOB_CLASSES (default: probe for ffprobe, audio otherwise)
+
+        Returns:
+            FFmpegResult with returncode, stdout, the last FFMPEG_CONFIG['stderr_tail_lines']
+            lines of stderr and the last progress snapshot
+
+        Raises:
+            subprocess.TimeoutExpired (FFmpegStalledError when progress stalled)
+        """
+        cmd = list(cmd)
+        program = os.path.basename(cmd[0])
+        job_class = job_class or ('probe' if program == 'ffprobe' else 'audio')
+        cls = self.job_classes[job_class]
+        if program == 'ffmpeg':
+            # -f null - : ghi ra devnull thay vì stdout để stdout dùng được cho -progress
+            for k in range(2, len(cmd)):
+                if cmd[k] == '-' and cmd[k - 2:k] == ['-f', 'null']:
+                    cmd[k] = os.devnull
+        if program == 'ffmpeg' and cls['global_slot'] and self.config.get('threads') and '-threads' not in cmd:
+            output_index = _ffmpeg_output_index(cmd)
+            if output_index is not None:
+                # Output option: phải đứng trước output (sau output ffmpeg bỏ qua: "Trailing option(s)")
+                cmd[output_index:output_index] = ['-threads', str(self.config['threads'])]
+        # Lệnh ghi output ra stdout (pipe:1 / -) không dùng được stdout cho -progress
+        track = program == 'ffmpeg' and 'pipe:1' not in cmd and '-' not in cmd[1:]
+        if track:
+            cmd[1:1] = ['-progress', 'pipe:1', '-nostats']
+            if duration is None and task_id is not None:
+                duration = _first_input_duration(cmd)
+        step = step or 'FFmpeg'
+
+        queue_start = time.monotonic()
+        with self.lock:
+            self.queued[job_class] += 1
+        self.class_slots[job_class].acquire()
+        if cls['global_slot']:
+            self.global_slots.acquire()
+        with self.lock:
+            self.queued[job_class] -= 1
+            self.active[job_class] += 1
+            self.counters['started'] += 1
+        queued_seconds = time.monotonic() - queue_start
+        try:
+            result = self._execute(cmd, cls, track, task_id, progress_range, step, duration, timeout, input, text)
+        except subprocess.TimeoutExpired as e:
+            reason = 'stalls' if isinstance(e, FFmpegStalledError) else 'timeouts'
+            with self.lock:
+                self.counters[reason] += 1
+            FFMPEG_KILLS_TOTAL.inc(job_class=job_class, reason=reason)
+            raise
+        finally:
+            with self.lock:
+                self.active[job_class] -= 1
+            if cls['global_slot']:
+                self.global_slots.release()
+            self.class_slots[job_class].release()
+        if result.returncode != 0:
+            with self.lock:
+                self.counters['failed'] += 1
+        FFMPEG_SECONDS.observe(result.elapsed, job_class=job_class)
+        result.queued_seconds = queued_seconds
+        return result
+
+    def _execute(self, cmd, cls, track, task_id, progress_range, step, duration, timeout, input, text):
+        started = time.time()
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if cls['nice'] and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, process.pid, cls['nice'])
+            except OSError:
+                pass  # Process đã kết thúc hoặc không đủ quyền
+        stderr_tail = deque(maxlen=self.config['stderr_tail_lines'])
+        state = {'last_advance': time.monotonic()}
+
+        def drain_stderr():
+            for line in process.stderr:
+                line = line.decode('utf-8', errors='replace').rstrip()
+                stderr_tail.append(line)
+                # Không có ffprobe / duration: lấy Duration của input đầu tiên từ log của ffmpeg
+                if 'input_duration' not in state:
+                    match = FFMPEG_DURATION_PATTERN.search(line)
+                    if match:
+                        hours, minutes, seconds = match.groups()
+                        state['input_duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+        def feed_stdin():
+            try:
+                process.stdin.write(input)
+            except (BrokenPipeError, OSError):
+                pass
+            finally:
+                process.stdin.close()
+
+        finished = threading.Event()
+        killed = {}
+
+        def watchdog():
+            while not finished.wait(self.config['watchdog_interval']):
+                state['peak_rss_mb'] = max(state.get('peak_rss_mb', 0.0), _process_peak_rss_mb(process.pid))
+                now = time.monotonic()
+                limit = timeout if timeout is not None else self._timeout_for(cls, duration or state.get('input_duration'))
+                if now - started_monotonic > limit:
+                    killed['reason'], killed['limit'] = 'timeout', limit
+                elif track and cls['stall_seconds'] and now - state['last_advance'] > cls['stall_seconds']:
+                    killed['reason'], killed['limit'] = 'stall', cls['stall_seconds']
+                else:
+                    continue
+                logger.warning(f"⏱️ Killing ffmpeg ({killed['reason']} after {killed['limit']:.0f}s): {' '.join(cmd[:6])}...")
+                process.kill()
+                return
+
+        started_monotonic = time.monotonic()
+        watchdog_thread = threading.Thread(target=watchdog, daemon=True)
+        helpers = [threading.Thread(target=drain_stderr, daemon=True), watchdog_thread]
+        if input is not None:
+            helpers.append(threading.Thread(target=feed_stdin, daemon=True))
+        for helper in helpers:
+            helper.start()
+
+        stdout_data, usage = b'', None
+        try:
+            if track:
+                last_report = 0.0
+                for raw in process.stdout:
+                    key, _, value = raw.decode('utf-8', errors='replace').strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit():
+                        out_time = int(value) / 1e6
+                        if out_time > state.get('out_time', -1.0):
+                            state['last_advance'] = time.monotonic()
+                        state['out_time'] = out_time
+                    elif key == 'fps':
+                        state['fps'] = float(value) if value.replace('.', '', 1).isdigit() else None
+                    elif key == 'speed':
+                        speed = value.rstrip('x')
+                        state['speed'] = float(speed) if speed.replace('.', '', 1).isdigit() else None
+                    elif key == 'progress':
+                        now = time.time()
+                        if task_id is not None and (value == 'end' or now - last_report >= self.config['progress_interval']):
+                            _report_ffmpeg_progress(task_id, progress_range, step, state,
+                                                    duration or state.get('input_duration'), now - started)
+                            last_report = now
+            else:
+                stdout_data = process.stdout.read()
+            usage = self._reap_with_usage(process, finished, watchdog_thread)
+        finally:
+            finished.set()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            for helper in helpers:
+                helper.join(timeout=5)
+
+        if usage:
+            rusage, (read_bytes, write_bytes) = usage
+            record_job_subprocess(rusage.ru_utime + rusage.ru_stime, state.get('peak_rss_mb', 0.0), read_bytes, write_bytes)
+        else:
+            record_job_subprocess(0.0, state.get('peak_rss_mb', 0.0), 0, 0)
+
+        stderr = '\n'.join(stderr_tail)
+        if killed.get('reason') == 'stall':
+            raise FFmpegStalledError(cmd, killed['limit'], stderr=stderr)
+        if killed.get('reason') == 'timeout':
+            raise subprocess.TimeoutExpired(cmd, killed['limit'], stderr=stderr)
+        progress = {k: v for k, v in state.items() if k not in ('last_advance', 'peak_rss_mb')}
+        return FFmpegResult(cmd, process.returncode, stdout_data.decode('utf-8', errors='replace') if text else stdout_data,
+                            stderr if text else stderr.encode('utf-8'), time.time() - started, progress)
+
+    def _reap_with_usage(self, process, finished, watchdog_thread):
+        """
+        Wait for the process and return (rusage, (read_bytes, write_bytes)) for the job timeline.
+
+        The exited process is kept as a zombie (WNOWAIT) while /proc/<pid>/io is read and the
+        watchdog is stopped, then reaped with os.wait4; None where that is unavailable.
+        """
+        usage = None
+        if hasattr(os, 'wait4'):
+            try:
+                os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+                finished.set()
+                watchdog_thread.join()
+                io = _read_proc_io(f'/proc/{process.pid}/io')
+                _, status, rusage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                usage = (rusage, io)
+            except ChildProcessError:
+                pass  # Watchdog đã reap process qua Popen.kill()/poll()
+        process.wait()
+        return usage
+
+ffmpeg_executor = FFmpegExecutor()
+
+def run_ffmpeg(cmd, task_id=None, progress_range=None, step=None, duration=None, timeout=None,
+               input=None, text=True, job_class=None):
+    """Chạy ffmpeg/ffprobe qua executor chung (xem FFmpegExecutor.run)"""
+    return ffmpeg_executor.run(cmd, task_id, progress_range, step, duration, timeout, input, text, job_class)
+
+# === IN-PROCESS AUDIO LAYER ===
+
+# Decode / resample trong process (soundfile + librosa, pydub làm fallback decode)
+# thay cho một lần gọi ffmpeg cho mỗi segment; tempo dùng atempo (WSOLA) qua ffmpeg pipe
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+def _conform_channels(samples, channels):
+    """(n, c) → (n, channels): mono nhân đôi, nhiều kênh lấy trung bình"""
+    if samples.shape[1] == channels:
+        return samples
+    mono = samples.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1) if channels > 1 else mono
+
+def resample_audio(samples, orig_sr, target_sr):
+    """Resample PCM float32 (n, c) bằng librosa (soxr); thiếu librosa thì nội suy tuyến tính"""
+    if orig_sr == target_sr or len(samples) == 0:
+        return samples
+    try:
+        import librosa
+    except ImportError:
+        positions = np.arange(int(round(len(samples) * target_sr / orig_sr))) * (orig_sr / target_sr)
+        return np.stack([np.interp(positions, np.arange(len(samples)), samples[:, ch])
+                         for ch in range(samples.shape[1])], axis=1).astype(np.float32)
+    resampled = librosa.resample(np.ascontiguousarray(samples.T), orig_sr=orig_sr, target_sr=target_sr)
+    return np.ascontiguousarray(resampled.T, dtype=np.float32)
+
+def atempo_filter(rate):
+    """Chuỗi atempo cho rate bất kỳ (ffmpeg cũ chỉ nhận 0.5-2.0 mỗi filter)"""
+    factors = []
+    while rate > 2.0:
+        factors.append(2.0)
+        rate /= 2.0
+    while rate < 0.5:
+        factors.append(0.5)
+        rate /= 0.5
+    factors.append(rate)
+    return ','.join(f'atempo={factor:.6g}' for factor in factors)
+
+def change_tempo(samples, sample_rate, rate):
+    """
+    Đổi tốc độ nói không đổi cao độ bằng atempo (WSOLA, không bị "phasey" như phase vocoder),
+    PCM đi qua ffmpeg pipe, không file tạm. Gọi trước khi nhân kênh để chỉ stretch audio mono gốc.
+    """
+    if abs(rate - 1.0) < 1e-3 or len(samples) == 0:
+        return samples
+    channels = samples.shape[1]
+    cmd = [
+        'ffmpeg', '-v', 'error', '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+        '-filter:a', atempo_filter(rate), '-f', 'f32le', 'pipe:1'
+    ]
+    result = run_ffmpeg(cmd, input=np.ascontiguousarray(samples, dtype=np.float32).tobytes(), text=False)
+    if result.returncode != 0:
+        raise Exception(f"atempo failed: {result.stderr.decode(errors='ignore')[-200:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels).copy()
+
+def decode_audio_bytes(data, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Decode MP3/WAV/OGG bytes của provider thành PCM float32 (n, channels) ở sample_rate
+    (channels=None giữ số kênh gốc)"""
+    import io
+    try:
+        import soundfile as sf
+        samples, source_rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    except Exception as e:
+        # libsndfile cũ không đọc được MP3: pydub (ffmpeg) làm fallback
+        logger.debug(f"soundfile decode failed ({e}), falling back to pydub")
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(io.BytesIO(data))
+        raw = np.array(segment.get_array_of_samples(), dtype=np.float32)
+        samples = raw.reshape(-1, segment.channels) / float(1 << (8 * segment.sample_width - 1))
+        source_rate = segment.frame_rate
+    if channels:
+        samples = _conform_channels(samples, channels)
+    return resample_audio(samples, source_rate, sample_rate)
+
+def decode_audio_pcm(file_path, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Decode file audio thành PCM float32 (samples, channels); ffmpeg pipe chỉ còn là fallback"""
+    try:
+        with open(file_path, 'rb') as f:
+            return decode_audio_bytes(f.read(), sample_rate, channels)
+    except Exception as e:
+        logger.debug(f"In-process decode failed for {file_path} ({e}), using ffmpeg")
+    FALLBACKS_TOTAL.inc(kind='ffmpeg_decode')
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', file_path,
+        '-f', 's16le', '-ac', str(channels), '-ar', str(sample_rate), 'pipe:1'
+    ]
+    result = run_ffmpeg(cmd, text=False)
+    if result.returncode != 0:
+        raise Exception(f"Failed to decode {file_path}: {result.stderr.decode(errors='ignore')[-200:]}")
+    pcm = np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+    return pcm.astype(np.float32) / 32768.0
+
+def write_wav_pcm(output_path, samples, sample_rate=AUDIO_SAMPLE_RATE):
+    """Ghi PCM float32 (samples, channels) ra WAV pcm_s16le"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    with wave.open(output_path, 'wb') as wav_file:
+        wav_file.setnchannels(pcm.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+
+class PCMSink(ABC):
+    """Đích nhận PCM float32 (n, AUDIO_CHANNELS) ở AUDIO_SAMPLE_RATE thay cho file audio tạm"""
+
+    def __init__(self):
+        self.frames = 0
+
+    @abstractmethod
+    def write_pcm(self, samples):
+        """Nhận thêm một chunk PCM"""
+
+    @abstractmethod
+    def reset(self):
+        """Bỏ phần audio đã ghi (request lỗi giữa chừng, chuẩn bị retry)"""
+
+    def commit(self):
+        """Request đã thành công: audio đã ghi không còn bị reset() bỏ đi"""
+
+class BufferSink(PCMSink):
+    """Gom PCM trong memory (batch/split cần toàn bộ audio để cắt/ghép, request hedged)"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def write_pcm(self, samples):
+        self.chunks.append(samples)
+        self.frames += len(samples)
+
+    def reset(self):
+        self.chunks = []
+        self.frames = 0
+
+    def samples(self):
+        if not self.chunks:
+            return np.zeros((0, AUDIO_CHANNELS), dtype=np.float32)
+        return np.concatenate(self.chunks)
+
+def write_audio_output(output, samples):
+    """Ghi PCM vào sink hoặc ra file WAV"""
+    if isinstance(output, PCMSink):
+        output.write_pcm(samples)
+    else:
+        write_wav_pcm(output, samples)
+
+def audio_output_size(output):
+    """Kích thước audio đã ghi (bytes, quy đổi pcm_s16le với sink); 0 nếu chưa có"""
+    if isinstance(output, PCMSink):
+        return output.frames * AUDIO_CHANNELS * 2
+    return os.path.getsize(output) if os.path.exists(output) else 0
+
+def commit_audio_output(output):
+    """Chốt audio của lần thử thành công (sink chỉ đẩy audio ra đích cuối khi commit)"""
+    if isinstance(output, PCMSink):
+        output.commit()
+
+def discard_audio_output(output):
+    """Xoá audio của một lần thử thất bại"""
+    if isinstance(output, PCMSink):
+        output.reset()
+    elif os.path.exists(output):
+        try:
+            os.remove(output)
+        except OSError:
+            pass
+
+class StreamingAudioDecoder:
+    """
+    Decode audio của provider theo từng chunk nhận được.
+
+    PCM thô (pcm_s16le) đi thẳng vào sink ngay khi chunk tới (resample bằng
+    soxr.ResampleStream); định dạng nén (MP3) được gom trong memory và decode một lần
+    khi stream kết thúc. Đích là file thì ghi WAV khi close().
+    """
+
+    def __init__(self, output, source_format='mp3', source_rate=None, source_channels=1, speed=1.0):
+        self.output = output
+        self.source_format = source_format
+        self.source_rate = source_rate
+        self.source_channels = source_channels
+        self.speed = speed
+        self.pending = bytearray()
+        self.resampler = None
+        self.streaming = (source_format == 'pcm_s16le' and isinstance(output, PCMSink)
+                          and abs(speed - 1.0) < 1e-3)
+        if self.streaming and source_rate != AUDIO_SAMPLE_RATE:
+            try:
+                import soxr
+                self.resampler = soxr.ResampleStream(source_rate, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, dtype='float32')
+            except ImportError:
+                self.streaming = False  # Không có soxr: resample cả đoạn khi close()
+
+    def _pcm_to_samples(self, data):
+        pcm = np.frombuffer(data, dtype=np.int16).reshape(-1, self.source_channels)
+        return _conform_channels(pcm.astype(np.float32) / 32768.0, AUDIO_CHANNELS)
+
+    def feed(self, chunk):
+        self.pending.extend(chunk)
+        if not self.streaming:
+            return
+        frame_bytes = 2 * self.source_channels
+        usable = len(self.pending) - len(self.pending) % frame_bytes
+        if usable == 0:
+            return
+        samples = self._pcm_to_samples(bytes(self.pending[:usable]))
+        del self.pending[:usable]
+        if self.resampler is not None:
+            samples = self.resampler.resample_chunk(samples)
+        if len(samples):
+            self.output.write_pcm(np.ascontiguousarray(samples, dtype=np.float32))
+
+    def close(self):
+        """Flush phần còn lại (chạy trong executor: decode MP3 / resample có thể tốn CPU)"""
+        if self.streaming:
+            if self.resampler is not None:
+                tail = self.resampler.resample_chunk(np.zeros((0, AUDIO_CHANNELS), dtype=np.float32), last=True)
+                if len(tail):
+                    self.output.write_pcm(np.ascontiguousarray(tail, dtype=np.float32))
+            return
+        data = bytes(self.pending)
+        self.pending = bytearray()
+        if self.source_format == 'pcm_s16le':
+            pcm = np.frombuffer(data, dtype=np.int16).reshape(-1, self.source_channels)
+            samples = change_tempo(pcm.astype(np.float32) / 32768.0, self.source_rate, self.speed)
+            samples = resample_audio(samples, self.source_rate, AUDIO_SAMPLE_RATE)
+            write_audio_output(self.output, _conform_channels(samples, AUDIO_CHANNELS))
+        else:
+            write_provider_audio(self.output, data, self.speed)
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+def write_provider_audio(output_path, data, speed=1.0):
+    """
+    Lưu audio của TTS provider: PCMSink / file .wav nhận PCM 44.1 kHz stereo đã decode
+    (áp dụng tempo nếu provider không hỗ trợ), định dạng khác ghi nguyên bytes.
+    """
+    if not isinstance(output_path, PCMSink) and not output_path.endswith('.wav'):
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return
+    try:
+        # Stretch ở số kênh gốc (provider trả mono) rồi mới nhân ra AUDIO_CHANNELS
+        samples = change_tempo(decode_audio_bytes(data, channels=None), AUDIO_SAMPLE_RATE, speed)
+        samples = _conform_channels(samples, AUDIO_CHANNELS)
+    except Exception as e:
+        # Thiếu codec: decode + atempo qua ffmpeg pipe (không file tạm)
+        logger.debug(f"In-process provider decode failed ({e}), using ffmpeg pipe")
+        FALLBACKS_TOTAL.inc(kind='ffmpeg_decode')
+        cmd = ['ffmpeg', '-v', 'error', '-i', 'pipe:0']
+        if abs(speed - 1.0) >= 1e-3:
+            cmd += ['-filter:a', atempo_filter(speed)]
+        cmd += ['-f', 's16le', '-ac', str(AUDIO_CHANNELS), '-ar', str(AUDIO_SAMPLE_RATE), 'pipe:1']
+        result = run_ffmpeg(cmd, input=data, text=False)
+        if result.returncode != 0:
+            raise Exception(f"Failed to decode provider audio: {result.stderr.decode(errors='ignore')[-200:]}")
+        pcm = np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, AUDIO_CHANNELS)
+        samples = pcm.astype(np.float32) / 32768.0
+    write_audio_output(output_path, samples)
+
 # === MULTI-AI TTS SYSTEM ===
 
 class TTSProvider(Enum):
@@ -75,6 +1218,7 @@ class TTSProvider(Enum):
     ELEVENLABS = "elevenlabs"
     AZURE_TTS = "azure_tts"
     COQUI_TTS = "coqui_tts"
+    LOCAL_TTS = "local_tts"  # Offline, deterministic (benchmark / load test)
 
 @dataclass
 class Voice:
@@ -87,24 +1231,539 @@ class Voice:
     quality: str = "standard"  # standard, premium, ultra
     description: str = ""
 
+# Provider TTS offline: audio tổng hợp tất định (formant/tone theo từng ký tự), độ dài tỉ lệ với text.
+# Latency và lỗi được "tiêm" có kiểm soát để đo concurrency / retry / mix của pipeline mà không cần mạng
+LOCAL_TTS_CONFIG = {
+    'enabled': os.getenv('LOCAL_TTS', '0') == '1',
+    'sample_rate': 24000,
+    'chars_per_second': float(os.getenv('LOCAL_TTS_CHARS_PER_SECOND', '14')),
+    'latency_mean': float(os.getenv('LOCAL_TTS_LATENCY', '0')),         # Giây / request
+    'latency_jitter': float(os.getenv('LOCAL_TTS_LATENCY_JITTER', '0')),  # ± giây (phân bố đều)
+    'failure_rate': float(os.getenv('LOCAL_TTS_FAILURE_RATE', '0')),      # Tỉ lệ request trả lỗi
+    'throttle_rate': float(os.getenv('LOCAL_TTS_THROTTLE_RATE', '0')),    # Tỉ lệ request bị "429"
+    'max_concurrent': int(os.getenv('LOCAL_TTS_CONCURRENCY', '8')),
+    'seed': int(os.getenv('LOCAL_TTS_SEED', '0'))
+}
+
+# Voice id → (F0 Hz, hệ số formant) của giọng local
+LOCAL_TTS_VOICES = {
+    'local-vi-female': (220.0, 1.15),
+    'local-vi-male': (120.0, 1.0),
+    'local-en-female': (210.0, 1.1),
+    'local-en-male': (115.0, 0.95)
+}
+
+# Formant (F1, F2) xấp xỉ cho nguyên âm; phụ âm là tiếng ồn ngắn, khoảng trắng / dấu câu là lặng
+_LOCAL_TTS_FORMANTS = {'a': (730, 1090), 'e': (530, 1840), 'i': (270, 2290), 'o': (570, 840),
+                       'u': (300, 870), 'y': (270, 2290)}
+
+def local_tts_draw(*key) -> float:
+    """Số [0, 1) tất định theo seed + key (không phụ thuộc thứ tự request giữa các thread)"""
+    digest = hashlib.blake2b(repr((LOCAL_TTS_CONFIG['seed'],) + key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+def synthesize_local_speech(text: str, voice_id: str, speed: float = 1.0) -> np.ndarray:
+    """
+    Tổng hợp PCM int16 mono (LOCAL_TTS_CONFIG['sample_rate']) cho text.
+
+    Cùng (text, voice, speed) luôn cho cùng samples; độ dài ≈ len(text) / (chars_per_second * speed).
+    """
+    import unicodedata
+    rate = LOCAL_TTS_CONFIG['sample_rate']
+    f0, formant_scale = LOCAL_TTS_VOICES.get(voice_id, (160.0, 1.0))
+    char_samples = max(1, int(rate / (LOCAL_TTS_CONFIG['chars_per_second'] * max(speed, 0.1))))
+    rng = np.random.default_rng(int(local_tts_draw('noise', voice_id, text) * 2 ** 32))
+    t = np.arange(char_samples) / rate
+    # Envelope attack/release 5 ms để tránh click giữa các ký tự
+    ramp = min(char_samples // 2, int(0.005 * rate))
+    envelope = np.ones(char_samples)
+    if ramp:
+        envelope[:ramp] = np.linspace(0, 1, ramp)
+        envelope[-ramp:] = np.linspace(1, 0, ramp)
+
+    pieces = []
+    for index, char in enumerate(text):
+        base = unicodedata.normalize('NFD', char.lower())[:1]  # "ế" → "e"
+        if base in _LOCAL_TTS_FORMANTS:
+            f1, f2 = _LOCAL_TTS_FORMANTS[base]
+            pitch = f0 * (1.0 + 0.05 * math.sin(index * 0.7))  # Ngữ điệu nhẹ
+            wave_ = (0.5 * np.sin(2 * np.pi * pitch * t)
+                     + 0.3 * np.sin(2 * np.pi * f1 * formant_scale * t)
+                     + 0.2 * np.sin(2 * np.pi * f2 * formant_scale * t))
+            pieces.append(0.6 * wave_ * envelope)
+        elif base.isalnum():
+            pieces.append(0.15 * rng.standard_normal(char_samples) * envelope)
+        else:
+            pieces.append(np.zeros(char_samples))
+    samples = np.concatenate(pieces) if pieces else np.zeros(char_samples)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+# Connection pool cho từng provider: giữ keep-alive, giới hạn số kết nối đồng thời
+TTS_POOL_CONFIG = {
+    'max_connections': {
+        TTSProvider.EDGE_TTS: 8,      # Websocket đồng thời
+        TTSProvider.OPENAI_TTS: 8,
+        TTSProvider.ELEVENLABS: 4,
+        TTSProvider.LOCAL_TTS: LOCAL_TTS_CONFIG['max_concurrent']
+    },
+    'keepalive_seconds': 60,
+    'request_timeout': 60,
+    'run_timeout': 900  # Giây tối đa cho một lần tts_manager.run (cả retry/backoff của segment)
+}
+
+# Audio TTS được decode thẳng vào slot của segment trên timeline (không file tạm trong temp/)
+TTS_STREAM_CONFIG = {
+    'enabled': os.getenv('TTS_STREAM_TO_TIMELINE', '1') != '0',
+    'chunk_bytes': 8192
+}
+
+# Rate limit + circuit breaker cho từng provider (adaptive theo 429 / lỗi quan sát được)
+TTS_RATE_LIMIT_CONFIG = {
+    'initial_rate': 5.0,          # Request/giây ban đầu
+    'min_rate': 0.2,
+    'max_rate': 20.0,
+    'burst': 5,                   # Dung lượng token bucket
+    'increase_step': 0.25,        # Additive increase sau mỗi request thành công
+    'decrease_factor': 0.5,       # Multiplicative decrease khi bị 429
+    'failure_threshold': 5,       # Lỗi liên tiếp để mở circuit
+    'cooldown_seconds': 15.0,     # Thời gian circuit mở trước khi thử lại (half-open)
+    'max_cooldown_seconds': 120.0
+}
+
+class TTSRateLimitError(Exception):
+    """Provider trả về 429 / throttling"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def parse_retry_after(value) -> Optional[float]:
+    """Retry-After header (giây) → float; dạng HTTP-date bị bỏ qua"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except (TypeError, ValueError):
+        return None
+
+class ProviderRateLimiter:
+    """Token bucket AIMD + circuit breaker (closed → open → half_open) cho một TTS provider"""
+    
+    def __init__(self, provider: TTSProvider, config: dict = None):
+        self.provider = provider
+        self.config = config or TTS_RATE_LIMIT_CONFIG
+        self.rate = self.config['initial_rate']
+        self.tokens = float(self.config['burst'])
+        self.updated = time.monotonic()
+        self.circuit = 'closed'
+        self.opened_until = 0.0
+        self.cooldown = self.config['cooldown_seconds']
+        self.probe_in_flight = False
+        self.consecutive_failures = 0
+        self.counters = {'requests': 0, 'successes': 0, 'failures': 0, 'throttled': 0, 'rejected': 0, 'cancelled': 0,
+                         'circuit_opens': 0}
+        # Có thể được gọi từ nhiều event loop/thread: lock không bao giờ giữ qua await
+        self.lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self.tokens = min(float(self.config['burst']), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def _circuit_blocked(self, now: float) -> bool:
+        if self.circuit == 'open' and now >= self.opened_until:
+            self.circuit = 'half_open'
+            self.probe_in_flight = False
+        return self.circuit == 'open' or (self.circuit == 'half_open' and self.probe_in_flight)
+    
+    def is_open(self) -> bool:
+        with self.lock:
+            return self._circuit_blocked(time.monotonic())
+    
+    async def acquire(self, wait_for_circuit: bool = True) -> bool:
+        """
+        Chờ tới lượt gửi request.
+        
+        Returns:
+            bool: False khi circuit đang mở và wait_for_circuit=False (caller nên defer segment)
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self._circuit_blocked(now):
+                    if not wait_for_circuit:
+                        self.counters['rejected'] += 1
+                        return False
+                    wait = max(self.opened_until - now, 0.5)
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        self.counters['requests'] += 1
+                        if self.circuit == 'half_open':
+                            self.probe_in_flight = True
+                        return True
+                    wait = (1.0 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+    
+    def record_success(self):
+        with self.lock:
+            self.counters['successes'] += 1
+            self.consecutive_failures = 0
+            self.rate = min(self.config['max_rate'], self.rate + self.config['increase_step'])
+            if self.circuit != 'closed':
+                logger.info(f"🟢 TTS circuit closed for {self.provider.value}")
+            self.circuit = 'closed'
+            self.probe_in_flight = False
+            self.cooldown = self.config['cooldown_seconds']
+    
+    def record_failure(self, throttled: bool = False, retry_after: Optional[float] = None):
+        with self.lock:
+            now = time.monotonic()
+            self.counters['failures'] += 1
+            self.consecutive_failures += 1
+            if throttled:
+                self.counters['throttled'] += 1
+                self.rate = max(self.config['min_rate'], self.rate * self.config['decrease_factor'])
+                self._refill(now)
+                # Retry-After: token bucket âm => các request sau tự chờ đủ thời gian
+                self.tokens = -(retry_after or 0.0) * self.rate if retry_after else min(self.tokens, 0.0)
+            
+            if self.circuit == 'half_open' or self.consecutive_failures >= self.config['failure_threshold']:
+                if self.circuit == 'half_open':
+                    self.cooldown = min(self.config['max_cooldown_seconds'], self.cooldown * 2)
+                self.circuit = 'open'
+                self.opened_until = now + self.cooldown
+                self.probe_in_flight = False
+                self.counters['circuit_opens'] += 1
+                logger.warning(f"🔴 TTS circuit open for {self.provider.value}: pausing {self.cooldown:.1f}s")
+    
+    def record_cancelled(self):
+        """Request bị huỷ (thua hedge): không phải success/failure, nhưng phải trả lại lượt probe"""
+        with self.lock:
+            self.counters['cancelled'] += 1
+            if self.circuit == 'half_open':
+                self.probe_in_flight = False
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            now = time.monotonic()
+            self._circuit_blocked(now)
+            return {
+                'rate_per_second': round(self.rate, 2),
+                'circuit': self.circuit,
+                'reopens_in_seconds': round(max(0.0, self.opened_until - now), 1) if self.circuit == 'open' else 0.0,
+                **self.counters
+            }
+
+# Hedged requests: gửi bản dự phòng khi request chậm hơn p90 của provider
+TTS_HEDGE_CONFIG = {
+    'enabled': os.getenv('TTS_HEDGING', '1') != '0',
+    'providers': [TTSProvider.EDGE_TTS.value, TTSProvider.GTTS.value,  # Provider miễn phí: không nhân đôi chi phí API
+                  TTSProvider.LOCAL_TTS.value],
+    'percentile': 0.9,
+    'min_samples': 20,         # Cần đủ mẫu latency trước khi hedge
+    'min_delay': 0.5,          # Không hedge sớm hơn (giây)
+    'max_extra_load': 0.1,     # Số hedge tối đa = 10% số request
+    'window': 200              # Số latency gần nhất dùng để tính percentile
+}
+
+class HedgeTracker:
+    """Latency gần đây, ngưỡng hedge (p90) và thống kê hedge/win của một provider"""
+    
+    def __init__(self, provider: TTSProvider, config: dict = None):
+        self.provider = provider
+        self.config = config or TTS_HEDGE_CONFIG
+        self.latencies = deque(maxlen=self.config['window'])
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.config['enabled'] and self.provider.value in self.config['providers']
+    
+    def record_latency(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+    
+    def hedge_delay(self) -> Optional[float]:
+        """p90 latency (giây), None khi chưa đủ mẫu; đếm request cho giới hạn extra load"""
+        with self.lock:
+            self.requests += 1
+            if len(self.latencies) < self.config['min_samples']:
+                return None
+            ordered = sorted(self.latencies)
+            index = min(len(ordered) - 1, int(self.config['percentile'] * len(ordered)))
+            return max(self.config['min_delay'], ordered[index])
+    
+    def try_reserve_hedge(self) -> bool:
+        with self.lock:
+            if self.hedges + 1 > self.config['max_extra_load'] * self.requests:
+                return False
+            self.hedges += 1
+            return True
+    
+    def record_hedge_result(self, won: bool):
+        with self.lock:
+            if won:
+                self.hedge_wins += 1
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            ordered = sorted(self.latencies)
+            def percentile(q):
+                return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3) if ordered else None
+            return {
+                'enabled': self.enabled,
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'win_rate': round(self.hedge_wins / self.hedges, 3) if self.hedges else None,
+                'p50_seconds': percentile(0.5),
+                'p90_seconds': percentile(self.config['percentile'])
+            }
+
+# Voice catalogue: index dựng sẵn + discovery chạy nền (không chặn lúc khởi động)
+VOICE_DISCOVERY_CONFIG = {
+    'enabled': os.getenv('TTS_VOICE_DISCOVERY', '1') != '0',
+    'providers': [TTSProvider.EDGE_TTS, TTSProvider.ELEVENLABS],
+    'refresh_seconds': 24 * 3600,
+    'retry_seconds': 300          # Discovery lỗi (offline, thiếu key) được thử lại sau 5 phút
+}
+
+class VoiceRegistry:
+    """
+    Voice catalogue indexed by id, provider, language and gender.
+
+    Indexes are rebuilt on every change and swapped in as a whole, so lookups
+    never take a lock. Serialized /api/voices bodies are cached per filter
+    together with their ETag and dropped when the catalogue version changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.by_provider: Dict[TTSProvider, List[Voice]] = {}
+        self._by_id: Dict[str, Voice] = {}
+        self._by_key: Dict[Tuple, List[Voice]] = {}
+        self._responses: Dict[Tuple, Tuple[bytes, str]] = {}
+        self.discovery: Dict[TTSProvider, Dict] = {}
+
+    def register(self, provider: TTSProvider, voices: List[Voice], merge: bool = False):
+        """Đặt (hoặc merge: thêm các voice id chưa có) danh sách voice của một provider"""
+        with self.lock:
+            current = self.by_provider.get(provider, [])
+            if merge:
+                known = {v.id for v in current}
+                voices = current + [v for v in voices if v.id not in known]
+            by_provider = dict(self.by_provider)
+            by_provider[provider] = list(voices)
+            self._rebuild(by_provider)
+
+    def _rebuild(self, by_provider):
+        by_id, by_key = {}, {}
+        for provider in TTSProvider:
+            for voice in by_provider.get(provider, []):
+                by_id.setdefault(voice.id, voice)  # Trùng id (Edge/Azure): provider đứng trước thắng
+                for key in ((provider, None, None), (provider, voice.language, None),
+                            (provider, None, voice.gender), (provider, voice.language, voice.gender)):
+                    by_key.setdefault(key, []).append(voice)
+        self.by_provider, self._by_id, self._by_key = by_provider, by_id, by_key
+        self._responses = {}
+        self.version += 1
+
+    def get(self, voice_id: str) -> Optional[Voice]:
+        return self._by_id.get(voice_id)
+
+    def find(self, language: str = None, provider: TTSProvider = None, gender: str = None) -> List[Voice]:
+        """Voices theo thứ tự provider trong TTSProvider, rồi thứ tự trong catalogue"""
+        by_key = self._by_key
+        voices = []
+        for prov in ([provider] if provider else TTSProvider):
+            voices.extend(by_key.get((prov, language or None, gender or None), []))
+        return voices
+
+    def languages(self) -> List[str]:
+        return sorted({key[1] for key in self._by_key if key[1] is not None})
+
+    def voices_response(self, language: str = None, provider: TTSProvider = None) -> Tuple[bytes, str]:
+        """Body JSON của /api/voices (đã serialize) + ETag, cache theo (language, provider)"""
+        key = (language or None, provider)
+        responses = self._responses
+        cached = responses.get(key)
+        if cached is not None:
+            return cached
+
+        version = self.version
+        providers_data = {}
+        voices = self.find(language, provider)
+        for voice in voices:
+            provider_key = voice.provider.value
+            if provider_key not in providers_data:
+                providers_data[provider_key] = {
+                    'name': provider_key.replace('_', ' ').title(),
+                    'voices': []
+                }
+            providers_data[provider_key]['voices'].append({
+                'id': voice.id,
+                'name': voice.name,
+                'language': voice.language,
+                'gender': voice.gender,
+                'provider': provider_key,
+                'quality': voice.quality,
+                'description': voice.description,
+                'sample_rate': voice.sample_rate
+            })
+        body = json.dumps({
+            'providers': providers_data,
+            'total_voices': len(voices),
+            'available_providers': list(providers_data.keys())
+        }, ensure_ascii=False).encode('utf-8')
+        cached = (body, f"v{version}-{hashlib.sha1(body).hexdigest()[:16]}")
+        # Chỉ cache filter hợp lệ (language tùy ý từ query string không làm cache phình ra)
+        if language is None or language in self.languages():
+            responses[key] = cached
+        return cached
+
+    def discovery_due(self, provider: TTSProvider) -> bool:
+        state = self.discovery.get(provider)
+        if state is None:
+            return True
+        if state['status'] == 'running':
+            return False
+        wait = VOICE_DISCOVERY_CONFIG['refresh_seconds'] if state['status'] == 'done' else VOICE_DISCOVERY_CONFIG['retry_seconds']
+        return time.time() - state['finished_at'] >= wait
+
 class TTSManager:
     """Unified TTS Manager supporting multiple AI providers"""
     
     def __init__(self):
-        self.voices: Dict[TTSProvider, List[Voice]] = {}
+        self.registry = VoiceRegistry()
         self.api_keys = {
             TTSProvider.OPENAI_TTS: os.getenv('OPENAI_API_KEY'),
             TTSProvider.ELEVENLABS: os.getenv('ELEVENLABS_API_KEY'), 
             TTSProvider.AZURE_TTS: os.getenv('AZURE_TTS_KEY'),
             TTSProvider.GOOGLE_TTS: os.getenv('GOOGLE_TTS_KEY')
         }
+        # Clients/sessions gắn với event loop tạo ra chúng: {loop: {key: client}}
+        self._pools = weakref.WeakKeyDictionary()
+        self.rate_limiters: Dict[TTSProvider, ProviderRateLimiter] = {
+            provider: ProviderRateLimiter(provider) for provider in TTSProvider
+        }
+        self.hedge_trackers: Dict[TTSProvider, HedgeTracker] = {
+            provider: HedgeTracker(provider) for provider in TTSProvider
+        }
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
         self._load_voices()
     
+    # --- Event loop + connection pools ---
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="tts-event-loop", daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+    
+    def run(self, coro, timeout: float = None):
+        """
+        Chạy coroutine trên event loop nền của manager (sống cùng manager).
+        
+        Caller đồng bộ (Flask thread) dùng hàm này thay cho new_event_loop() mỗi segment,
+        nên HTTP sessions / async clients được tái sử dụng giữa các segment.
+        Quá timeout (mặc định TTS_POOL_CONFIG['run_timeout']) thì huỷ coroutine và raise TimeoutError.
+        """
+        if timeout is None:
+            timeout = TTS_POOL_CONFIG['run_timeout']
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+    
+    def _loop_pool(self) -> Dict:
+        return self._pools.setdefault(asyncio.get_running_loop(), {})
+    
+    def _get_semaphore(self, provider: TTSProvider) -> asyncio.Semaphore:
+        """Giới hạn số request đồng thời tới một provider"""
+        pool = self._loop_pool()
+        key = ('semaphore', provider)
+        if key not in pool:
+            pool[key] = asyncio.Semaphore(TTS_POOL_CONFIG['max_connections'].get(provider, 4))
+        return pool[key]
+    
+    def _get_http_session(self, provider: TTSProvider) -> aiohttp.ClientSession:
+        """aiohttp session dùng chung (keep-alive, DNS cache) cho provider"""
+        pool = self._loop_pool()
+        key = ('session', provider)
+        session = pool.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=TTS_POOL_CONFIG['max_connections'].get(provider, 4),
+                keepalive_timeout=TTS_POOL_CONFIG['keepalive_seconds'],
+                ttl_dns_cache=300
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=TTS_POOL_CONFIG['request_timeout'])
+            )
+            pool[key] = session
+        return session
+    
+    def _get_openai_client(self) -> 'openai.AsyncOpenAI':
+        """AsyncOpenAI client dùng chung, không block event loop"""
+        pool = self._loop_pool()
+        key = ('client', TTSProvider.OPENAI_TTS)
+        if key not in pool:
+            import httpx
+            max_connections = TTS_POOL_CONFIG['max_connections'][TTSProvider.OPENAI_TTS]
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=TTS_POOL_CONFIG['keepalive_seconds']
+                ),
+                timeout=TTS_POOL_CONFIG['request_timeout']
+            )
+            pool[key] = openai.AsyncOpenAI(
+                api_key=self.api_keys[TTSProvider.OPENAI_TTS],
+                http_client=http_client,
+                max_retries=0  # Retry do generate_speech_with_retry đảm nhiệm
+            )
+        return pool[key]
+    
+    async def aclose(self):
+        """Đóng các sessions/clients của event loop hiện tại"""
+        pool = self._pools.pop(asyncio.get_running_loop(), {})
+        for key, client in pool.items():
+            if key[0] in ('session', 'client'):
+                try:
+                    await client.close()
+                except Exception as e:
+                    logger.debug(f"Closing TTS {key[1].value} client failed: {e}")
+    
+    def close(self):
+        """Đóng pools và dừng event loop nền"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            self.run(self.aclose(), timeout=5)
+        except Exception as e:
+            logger.debug(f"TTS pool shutdown error: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        self._loop.close()
+    
     def _load_voices(self):
-        """Load available voices from all providers"""
+        """Load the built-in voice catalogue (discovery adds more voices in the background)"""
+        catalogue = {}
         
         # Edge TTS Voices (Free)
-        self.voices[TTSProvider.EDGE_TTS] = [
+        catalogue[TTSProvider.EDGE_TTS] = [
             # Vietnamese
             Voice("vi-VN-HoaiMyNeural", "Hoài My (Nữ)", "vi", "female", TTSProvider.EDGE_TTS, quality="standard", description="Giọng nữ Việt Nam tự nhiên"),
             Voice("vi-VN-NamMinhNeural", "Nam Minh (Nam)", "vi", "male", TTSProvider.EDGE_TTS, quality="standard", description="Giọng nam Việt Nam tự nhiên"),
@@ -128,7 +1787,7 @@ class TTSManager:
         ]
         
         # OpenAI TTS Voices (Premium - requires API key)
-        self.voices[TTSProvider.OPENAI_TTS] = [
+        catalogue[TTSProvider.OPENAI_TTS] = [
             Voice("alloy", "Alloy (Premium)", "en", "neutral", TTSProvider.OPENAI_TTS, quality="premium", description="OpenAI premium voice - versatile and balanced"),
             Voice("echo", "Echo (Premium)", "en", "male", TTSProvider.OPENAI_TTS, quality="premium", description="OpenAI premium voice - deep and resonant"),
             Voice("fable", "Fable (Premium)", "en", "neutral", TTSProvider.OPENAI_TTS, quality="premium", description="OpenAI premium voice - expressive storytelling"),
@@ -138,7 +1797,7 @@ class TTSManager:
         ]
         
         # ElevenLabs Voices (Ultra Premium - requires API key) 
-        self.voices[TTSProvider.ELEVENLABS] = [
+        catalogue[TTSProvider.ELEVENLABS] = [
             Voice("21m00Tcm4TlvDq8ikWAM", "Rachel (Ultra)", "en", "female", TTSProvider.ELEVENLABS, quality="ultra", description="ElevenLabs ultra-realistic female voice"),
             Voice("AZnzlk1XvdvUeBnXmlld", "Domi (Ultra)", "en", "female", TTSProvider.ELEVENLABS, quality="ultra", description="ElevenLabs strong female voice"),
             Voice("EXAVITQu4vr4xnSDxMaL", "Bella (Ultra)", "en", "female", TTSProvider.ELEVENLABS, quality="ultra", description="ElevenLabs expressive female voice"),
@@ -148,7 +1807,7 @@ class TTSManager:
         ]
         
         # Google TTS Voices (Premium)
-        self.voices[TTSProvider.GOOGLE_TTS] = [
+        catalogue[TTSProvider.GOOGLE_TTS] = [
             Voice("vi-VN-Standard-A", "Google Vietnamese (Female)", "vi", "female", TTSProvider.GOOGLE_TTS, quality="premium", description="Google Cloud TTS Vietnamese female"),
             Voice("vi-VN-Standard-B", "Google Vietnamese (Male)", "vi", "male", TTSProvider.GOOGLE_TTS, quality="premium", description="Google Cloud TTS Vietnamese male"),
             Voice("en-US-Neural2-C", "Google Neural (Female)", "en", "female", TTSProvider.GOOGLE_TTS, quality="premium", description="Google Neural2 English female"),
@@ -156,13 +1815,13 @@ class TTSManager:
         ]
         
         # Azure Cognitive Services (Premium)
-        self.voices[TTSProvider.AZURE_TTS] = [
+        catalogue[TTSProvider.AZURE_TTS] = [
             Voice("vi-VN-HoaiMyNeural", "Azure Hoài My", "vi", "female", TTSProvider.AZURE_TTS, quality="premium", description="Azure Cognitive Services Vietnamese"),
             Voice("en-US-AriaNeural", "Azure Aria", "en", "female", TTSProvider.AZURE_TTS, quality="premium", description="Azure Cognitive Services English"),
         ]
         
         # gTTS (Google Text-to-Speech) - Free with many languages
-        self.voices[TTSProvider.GTTS] = [
+        catalogue[TTSProvider.GTTS] = [
             # Vietnamese
             Voice("vi", "gTTS Tiếng Việt (Miền Bắc)", "vi", "female", TTSProvider.GTTS, quality="standard", description="Google Text-to-Speech Vietnamese miền Bắc (Free)"),
             
@@ -217,61 +1876,238 @@ class TTSManager:
             Voice("no", "gTTS Norsk", "no", "neutral", TTSProvider.GTTS, quality="standard", description="Google Text-to-Speech Norwegian (Free)"),
             Voice("fi", "gTTS Suomi", "fi", "neutral", TTSProvider.GTTS, quality="standard", description="Google Text-to-Speech Finnish (Free)"),
         ]
+        
+        # Local TTS (offline, tất định) - chỉ khi bật LOCAL_TTS=1 để không lẫn vào danh sách giọng thật
+        if LOCAL_TTS_CONFIG['enabled']:
+            catalogue[TTSProvider.LOCAL_TTS] = [
+                Voice("local-vi-female", "Local Nữ (offline)", "vi", "female", TTSProvider.LOCAL_TTS, sample_rate=LOCAL_TTS_CONFIG['sample_rate'], description="Giọng tổng hợp tất định cho benchmark / load test"),
+                Voice("local-vi-male", "Local Nam (offline)", "vi", "male", TTSProvider.LOCAL_TTS, sample_rate=LOCAL_TTS_CONFIG['sample_rate'], description="Giọng tổng hợp tất định cho benchmark / load test"),
+                Voice("local-en-female", "Local Female (offline)", "en", "female", TTSProvider.LOCAL_TTS, sample_rate=LOCAL_TTS_CONFIG['sample_rate'], description="Deterministic synthetic voice for benchmarks / load tests"),
+                Voice("local-en-male", "Local Male (offline)", "en", "male", TTSProvider.LOCAL_TTS, sample_rate=LOCAL_TTS_CONFIG['sample_rate'], description="Deterministic synthetic voice for benchmarks / load tests"),
+            ]
+        
+        for provider, voices in catalogue.items():
+            self.registry.register(provider, voices)
 
-    def get_available_voices(self, language: str = None, provider: TTSProvider = None) -> List[Voice]:
-        """Get available voices with optional filtering"""
-        all_voices = []
+    @property
+    def voices(self) -> Dict[TTSProvider, List[Voice]]:
+        return self.registry.by_provider
+    
+    def get_available_voices(self, language: str = None, provider: TTSProvider = None,
+                             gender: str = None) -> List[Voice]:
+        """Get available voices with optional filtering (index lookup)"""
+        return self.registry.find(language, provider, gender)
+    
+    def get_voice_by_id(self, voice_id: str) -> Optional[Voice]:
+        """Get voice by ID across all providers"""
+        return self.registry.get(voice_id)
+    
+    # --- Voice discovery (lazy, chạy trên event loop nền) ---
+    
+    def ensure_voice_discovery(self):
+        """Bắt đầu discovery cho các provider đến hạn; không chờ kết quả"""
+        if not VOICE_DISCOVERY_CONFIG['enabled']:
+            return
+        loaders = {
+            TTSProvider.EDGE_TTS: self._discover_edge_voices,
+            TTSProvider.ELEVENLABS: self._discover_elevenlabs_voices
+        }
+        for provider in VOICE_DISCOVERY_CONFIG['providers']:
+            if provider in self.api_keys and not self.api_keys[provider]:
+                continue  # Provider trả phí chưa cấu hình key: giữ catalogue dựng sẵn
+            with self.registry.lock:
+                if provider not in loaders or not self.registry.discovery_due(provider):
+                    continue
+                self.registry.discovery[provider] = {'status': 'running', 'started_at': time.time()}
+            asyncio.run_coroutine_threadsafe(self._run_discovery(provider, loaders[provider]), self._ensure_loop())
+    
+    async def _run_discovery(self, provider: TTSProvider, loader):
+        state = {'status': 'done', 'discovered': 0}
+        try:
+            voices = await loader()
+            before = len(self.registry.by_provider.get(provider, []))
+            self.registry.register(provider, voices, merge=True)
+            state['discovered'] = len(self.registry.by_provider[provider]) - before
+            logger.info(f"🔎 {provider.value} voice discovery: +{state['discovered']} voices")
+        except Exception as e:
+            state = {'status': 'error', 'error': str(e)}
+            logger.warning(f"🔎 {provider.value} voice discovery failed: {e}")
+        state['finished_at'] = time.time()
+        self.registry.discovery[provider] = state
+    
+    async def _discover_edge_voices(self) -> List[Voice]:
+        import edge_tts
+        voices = []
+        for item in await edge_tts.list_voices():
+            locale = item.get('Locale', '')
+            voices.append(Voice(
+                item['ShortName'], item.get('FriendlyName', item['ShortName']), locale.split('-')[0].lower(),
+                item.get('Gender', 'neutral').lower(), TTSProvider.EDGE_TTS,
+                quality="standard", description=f"Edge TTS {locale}"
+            ))
+        return voices
+    
+    async def _discover_elevenlabs_voices(self) -> List[Voice]:
+        if not self.api_keys[TTSProvider.ELEVENLABS]:
+            raise Exception("ElevenLabs API key not configured")
+        session = self._get_http_session(TTSProvider.ELEVENLABS)
+        headers = {"xi-api-key": self.api_keys[TTSProvider.ELEVENLABS]}
+        async with session.get("https://api.elevenlabs.io/v1/voices", headers=headers) as response:
+            if response.status != 200:
+                raise Exception(f"ElevenLabs API error: {response.status}")
+            payload = await response.json()
+        return [
+            Voice(item['voice_id'], f"{item['name']} (Ultra)", "en", item.get('labels', {}).get('gender', 'neutral'),
+                  TTSProvider.ELEVENLABS, quality="ultra", description=item.get('description') or "ElevenLabs voice")
+            for item in payload.get('voices', [])
+        ]
+    
+    async def generate_speech(self, text: str, voice_id: str, output_path: str, 
+                            speed: float = 1.0, **kwargs) -> bool:
+        """
+        Generate speech using the appropriate provider.
+        
+        Mỗi request đi qua rate limiter của provider; fail_fast=True trả về False ngay
+        khi circuit đang mở (caller đưa segment vào deferred retry queue).
+        Provider bật hedging sẽ gửi request dự phòng khi quá p90 latency.
+        output_path có thể là PCMSink (vd. slot trên timeline): audio được decode
+        thẳng vào đó, không qua file tạm.
+        attempt: định danh lần thử do retry loop của caller truyền vào (local TTS dùng
+        để rút latency / lỗi tất định cho từng lần thử).
+        """
+        voice = self.get_voice_by_id(voice_id)
+        if not voice:
+            logger.error(f"Voice not found: {voice_id}")
+            return False
+        
+        fail_fast = kwargs.get('fail_fast', False)
+        boundaries = kwargs.get('boundaries')  # Chỉ Edge TTS trả về WordBoundary
+        attempt = tuple(kwargs.get('attempt', ()))
+        if self.hedge_trackers[voice.provider].enabled:
+            return await self._generate_hedged(text, voice, output_path, speed, fail_fast, attempt, boundaries)
+        return await self._synthesize(text, voice, output_path, speed, fail_fast, boundaries, attempt)
+    
+    async def _generate_hedged(self, text: str, voice: Voice, output_path: str, speed: float, fail_fast: bool,
+                               attempt: tuple = (), boundaries: Optional[List] = None) -> bool:
+        """Gửi request dự phòng nếu request chính chưa xong sau p90 latency, lấy kết quả về trước
+        (batch cũng được hedge: boundaries là WordBoundary của request thắng)"""
+        tracker = self.hedge_trackers[voice.provider]
+        # Đích là sink: mỗi request ghi vào buffer riêng (request bị huỷ vẫn có thể đang
+        # decode trong executor), chỉ audio của request thắng được ghi vào sink
+        sink = output_path if isinstance(output_path, PCMSink) else None
+        primary_path = BufferSink() if sink else output_path
+        primary = asyncio.ensure_future(self._synthesize(text, voice, primary_path, speed, fail_fast, boundaries, attempt))
+        delay = tracker.hedge_delay()
+        if delay is None:
+            winner = primary_path if await primary else None
+        else:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not tracker.try_reserve_hedge() or self.rate_limiters[voice.provider].is_open():
+                winner = primary_path if await primary else None
+            else:
+                winner = await self._race_hedge(text, voice, output_path, speed, primary, primary_path, delay, attempt,
+                                                boundaries)
         
-        providers_to_check = [provider] if provider else list(TTSProvider)
+        if sink is not None and winner is not None:
+            sink.write_pcm(winner.samples())
+        return winner is not None
+    
+    async def _race_hedge(self, text: str, voice: Voice, output_path, speed: float, primary, primary_path, delay: float,
+                          attempt: tuple = (), boundaries: Optional[List] = None):
+        """Chạy request dự phòng song song với request chính; trả về output của request thắng (hoặc None)"""
+        tracker = self.hedge_trackers[voice.provider]
+        if isinstance(output_path, PCMSink):
+            hedge_path = BufferSink()
+        else:
+            root, ext = os.path.splitext(output_path)
+            hedge_path = f"{root}_hedge{ext}"
+        logger.info(f"🪁 Hedging {voice.provider.value} request after {delay:.2f}s: \"{text[:30]}...\"")
+        FALLBACKS_TOTAL.inc(kind='tts_hedge')
+        hedge_boundaries = [] if boundaries is not None else None
+        hedge = asyncio.ensure_future(self._synthesize(text, voice, hedge_path, speed, True, hedge_boundaries,
+                                                       attempt + ('hedge',)))
         
-        for prov in providers_to_check:
-            if prov in self.voices:
-                voices = self.voices[prov]
-                if language:
-                    voices = [v for v in voices if v.language == language]
-                all_voices.extend(voices)
+        winner = None
+        pending = {primary, hedge}
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        winner = task
+                        break
+        finally:
+            # Huỷ request chậm hơn và chờ nó dừng hẳn trước khi động vào file
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         
-        return all_voices
-    
-    def get_voice_by_id(self, voice_id: str) -> Optional[Voice]:
-        """Get voice by ID across all providers"""
-        for provider_voices in self.voices.values():
-            for voice in provider_voices:
-                if voice.id == voice_id:
-                    return voice
-        return None
+        if winner is hedge and not isinstance(output_path, PCMSink):
+            os.replace(hedge_path, output_path)
+        if winner is hedge and boundaries is not None:
+            boundaries[:] = hedge_boundaries  # Request chính đã dừng hẳn, bỏ WordBoundary dở dang của nó
+        tracker.record_hedge_result(won=winner is hedge)
+        if not isinstance(hedge_path, PCMSink) and os.path.exists(hedge_path):
+            os.remove(hedge_path)
+        if winner is None:
+            return None
+        return hedge_path if winner is hedge and isinstance(output_path, PCMSink) else primary_path
     
-    async def generate_speech(self, text: str, voice_id: str, output_path: str, 
-                            speed: float = 1.0, **kwargs) -> bool:
-        """Generate speech using the appropriate provider"""
-        voice = self.get_voice_by_id(voice_id)
-        if not voice:
-            logger.error(f"Voice not found: {voice_id}")
+    async def _synthesize(self, text: str, voice: Voice, output_path: str, speed: float, fail_fast: bool = False,
+                          boundaries: Optional[List] = None, attempt: tuple = ()) -> bool:
+        """Một request tới provider: rate limiter + circuit breaker + đo latency"""
+        limiter = self.rate_limiters[voice.provider]
+        if not await limiter.acquire(wait_for_circuit=not fail_fast):
+            logger.warning(f"⏸️ {voice.provider.value} circuit open, deferring: \"{text[:30]}...\"")
             return False
         
+        request_start = time.monotonic()
         try:
             if voice.provider == TTSProvider.EDGE_TTS:
-                return await self._generate_edge_tts(text, voice, output_path, speed)
+                success = await self._generate_edge_tts(text, voice, output_path, speed, boundaries)
             elif voice.provider == TTSProvider.GTTS:
-                return await self._generate_gtts(text, voice, output_path, speed)
+                success = await self._generate_gtts(text, voice, output_path, speed)
             elif voice.provider == TTSProvider.OPENAI_TTS:
-                return await self._generate_openai_tts(text, voice, output_path, speed)
+                success = await self._generate_openai_tts(text, voice, output_path, speed)
             elif voice.provider == TTSProvider.ELEVENLABS:
-                return await self._generate_elevenlabs_tts(text, voice, output_path, speed)
+                success = await self._generate_elevenlabs_tts(text, voice, output_path, speed)
             elif voice.provider == TTSProvider.GOOGLE_TTS:
-                return await self._generate_google_tts(text, voice, output_path, speed)
+                success = await self._generate_google_tts(text, voice, output_path, speed)
             elif voice.provider == TTSProvider.AZURE_TTS:
-                return await self._generate_azure_tts(text, voice, output_path, speed)
+                success = await self._generate_azure_tts(text, voice, output_path, speed)
+            elif voice.provider == TTSProvider.LOCAL_TTS:
+                success = await self._generate_local_tts(text, voice, output_path, speed, attempt)
             else:
                 logger.error(f"Unsupported TTS provider: {voice.provider}")
                 return False
                 
+        except asyncio.CancelledError:
+            # Request thua hedge bị huỷ: trả lại probe half-open, latency đã chạy vẫn được tính
+            # (chỉ lấy mẫu từ request thắng sẽ kéo p90 xuống thấp)
+            limiter.record_cancelled()
+            self.hedge_trackers[voice.provider].record_latency(time.monotonic() - request_start)
+            raise
+        except TTSRateLimitError as e:
+            logger.warning(f"🐢 {voice.provider.value} throttled: {e}")
+            limiter.record_failure(throttled=True, retry_after=e.retry_after)
+            return False
         except Exception as e:
             logger.error(f"TTS generation failed: {e}")
+            limiter.record_failure()
             return False
+        
+        if success:
+            limiter.record_success()
+            latency = time.monotonic() - request_start
+            self.hedge_trackers[voice.provider].record_latency(latency)
+            TTS_SEGMENT_SECONDS.observe(latency, provider=voice.provider.value)
+        else:
+            limiter.record_failure()
+        return success
     
-    async def _generate_edge_tts(self, text: str, voice: Voice, output_path: str, speed: float) -> bool:
-        """Generate speech using Edge TTS"""
+    async def _generate_edge_tts(self, text: str, voice: Voice, output_path: str, speed: float,
+                                 boundaries: Optional[List] = None) -> bool:
+        """Generate speech using Edge TTS (boundaries: nhận WordBoundary (offset, duration, text) theo giây)"""
         try:
             import edge_tts
             
@@ -281,10 +2117,26 @@ class TTSManager:
             else:
                 rate = f"-{int((1.0 - speed) * 100)}%"
             
-            communicate = edge_tts.Communicate(text, voice.id, rate=rate)
-            await communicate.save(output_path)
+            # edge-tts tự mở websocket cho mỗi Communicate: chỉ giới hạn số kết nối đồng thời
+            async with self._get_semaphore(TTSProvider.EDGE_TTS):
+                communicate = edge_tts.Communicate(text, voice.id, rate=rate)
+                decoder = StreamingAudioDecoder(output_path, 'mp3')
+                async for message in communicate.stream():
+                    if message['type'] == 'audio':
+                        decoder.feed(message['data'])
+                    elif message['type'] == 'WordBoundary' and boundaries is not None:
+                        # Offset/duration tính theo đơn vị 100ns
+                        boundaries.append((message['offset'] / 1e7, message['duration'] / 1e7, message['text']))
+            
+            # Edge trả MP3: decode trong memory vào sink / WAV thật thay vì ghi MP3 vào file .wav
+            await decoder.aclose()
             return True
             
+        except aiohttp.WSServerHandshakeError as e:
+            if e.status == 429:
+                raise TTSRateLimitError(f"Edge TTS handshake rejected ({e.status})")
+            logger.error(f"Edge TTS error: {e}")
+            return False
         except Exception as e:
             logger.error(f"Edge TTS error: {e}")
             return False
@@ -296,18 +2148,22 @@ class TTSManager:
             return False
             
         try:
-            client = openai.OpenAI(api_key=self.api_keys[TTSProvider.OPENAI_TTS])
-            
-            response = client.audio.speech.create(
-                model="tts-1-hd",  # Use HD model for better quality
-                voice=voice.id,
-                input=text,
-                speed=speed
-            )
+            client = self._get_openai_client()
+            
+            async with self._get_semaphore(TTSProvider.OPENAI_TTS):
+                response = await client.audio.speech.create(
+                    model="tts-1-hd",  # Use HD model for better quality
+                    voice=voice.id,
+                    input=text,
+                    speed=speed
+                )
             
-            response.stream_to_file(output_path)
+            await asyncio.get_running_loop().run_in_executor(None, write_provider_audio, output_path, response.content)
             return True
             
+        except openai.RateLimitError as e:
+            retry_after = e.response.headers.get('retry-after') if e.response is not None else None
+            raise TTSRateLimitError(f"OpenAI TTS rate limited: {e}", parse_retry_after(retry_after))
         except Exception as e:
             logger.error(f"OpenAI TTS error: {e}")
             return False
@@ -319,10 +2175,11 @@ class TTSManager:
             return False
             
         try:
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice.id}"
+            # Stream PCM 24 kHz: từng chunk được decode vào sink ngay khi tới
+            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice.id}/stream?output_format=pcm_24000"
             
             headers = {
-                "Accept": "audio/mpeg",
+                "Accept": "audio/pcm",
                 "Content-Type": "application/json",
                 "xi-api-key": self.api_keys[TTSProvider.ELEVENLABS]
             }
@@ -337,17 +2194,25 @@ class TTSManager:
                 }
             }
             
-            async with aiohttp.ClientSession() as session:
+            session = self._get_http_session(TTSProvider.ELEVENLABS)
+            async with self._get_semaphore(TTSProvider.ELEVENLABS):
                 async with session.post(url, json=data, headers=headers) as response:
                     if response.status == 200:
-                        with open(output_path, 'wb') as f:
-                            async for chunk in response.content.iter_chunked(8192):
-                                f.write(chunk)
-                        return True
+                        decoder = StreamingAudioDecoder(output_path, 'pcm_s16le', 24000, 1)
+                        async for chunk in response.content.iter_chunked(TTS_STREAM_CONFIG['chunk_bytes']):
+                            decoder.feed(chunk)
+                    elif response.status == 429:
+                        raise TTSRateLimitError("ElevenLabs API rate limited (429)",
+                                                parse_retry_after(response.headers.get('Retry-After')))
                     else:
                         logger.error(f"ElevenLabs API error: {response.status}")
                         return False
+            
+            await decoder.aclose()
+            return True
                         
+        except TTSRateLimitError:
+            raise
         except Exception as e:
             logger.error(f"ElevenLabs TTS error: {e}")
             return False
@@ -361,7 +2226,7 @@ class TTSManager:
         try:
             from google.cloud import texttospeech
             
-            client = texttospeech.TextToSpeechClient()
+            client = await asyncio.get_running_loop().run_in_executor(None, texttospeech.TextToSpeechClient)
             
             synthesis_input = texttospeech.SynthesisInput(text=text)
             voice_params = texttospeech.VoiceSelectionParams(
@@ -373,14 +2238,16 @@ class TTSManager:
                 speaking_rate=speed
             )
             
-            response = client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice_params,
-                audio_config=audio_config
-            )
+            # Client gRPC synchronous: gọi + decode trong thread, không chặn event loop dùng chung
+            def generate_audio():
+                response = client.synthesize_speech(
+                    input=synthesis_input,
+                    voice=voice_params,
+                    audio_config=audio_config
+                )
+                write_provider_audio(output_path, response.audio_content)
             
-            with open(output_path, "wb") as out:
-                out.write(response.audio_content)
+            await asyncio.get_running_loop().run_in_executor(None, generate_audio)
             return True
             
         except Exception as e:
@@ -391,63 +2258,21 @@ class TTSManager:
         """Generate speech using gTTS (Google Text-to-Speech) - Free"""
         try:
             from gtts import gTTS
-            import tempfile
-            import asyncio
-            import subprocess
+            import io
             
-            # gTTS doesn't support speed control natively, but we can mention it
+            # gTTS doesn't support speed control natively: tempo được áp dụng khi decode
             logger.debug(f"gTTS generating: '{text[:50]}...' in {voice.id} (speed: {speed}x)")
             
             # Create gTTS object
             tts = gTTS(text=text, lang=voice.id, slow=False)
             
-            # gTTS outputs MP3, so we need a temp file
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_mp3:
-                temp_mp3_path = temp_mp3.name
-            
-            # Run gTTS in thread to avoid blocking
-            def generate_mp3():
-                tts.save(temp_mp3_path)
-            
-            # Execute in thread since gTTS is synchronous
-            await asyncio.get_event_loop().run_in_executor(None, generate_mp3)
-            
-            # Convert MP3 to WAV using FFmpeg (to match expected output format)
-            if output_path.endswith('.wav'):
-                convert_cmd = [
-                    'ffmpeg', '-i', temp_mp3_path,
-                    '-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2',
-                    output_path, '-y'
-                ]
-                
-                # Apply speed adjustment if needed (since gTTS doesn't support it)
-                if speed != 1.0:
-                    convert_cmd = [
-                        'ffmpeg', '-i', temp_mp3_path,
-                        '-filter:a', f'atempo={speed}',
-                        '-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2',
-                        output_path, '-y'
-                    ]
-                
-                result = subprocess.run(convert_cmd, capture_output=True, text=True)
-                
-                if result.returncode != 0:
-                    logger.error(f"gTTS MP3 to WAV conversion failed: {result.stderr}")
-                    # Fallback: just copy the MP3 if conversion fails
-                    import shutil
-                    shutil.copy2(temp_mp3_path, output_path.replace('.wav', '.mp3'))
-            else:
-                # Output is MP3, just copy
-                import shutil
-                shutil.copy2(temp_mp3_path, output_path)
-            
-            # Cleanup temp file
-            try:
-                import os
-                os.unlink(temp_mp3_path)
-            except:
-                pass
+            # gTTS synchronous + decode MP3 → WAV 44.1 kHz stereo trong memory, chạy trong thread
+            def generate_audio():
+                buffer = io.BytesIO()
+                tts.write_to_fp(buffer)
+                write_provider_audio(output_path, buffer.getvalue(), speed)
             
+            await asyncio.get_running_loop().run_in_executor(None, generate_audio)
             return True
             
         except ImportError:
@@ -473,8 +2298,41 @@ class TTSManager:
             logger.error(f"Azure TTS error: {e}")
             return False
 
+    async def _generate_local_tts(self, text: str, voice: Voice, output_path: str, speed: float,
+                                  attempt: tuple = ()) -> bool:
+        """Generate speech offline (deterministic audio, injected latency / failures theo LOCAL_TTS_CONFIG)"""
+        config = LOCAL_TTS_CONFIG
+        # Số rút theo (segment, lần thử của caller): retry có thể thành công, kết quả không phụ thuộc
+        # thứ tự request hay các job trước đó
+        key = (voice.id, text) + attempt
+
+        async with self._get_semaphore(TTSProvider.LOCAL_TTS):
+            latency = config['latency_mean'] + config['latency_jitter'] * (2 * local_tts_draw('latency', *key) - 1)
+            if latency > 0:
+                await asyncio.sleep(latency)
+            outcome = local_tts_draw('outcome', *key)
+            if outcome < config['throttle_rate']:
+                raise TTSRateLimitError("Local TTS injected throttle (429)", 1.0)
+            if outcome < config['throttle_rate'] + config['failure_rate']:
+                logger.error(f"Local TTS injected failure (attempt {attempt}): \"{text[:30]}...\"")
+                return False
+
+            def generate_audio():
+                pcm = synthesize_local_speech(text, voice.id, speed)
+                # Cùng đường decode streaming với provider PCM (ElevenLabs)
+                decoder = StreamingAudioDecoder(output_path, 'pcm_s16le', config['sample_rate'], 1)
+                data = pcm.tobytes()
+                step = TTS_STREAM_CONFIG['chunk_bytes']
+                for offset in range(0, len(data), step):
+                    decoder.feed(data[offset:offset + step])
+                decoder.close()
+
+            await asyncio.get_running_loop().run_in_executor(None, generate_audio)
+        return True
+
 # Initialize TTS Manager
 tts_manager = TTSManager()
+atexit.register(tts_manager.close)
 
 # === RETRY MECHANISM FOR TTS ===
 
@@ -488,10 +2346,12 @@ TTS_RETRY_CONFIG = {
     'use_exponential_backoff': True,  # Use exponential backoff for delays
     'add_jitter': True,         # Add random jitter to delays
     'min_file_size_bytes': 1024,  # Minimum file size to consider successful (1KB)
-    'require_all_segments': True   # Require all segments to succeed before proceeding
+    'require_all_segments': True,  # Require all segments to succeed before proceeding
+    'defer_failed_segments': True  # Segment lỗi ở lượt đầu được retry ở cuối job (deferred queue)
 }
 
-async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, output_path: str, speed: float = 1.0, config: dict = None):
+async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, output_path: str, speed: float = 1.0, config: dict = None,
+                                     fail_fast: bool = False, retry_pass: str = 'retry'):
     """
     TTS generation with automatic retry mechanism
     
@@ -499,9 +2359,11 @@ async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, outp
         tts_manager: TTSManager instance
         text: Text to convert to speech
         voice_id: Voice ID to use
-        output_path: Output file path
+        output_path: Output file path or PCMSink
         speed: Speech speed
         config: Retry configuration dict (uses TTS_RETRY_CONFIG if None)
+        fail_fast: Don't wait for an open provider circuit, fail immediately instead
+        retry_pass: name of this pass ('first' / 'retry'), sent to the provider with the attempt index
     
     Returns:
         bool: True if successful, False if all retries failed
@@ -519,12 +2381,18 @@ async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, outp
         try:
             logger.info(f"🔄 TTS attempt {attempt + 1}/{max_retries + 1} for: \"{text[:30]}...\"")
             
-            success = await tts_manager.generate_speech(text, voice_id, output_path, speed)
+            if fail_fast:
+                success = await tts_manager.generate_speech(text, voice_id, output_path, speed, fail_fast=True,
+                                                            attempt=(retry_pass, attempt))
+            else:
+                success = await tts_manager.generate_speech(text, voice_id, output_path, speed,
+                                                            attempt=(retry_pass, attempt))
             
-            if success and os.path.exists(output_path):
+            if success and audio_output_size(output_path) > 0:
                 # Verify file size is reasonable
-                file_size = os.path.getsize(output_path)
+                file_size = audio_output_size(output_path)
                 if file_size >= min_file_size:
+                    commit_audio_output(output_path)
                     if attempt > 0:
                         logger.info(f"✅ TTS SUCCESS after {attempt + 1} attempts!")
                     return True
@@ -544,14 +2412,11 @@ async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, outp
                     delay += random.uniform(0, 1)
                 
                 logger.warning(f"⏳ TTS failed, retrying in {delay:.1f}s... (attempt {attempt + 1}/{max_retries + 1})")
+                RETRIES_TOTAL.inc(kind='tts')
                 await asyncio.sleep(delay)
                 
-                # Cleanup failed file if exists
-                if os.path.exists(output_path):
-                    try:
-                        os.remove(output_path)
-                    except:
-                        pass
+                # Cleanup failed file / partially streamed audio
+                discard_audio_output(output_path)
             
         except Exception as e:
             logger.error(f"❌ TTS attempt {attempt + 1} failed with error: {e}")
@@ -566,18 +2431,74 @@ async def generate_speech_with_retry(tts_manager, text: str, voice_id: str, outp
                     delay += random.uniform(0, 1)
                 
                 logger.warning(f"⏳ Retrying in {delay:.1f}s...")
+                RETRIES_TOTAL.inc(kind='tts')
                 await asyncio.sleep(delay)
                 
-                # Cleanup failed file if exists
-                if os.path.exists(output_path):
-                    try:
-                        os.remove(output_path)
-                    except:
-                        pass
+                # Cleanup failed file / partially streamed audio
+                discard_audio_output(output_path)
     
+    # Không để lại audio dở dang trên timeline (segment sẽ được retry từ đầu)
+    discard_audio_output(output_path)
     logger.error(f"❌ TTS FAILED after {max_retries + 1} attempts for: \"{text[:30]}...\"")
     return False
 
+async def generate_speech_first_pass(tts_manager, text: str, voice_id: str, output_path: str, speed: float = 1.0, config: dict = None):
+    """
+    First pass of a job: one attempt, no inline backoff, no waiting on an open circuit.
+    
+    Segments that fail here go to the deferred retry queue (drain_deferred_segments),
+    so one throttled segment doesn't stall the healthy ones behind it.
+    """
+    if config is None:
+        config = TTS_RETRY_CONFIG
+    if not config.get('defer_failed_segments', True):
+        return await generate_speech_with_retry(tts_manager, text, voice_id, output_path, speed, config)
+    return await generate_speech_with_retry(
+        tts_manager, text, voice_id, output_path, speed, dict(config, max_retries=0), fail_fast=True, retry_pass='first'
+    )
+
+def run_segment_tts(coro, *outputs):
+    """tts_manager.run cho một request của job: quá run_timeout thì coi như lỗi, bỏ audio dở dang
+    (segment vào deferred retry queue thay vì làm hỏng cả job / treo TTS worker)"""
+    try:
+        return tts_manager.run(coro)
+    except concurrent.futures.TimeoutError:
+        logger.warning(f"⌛ TTS request quá {TTS_POOL_CONFIG['run_timeout']}s, huỷ")
+        for output in outputs:
+            discard_audio_output(output)
+        return False
+
+def drain_deferred_segments(task_id, deferred, voice_id, speed, on_success):
+    """
+    Retry deferred segments at the end of a job with the full retry policy.
+    
+    Args:
+        deferred: list of dicts with text, output (file path or timeline slot), start, end
+        on_success: callback(item) for each recovered segment
+    
+    Returns:
+        list: segments that still failed
+    """
+    remaining = []
+    for n, item in enumerate(deferred, 1):
+        logger.info(f"🔁 Retry deferred segment [{n}/{len(deferred)}]: \"{item['text'][:50]}\"")
+        RETRIES_TOTAL.inc(kind='tts_deferred')
+        processing_tasks[task_id].update({
+            'current_step': f'🔁 Đang thử lại phân đoạn bị hoãn [{n}/{len(deferred)}]'
+        })
+        if len(item['text']) > TTS_SHAPING_CONFIG['max_chars']:
+            retry = generate_speech_split(tts_manager, item['text'], voice_id, item['output'], speed)
+        else:
+            retry = generate_speech_with_retry(tts_manager, item['text'], voice_id, item['output'], speed)
+        success = run_segment_tts(retry, item['output'])
+        if success and audio_output_size(item['output']) > 0:
+            on_success(item)
+        else:
+            remaining.append(item)
+    if deferred:
+        logger.info(f"🔁 Deferred queue drained: {len(deferred) - len(remaining)}/{len(deferred)} recovered")
+    return remaining
+
 def check_all_segments_successful(audio_segments, total_segments):
     """
     Check if all segments were successfully generated
@@ -618,96 +2539,592 @@ class GPUManager:
             self.gpu_info = "Apple Metal Performance Shaders (MPS)"
             logger.info("MPS device selected.")
         else:
-            self.device = torch.device("cpu")
-            self.gpu_info = "CPU"
-            logger.info("No GPU found, falling back to CPU.")
+            self.device = torch.device("cpu")
+            self.gpu_info = "CPU"
+            logger.info("No GPU found, falling back to CPU.")
+
+    def get_device(self):
+        """Returns the initialized torch.device."""
+        return self.device
+
+    def get_info(self):
+        """Returns a string with information about the active device."""
+        return self.gpu_info
+
+    def get_vram_gb(self):
+        """Returns total VRAM in GB if a CUDA device is active."""
+        return self.vram_total
+
+    def should_use_fp16(self):
+        """Determines if FP16 precision should be used. True for T4 GPUs."""
+        return self.is_t4
+
+# Initialize GPU Manager
+gpu_manager = GPUManager()
+device = gpu_manager.get_device()
+
+# === CPU INFERENCE PROFILE (Whisper trên máy không có GPU) ===
+
+# Whisper CPU settings - ghi đè bằng mục "whisper_cpu" trong cpu_config.json
+WHISPER_CPU_CONFIG = {
+    'precision': 'fp32',                       # fp32 hoặc int8 (dynamic quantization, profile phải bật)
+    'intra_op_threads': os.cpu_count() or 1,   # Số thread cho matmul/conv trong một op
+    'inter_op_threads': 1                      # Whisper decode tuần tự, 1 là đủ
+}
+WHISPER_CPU_CONFIG.update(CPU_PROFILE.get('whisper_cpu', {}))
+
+WHISPER_PRECISIONS = {
+    'fp32': 'FP32 - Chính xác nhất, chậm nhất trên CPU',
+    'int8': 'INT8 - Quantized Linear layers, nhanh hơn nhiều trên CPU'
+}
+
+def configure_cpu_threads():
+    """Set PyTorch thread pools from WHISPER_CPU_CONFIG (CPU device only)"""
+    if device.type != 'cpu':
+        return
+    torch.set_num_threads(int(WHISPER_CPU_CONFIG['intra_op_threads']))
+    try:
+        # Chỉ set được trước khi có parallel work đầu tiên
+        torch.set_num_interop_threads(int(WHISPER_CPU_CONFIG['inter_op_threads']))
+    except RuntimeError as e:
+        logger.warning(f"Could not set inter-op threads: {e}")
+    logger.info(f"CPU inference threads: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+
+configure_cpu_threads()
+
+# Supported languages
+LANGUAGES = {
+    'auto': 'Tự động phát hiện',
+    'vi': '🇻🇳 Tiếng Việt',
+    'en': '🇺🇸 English', 
+    'zh': '🇨🇳 中文',
+    'ja': '🇯🇵 日本語',
+    'ko': '🇰🇷 한국어',
+    'th': '🇹🇭 ไทย',
+    'fr': '🇫🇷 Français',
+    'es': '🇪🇸 Español',
+    'de': '🇩🇪 Deutsch'
+}
+
+# Whisper models
+WHISPER_MODELS = {
+    'tiny': 'Tiny (39MB) - Nhanh nhất',
+    'base': 'Base (74MB) - Cân bằng',
+    'small': 'Small (244MB) - Tốt',
+    'medium': 'Medium (769MB) - Rất tốt', 
+    'large': 'Large (1550MB) - Xuất sắc',
+    'large-v3': 'Large-v3 (1550MB) - Tốt nhất'
+}
+
+# OLD TTS_VOICES REMOVED - Now using TTSManager with multiple AI providers
+
+def allowed_file(filename, extensions):
+    """Kiểm tra file extension có được phép không"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+def resolve_whisper_precision(precision=None):
+    """Chọn precision thực tế: int8 chỉ áp dụng trên CPU"""
+    precision = precision or WHISPER_CPU_CONFIG['precision']
+    if precision not in WHISPER_PRECISIONS:
+        logger.warning(f"Unknown Whisper precision '{precision}', using fp32")
+        return 'fp32'
+    if precision == 'int8' and gpu_manager.get_device().type != 'cpu':
+        return 'fp32'
+    return precision
+
+def quantize_whisper_model(model):
+    """
+    Apply int8 dynamic quantization to every Linear layer of a Whisper model.
+
+    whisper.model.Linear is a subclass that quantize_dynamic() refuses to
+    convert, so each one is first swapped for a plain nn.Linear that shares
+    the same weight/bias tensors. Convolutions and the token embedding stay FP32.
+    """
+    def swap_linear(module):
+        for name, child in module.named_children():
+            if isinstance(child, whisper.model.Linear):
+                linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                linear.weight = child.weight
+                linear.bias = child.bias
+                setattr(module, name, linear)
+            else:
+                swap_linear(child)
+
+    model.eval()
+    swap_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def get_whisper_model(model_name, precision=None):
+    """Loads a Whisper model, caches it, and handles device placement and precision."""
+    global whisper_models
+    target_device = gpu_manager.get_device()
+    precision = resolve_whisper_precision(precision)
+    cache_key = model_name if precision == 'fp32' else f"{model_name}:{precision}"
+
+    # Check cache first
+    if cache_key in whisper_models:
+        cached_model = whisper_models[cache_key]
+        # Ensure the cached model is on the correct device
+        if str(cached_model.device) == str(target_device):
+            logger.info(f"Using cached Whisper model '{cache_key}' on {target_device}")
+            return cached_model
+        else:
+            logger.info(f"Device changed. Moving cached model '{cache_key}' to {target_device}")
+            cached_model.to(target_device)
+            return cached_model
+
+    logger.info(f"Loading Whisper model '{model_name}' onto device: {target_device} ({precision})")
+    try:
+        load_start = time.monotonic()
+        model = whisper.load_model(model_name, device=target_device)
+        
+        # Apply optimizations if on a capable GPU
+        if target_device.type == 'cuda' and gpu_manager.should_use_fp16():
+            # The model.half() call is commented out to force FP32 precision, which is more stable.
+            # This is the definitive fix for the hardware/library incompatibility.
+            logger.warning("FP16 optimization has been manually disabled to ensure stability. Transcription will use FP32.")
+        
+        # CPU profile: int8 dynamic quantization cho Linear layers
+        if precision == 'int8':
+            model = quantize_whisper_model(model)
+            logger.info(f"Whisper model '{model_name}' quantized to int8 (dynamic, Linear layers).")
+        
+        logger.info(f"Whisper model '{cache_key}' loaded successfully.")
+        MODEL_LOAD_SECONDS.observe(time.monotonic() - load_start, backend='openai_whisper', model=cache_key)
+        whisper_models[cache_key] = model
+        return model
+
+    except Exception as e:
+        logger.error(f"Fatal error loading Whisper model '{model_name}': {e}", exc_info=True)
+        return None
+    
+    return whisper_models[cache_key]
+
+# === PLUGGABLE ASR BACKENDS ===
+
+# Decode profiles: đánh đổi tốc độ / chất lượng decode của Whisper theo từng request
+WHISPER_DECODE_PROFILES = {
+    'fast': {
+        'beam_size': None,                      # Greedy
+        'best_of': None,
+        'temperature': 0.0,                     # Không temperature fallback
+        'condition_on_previous_text': False,
+        'verbose': None                         # Không in từng segment ra stdout
+    },
+    'balanced': {
+        'beam_size': None,                      # Greedy + fallback như mặc định của Whisper
+        'best_of': 5,
+        'temperature': (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        'condition_on_previous_text': True,
+        'verbose': None
+    },
+    'accurate': {
+        'beam_size': 5,
+        'best_of': 5,
+        'temperature': (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        'condition_on_previous_text': True,
+        'verbose': False                        # Chỉ hiện progress bar
+    }
+}
+DEFAULT_DECODE_PROFILE = 'balanced'
+
+def get_decode_options(profile_name=None):
+    """Trả về (tên profile, decode options) - profile không hợp lệ dùng mặc định"""
+    profile_name = profile_name or DEFAULT_DECODE_PROFILE
+    if profile_name not in WHISPER_DECODE_PROFILES:
+        logger.warning(f"Unknown decode profile '{profile_name}', using '{DEFAULT_DECODE_PROFILE}'")
+        profile_name = DEFAULT_DECODE_PROFILE
+    return profile_name, dict(WHISPER_DECODE_PROFILES[profile_name])
+
+class ASRBackend(Enum):
+    OPENAI_WHISPER = "openai_whisper"    # openai-whisper (PyTorch)
+    FASTER_WHISPER = "faster_whisper"    # faster-whisper (CTranslate2, int8 CPU kernels)
+
+# ASR settings - ghi đè bằng mục "asr" trong cpu_config.json hoặc env ASR_BACKEND
+ASR_CONFIG = {
+    'backend': os.getenv('ASR_BACKEND', ASRBackend.OPENAI_WHISPER.value),
+    'batch_size': 8,        # Batched decoding của faster-whisper (BatchedInferencePipeline)
+    'beam_size': 5
+}
+ASR_CONFIG.update(CPU_PROFILE.get('asr', {}))
+
+class ASREngine(ABC):
+    """
+    Base class for transcription engines.
+
+    transcribe() must return a Whisper-style result dict: 'text', 'language'
+    and 'segments', where each segment carries at least id/start/end/text plus
+    avg_logprob, compression_ratio and no_speech_prob, so create_srt_content()
+    and the task JSON see the same shape whatever engine produced it.
+    """
+    backend = None
+
+    @abstractmethod
+    def load(self, model_name: str, precision: str) -> bool:
+        """Load the model; False when the backend or model is unavailable"""
+
+    @abstractmethod
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict:
+        """Transcribe 16 kHz mono float32 audio into a Whisper-style result dict"""
+
+class OpenAIWhisperEngine(ASREngine):
+    """openai-whisper engine (FP32 or int8 dynamic quantization on CPU)"""
+    backend = ASRBackend.OPENAI_WHISPER
+
+    def __init__(self):
+        self.model = None
+
+    def load(self, model_name: str, precision: str) -> bool:
+        self.model = get_whisper_model(model_name, precision)
+        return self.model is not None
+
+    def detect_language(self, audio: np.ndarray) -> Optional[str]:
+        """Manual language detection on the first 30s (float32 pipeline)"""
+        try:
+            audio_for_detection = whisper.pad_or_trim(audio)
+            mel = whisper.log_mel_spectrogram(audio_for_detection).to(self.model.device)
+            # Ensure mel is float32
+            mel = mel.float()
+            with torch.inference_mode():
+                _, probs = self.model.detect_language(mel)
+            return max(probs, key=probs.get)
+        except Exception as e:
+            logger.error(f"Manual language detection failed: {e}. Proceeding without language hint.")
+            return None
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict:
+        if language == 'auto' or language is None:
+            logger.info("Performing manual language detection (float32 pipeline)...")
+            language = self.detect_language(audio)
+            logger.info(f"Language manually detected: {language}")
+
+        logger.info(f"Starting transcription with language: {language or 'auto'} (openai-whisper)")
+        options.setdefault('verbose', True)
+        with torch.inference_mode():
+            return self.model.transcribe(audio, language=language, **options)
+
+class FasterWhisperEngine(ASREngine):
+    """faster-whisper engine: CTranslate2 int8 kernels + batched decoding"""
+    backend = ASRBackend.FASTER_WHISPER
+
+    def __init__(self):
+        self.model = None
+        self.pipeline = None
+
+    def load(self, model_name: str, precision: str) -> bool:
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            logger.error("faster-whisper not installed. Run: pip install faster-whisper")
+            return False
+
+        device_type = gpu_manager.get_device().type
+        ct2_device = 'cuda' if device_type == 'cuda' else 'cpu'
+        compute_type = 'int8' if precision == 'int8' else 'float32'
+        cache_key = f"faster:{model_name}:{compute_type}"
+
+        if cache_key not in whisper_models:
+            logger.info(f"Loading faster-whisper model '{model_name}' on {ct2_device} ({compute_type})")
+            try:
+                with MODEL_LOAD_SECONDS.time(backend='faster_whisper', model=cache_key):
+                    whisper_models[cache_key] = WhisperModel(
+                        model_name, device=ct2_device, compute_type=compute_type,
+                        cpu_threads=int(WHISPER_CPU_CONFIG['intra_op_threads'])
+                    )
+            except Exception as e:
+                logger.error(f"Fatal error loading faster-whisper model '{model_name}': {e}", exc_info=True)
+                return False
+        else:
+            logger.info(f"Using cached faster-whisper model '{cache_key}'")
+
+        self.model = whisper_models[cache_key]
+        try:
+            # faster-whisper >= 1.1: batch nhiều chunk VAD trong một lần decode
+            from faster_whisper import BatchedInferencePipeline
+            self.pipeline = BatchedInferencePipeline(model=self.model)
+        except ImportError:
+            self.pipeline = None
+        return True
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict:
+        if language == 'auto':
+            language = None
+        options.pop('verbose', None)
+        # faster-whisper không nhận None: greedy = beam_size 1
+        if options.get('beam_size') is None:
+            options['beam_size'] = 1 if 'beam_size' in options else ASR_CONFIG['beam_size']
+        if 'best_of' in options and options['best_of'] is None:
+            options['best_of'] = 1
+        if isinstance(options.get('temperature'), tuple):
+            options['temperature'] = list(options['temperature'])
+
+        if self.pipeline is not None:
+            logger.info(f"Starting batched transcription (batch_size={ASR_CONFIG['batch_size']}, faster-whisper)")
+            segments_iter, info = self.pipeline.transcribe(audio, language=language,
+                                                           batch_size=int(ASR_CONFIG['batch_size']), **options)
+        else:
+            logger.info("Starting transcription (faster-whisper, sequential)")
+            segments_iter, info = self.model.transcribe(audio, language=language, **options)
+
+        segments = []
+        for segment in segments_iter:
+            segments.append({
+                'id': segment.id,
+                'seek': segment.seek,
+                'start': segment.start,
+                'end': segment.end,
+                'text': segment.text,
+                'tokens': list(segment.tokens),
+                'temperature': segment.temperature,
+                'avg_logprob': segment.avg_logprob,
+                'compression_ratio': segment.compression_ratio,
+                'no_speech_prob': segment.no_speech_prob
+            })
+
+        return {
+            'text': ''.join(seg['text'] for seg in segments),
+            'segments': segments,
+            'language': info.language
+        }
+
+ASR_ENGINES = {
+    ASRBackend.OPENAI_WHISPER: OpenAIWhisperEngine,
+    ASRBackend.FASTER_WHISPER: FasterWhisperEngine
+}
+
+def get_asr_engine(model_name: str, precision: str, backend: Optional[str] = None) -> ASREngine:
+    """
+    Create and load the requested ASR engine.
+
+    Falls back to openai-whisper if the requested backend is unknown or
+    cannot load (e.g. faster-whisper not installed).
+    """
+    backend = backend or ASR_CONFIG['backend']
+    try:
+        backend_enum = ASRBackend(backend)
+    except ValueError:
+        logger.warning(f"Unknown ASR backend '{backend}', using {ASRBackend.OPENAI_WHISPER.value}")
+        backend_enum = ASRBackend.OPENAI_WHISPER
+
+    engine = ASR_ENGINES[backend_enum]()
+    if engine.load(model_name, precision):
+        return engine
+
+    if backend_enum != ASRBackend.OPENAI_WHISPER:
+        logger.warning(f"ASR backend '{backend_enum.value}' unavailable, falling back to openai-whisper")
+        engine = OpenAIWhisperEngine()
+        if engine.load(model_name, precision):
+            return engine
+
+    raise Exception(f"Whisper model '{model_name}' could not be loaded.")
+
+# === STREAMING (WINDOWED) TRANSCRIPTION ===
+
+# Transcribe theo window để publish segments dần lên task trong lúc ASR còn chạy
+STREAMING_CONFIG = {
+    'window_seconds': 60.0,    # Độ dài audio mỗi lần gọi engine
+    'boundary_guard': 1.0,     # Segment kết thúc sát mép window sẽ được decode lại ở window sau
+    'prompt_chars': 200        # Text cuối window trước làm initial_prompt (condition_on_previous_text)
+}
+
+def transcribe_in_windows(engine, audio, language=None, on_batch=None, config=None, **options):
+    """
+    Transcribe audio window by window and report each finished batch of segments.
+
+    Segments ending inside the boundary guard of a window are dropped and the next
+    window starts at the end of the last kept segment, so words cut by the window
+    edge are decoded again with full context.
+
+    Args:
+        engine: loaded ASREngine
+        audio: 16 kHz float32 audio
+        language: language code, 'auto'/None detects it on the first window only
+        on_batch: callback(new_segments, all_segments, position_seconds, audio_seconds)
+        config: STREAMING_CONFIG overrides
+        options: Whisper decode options (decode profile)
+
+    Returns:
+        dict: Whisper-style result (text, segments, language)
+    """
+    config = config or STREAMING_CONFIG
+    sample_rate = whisper.audio.SAMPLE_RATE
+    audio_seconds = len(audio) / sample_rate
+    window_seconds = config['window_seconds']
+    condition = options.get('condition_on_previous_text', True)
+    options['verbose'] = None
+
+    segments = []
+    position = 0.0
+    while position < audio_seconds:
+        window_end = min(audio_seconds, position + window_seconds)
+        is_last = window_end >= audio_seconds
+        audio_slice = audio[int(position * sample_rate):int(window_end * sample_rate)]
+
+        if condition and segments:
+            options['initial_prompt'] = ''.join(seg['text'] for seg in segments)[-config['prompt_chars']:].strip()
+        window_result = engine.transcribe(audio_slice, language=language, **options)
+        if language in (None, 'auto'):
+            language = window_result.get('language') or language
+
+        window_segments = window_result['segments']
+        if not is_last:
+            kept = [seg for seg in window_segments
+                    if seg['end'] <= window_end - position - config['boundary_guard']]
+            # Một segment dài phủ cả window: giữ nguyên để không lặp vô hạn
+            window_segments = kept or window_segments
+
+        new_segments = []
+        for seg in window_segments:
+            seg = dict(seg, start=seg['start'] + position, end=seg['end'] + position, id=len(segments))
+            segments.append(seg)
+            new_segments.append(seg)
+
+        if is_last or not new_segments or new_segments[-1]['end'] <= position:
+            position = window_end
+        else:
+            position = new_segments[-1]['end']
+
+        if on_batch:
+            on_batch(new_segments, segments, min(position, audio_seconds), audio_seconds)
+
+    return {
+        'text': ''.join(seg['text'] for seg in segments),
+        'segments': segments,
+        'language': language
+    }
+
+# === DRAFT-THEN-REFINE TRANSCRIPTION ===
+
+# Draft bằng model nhỏ, chỉ chạy model lớn lại trên các đoạn Whisper không tự tin
+REFINE_CONFIG = {
+    'draft_model': 'base',
+    'logprob_threshold': -0.8,           # avg_logprob thấp hơn => decode không chắc chắn
+    'compression_ratio_threshold': 2.4,  # Cao hơn => text lặp/hallucination
+    'no_speech_threshold': 0.6,          # Cao hơn => có thể là im lặng bị đoán thành chữ
+    'merge_gap': 1.0,                    # Gộp các đoạn cần refine cách nhau < merge_gap giây
+    'padding': 0.3,                      # Thêm context audio hai đầu mỗi window (giây)
+    'min_coverage': 0.5                  # Refine phủ < tỉ lệ này so với draft trong window => giữ draft
+}
+
+def is_low_confidence_segment(segment, config=None):
+    """Kiểm tra segment có vượt một trong các ngưỡng confidence của Whisper không"""
+    config = config or REFINE_CONFIG
+    return (segment.get('avg_logprob', 0.0) < config['logprob_threshold']
+            or segment.get('compression_ratio', 0.0) > config['compression_ratio_threshold']
+            or segment.get('no_speech_prob', 0.0) > config['no_speech_threshold'])
+
+def find_low_confidence_windows(segments, config=None):
+    """
+    Group low-confidence segments into time windows to re-transcribe.
+
+    Windows are snapped to draft segment boundaries and neighbouring flagged
+    segments closer than merge_gap are merged, so each window can replace a
+    contiguous run of draft segments.
+
+    Returns:
+        list: [(start, end)] in seconds, sorted by start
+    """
+    config = config or REFINE_CONFIG
+    windows = []
+    for segment in segments:
+        if not is_low_confidence_segment(segment, config):
+            continue
+        if windows and segment['start'] - windows[-1][1] <= config['merge_gap']:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], segment['end']))
+        else:
+            windows.append((segment['start'], segment['end']))
+    return windows
 
-    def get_device(self):
-        """Returns the initialized torch.device."""
-        return self.device
+def merge_refined_segments(draft_segments, refined_windows, config=None):
+    """
+    Replace draft segments inside each refined window with the refined ones.
 
-    def get_info(self):
-        """Returns a string with information about the active device."""
-        return self.gpu_info
+    A segment belongs to a window when its midpoint falls inside it, which
+    avoids duplicating words from the padding at window edges. Windows whose
+    refined output is empty or covers much less speech than the draft
+    (min_coverage) keep their draft segments.
+    """
+    config = config or REFINE_CONFIG
 
-    def get_vram_gb(self):
-        """Returns total VRAM in GB if a CUDA device is active."""
-        return self.vram_total
+    def in_window(segment, window):
+        midpoint = (segment['start'] + segment['end']) / 2
+        return window[0] <= midpoint <= window[1]
 
-    def should_use_fp16(self):
-        """Determines if FP16 precision should be used. True for T4 GPUs."""
-        return self.is_t4
+    def coverage(segments, window):
+        return sum(max(0.0, min(seg['end'], window[1]) - max(seg['start'], window[0]))
+                   for seg in segments if in_window(seg, window))
 
-# Initialize GPU Manager
-gpu_manager = GPUManager()
-device = gpu_manager.get_device()
+    accepted = []
+    for window, refined in refined_windows:
+        draft_seconds = coverage(draft_segments, window)
+        refined_seconds = coverage(refined, window)
+        if refined_seconds > 0 and refined_seconds >= config['min_coverage'] * draft_seconds:
+            accepted.append((window, refined))
+        else:
+            logger.warning(f"⚠️ Refine {window[0]:.1f}s → {window[1]:.1f}s chỉ phủ {refined_seconds:.1f}s "
+                           f"(draft {draft_seconds:.1f}s), giữ bản draft")
 
-# Supported languages
-LANGUAGES = {
-    'auto': 'Tự động phát hiện',
-    'vi': '🇻🇳 Tiếng Việt',
-    'en': '🇺🇸 English', 
-    'zh': '🇨🇳 中文',
-    'ja': '🇯🇵 日本語',
-    'ko': '🇰🇷 한국어',
-    'th': '🇹🇭 ไทย',
-    'fr': '🇫🇷 Français',
-    'es': '🇪🇸 Español',
-    'de': '🇩🇪 Deutsch'
-}
+    merged = [seg for seg in draft_segments
+              if not any(in_window(seg, window) for window, _ in accepted)]
+    for window, refined in accepted:
+        merged.extend(seg for seg in refined if in_window(seg, window))
 
-# Whisper models
-WHISPER_MODELS = {
-    'tiny': 'Tiny (39MB) - Nhanh nhất',
-    'base': 'Base (74MB) - Cân bằng',
-    'small': 'Small (244MB) - Tốt',
-    'medium': 'Medium (769MB) - Rất tốt', 
-    'large': 'Large (1550MB) - Xuất sắc',
-    'large-v3': 'Large-v3 (1550MB) - Tốt nhất'
-}
+    merged.sort(key=lambda seg: seg['start'])
+    for i, seg in enumerate(merged):
+        seg['id'] = i
+    return merged
 
-# OLD TTS_VOICES REMOVED - Now using TTSManager with multiple AI providers
+def refine_transcription(draft_result, audio, engine, language=None, config=None, **decode_options):
+    """
+    Re-transcribe only the low-confidence windows of a draft result.
 
-def allowed_file(filename, extensions):
-    """Kiểm tra file extension có được phép không"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+    Args:
+        draft_result: Whisper-style result from the draft model
+        audio: 16 kHz float32 audio used for the draft
+        engine: loaded ASREngine for the refine (large) model
+        language: language to force for the refine pass
+        decode_options: Whisper decode options (decode profile) for the refine pass
 
-def get_whisper_model(model_name):
-    """Loads a Whisper model, caches it, and handles device placement and precision."""
-    global whisper_models
-    target_device = gpu_manager.get_device()
+    Returns:
+        tuple: (merged result dict, refine stats dict)
+    """
+    config = config or REFINE_CONFIG
+    sample_rate = whisper.audio.SAMPLE_RATE
+    audio_seconds = len(audio) / sample_rate
+    windows = find_low_confidence_windows(draft_result['segments'], config)
 
-    # Check cache first
-    if model_name in whisper_models:
-        cached_model = whisper_models[model_name]
-        # Ensure the cached model is on the correct device
-        if str(cached_model.device) == str(target_device):
-            logger.info(f"Using cached Whisper model '{model_name}' on {target_device}")
-            return cached_model
-        else:
-            logger.info(f"Device changed. Moving cached model '{model_name}' to {target_device}")
-            cached_model.to(target_device)
-            return cached_model
+    refined_windows = []
+    for window_start, window_end in windows:
+        slice_start = max(0.0, window_start - config['padding'])
+        slice_end = min(audio_seconds, window_end + config['padding'])
+        audio_slice = audio[int(slice_start * sample_rate):int(slice_end * sample_rate)]
+        logger.info(f"🔁 Refining {window_start:.1f}s → {window_end:.1f}s with {engine.backend.value}")
 
-    logger.info(f"Loading Whisper model '{model_name}' onto device: {target_device}")
-    try:
-        model = whisper.load_model(model_name, device=target_device)
-        
-        # Apply optimizations if on a capable GPU
-        if target_device.type == 'cuda' and gpu_manager.should_use_fp16():
-            # The model.half() call is commented out to force FP32 precision, which is more stable.
-            # This is the definitive fix for the hardware/library incompatibility.
-            logger.warning("FP16 optimization has been manually disabled to ensure stability. Transcription will use FP32.")
-        
-        logger.info(f"Whisper model '{model_name}' loaded successfully.")
-        whisper_models[model_name] = model
-        return model
+        decode_options['verbose'] = None
+        window_result = engine.transcribe(audio_slice, language=language, **decode_options)
+        refined = []
+        for seg in window_result['segments']:
+            seg = dict(seg)
+            seg['start'] += slice_start
+            seg['end'] += slice_start
+            seg['refined'] = True
+            refined.append(seg)
+        refined_windows.append(((window_start, window_end), refined))
 
-    except Exception as e:
-        logger.error(f"Fatal error loading Whisper model '{model_name}': {e}", exc_info=True)
-        return None
-    
-    return whisper_models[model_name]
+    segments = merge_refined_segments([dict(seg) for seg in draft_result['segments']], refined_windows, config)
+    refined_seconds = sum(end - start for start, end in windows)
+    result = dict(draft_result)
+    result['segments'] = segments
+    result['text'] = ''.join(seg['text'] for seg in segments)
+
+    stats = {
+        'windows': len(windows),
+        'draft_segments': len(draft_result['segments']),
+        'refined_segments': sum(1 for seg in segments if seg.get('refined')),
+        'refined_seconds': round(refined_seconds, 2),
+        'refined_fraction': round(refined_seconds / audio_seconds, 3) if audio_seconds > 0 else 0.0
+    }
+    return result, stats
 
 def format_timestamp(seconds):
     """Convert seconds to SRT timestamp format"""
@@ -782,7 +3199,7 @@ def parse_srt_content(srt_text):
 
 # OLD create_tts_audio REMOVED - Now using TTSManager.generate_speech()
 
-def extract_audio_from_video(video_path, audio_path):
+def extract_audio_from_video(video_path, audio_path, task_id=None, progress_range=None):
     """Extract audio từ video bằng FFmpeg"""
     try:
         cmd = [
@@ -790,42 +3207,51 @@ def extract_audio_from_video(video_path, audio_path):
             '-ab', '160k', '-ac', '2', '-ar', '44100',
             '-vn', audio_path, '-y'
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_ffmpeg(cmd, task_id, progress_range, '🎵 Extracting audio')
+        if result.returncode != 0:
+            logger.error(f"Audio extraction failed: {result.stderr[-500:]}")
+        else:
+            AUDIO_EXTRACTION_SECONDS.observe(result.elapsed)
         return result.returncode == 0
     except Exception as e:
         logger.error(f"Audio extraction error: {e}")
         return False
 
+def select_tts_voice(language, voice_type, voice_id=None):
+    """Chọn voice từ TTSManager theo voice_id, hoặc theo ngôn ngữ + giới tính"""
+    if voice_id:
+        # Use specific voice ID if provided
+        selected_voice = tts_manager.get_voice_by_id(voice_id)
+        if not selected_voice:
+            logger.warning(f"Voice ID {voice_id} not found, finding suitable voice for language {language}")
+            # Don't force Edge TTS - find the best available voice for the language
+            available_voices = tts_manager.get_available_voices(language)
+            if not available_voices:
+                available_voices = tts_manager.get_available_voices('vi')
+            selected_voice = available_voices[0] if available_voices else None
+        return selected_voice
+
+    # Get voices by language and gender
+    available_voices = tts_manager.get_available_voices(language)
+    if not available_voices:
+        # Fallback to Vietnamese
+        available_voices = tts_manager.get_available_voices('vi')
+    
+    # Filter by gender if specified
+    if voice_type in ['male', 'female']:
+        gender_voices = [v for v in available_voices if v.gender == voice_type]
+        if gender_voices:
+            available_voices = gender_voices
+    
+    return available_voices[0] if available_voices else None
+
 def generate_voice_internal(task_id, segments, language, voice_type, speech_rate, voice_volume, voice_id=None):
     """Internal function to generate voice from segments using Multi-AI TTS"""
     try:
         logger.info(f"Generating voice for task {task_id}: {len(segments)} segments")
         
         # Get voice from TTSManager
-        if voice_id:
-            # Use specific voice ID if provided
-            selected_voice = tts_manager.get_voice_by_id(voice_id)
-            if not selected_voice:
-                logger.warning(f"Voice ID {voice_id} not found, finding suitable voice for language {language}")
-                # Don't force Edge TTS - find the best available voice for the language
-                available_voices = tts_manager.get_available_voices(language)
-                if not available_voices:
-                    available_voices = tts_manager.get_available_voices('vi')
-                selected_voice = available_voices[0] if available_voices else None
-        else:
-            # Get voices by language and gender
-            available_voices = tts_manager.get_available_voices(language)
-            if not available_voices:
-                # Fallback to Vietnamese
-                available_voices = tts_manager.get_available_voices('vi')
-            
-            # Filter by gender if specified
-            if voice_type in ['male', 'female']:
-                gender_voices = [v for v in available_voices if v.gender == voice_type]
-                if gender_voices:
-                    available_voices = gender_voices
-            
-            selected_voice = available_voices[0] if available_voices else None
+        selected_voice = select_tts_voice(language, voice_type, voice_id)
         
         if not selected_voice:
             raise Exception("No suitable voice found")
@@ -833,8 +3259,6 @@ def generate_voice_internal(task_id, segments, language, voice_type, speech_rate
         voice_id = selected_voice.id
         provider_name = selected_voice.provider.value
         
-        # Create TTS for each segment
-        audio_segments = []
         total_segments = len(segments)
         
         # Log overview of voice generation task
@@ -846,193 +3270,753 @@ def generate_voice_internal(task_id, segments, language, voice_type, speech_rate
         logger.info(f"⚡ Tốc độ: {speech_rate}x")
         logger.info("🎬" + "="*78)
         
-        for i, segment in enumerate(segments):
-            progress = 20 + (i * 60 / total_segments)
+        # Create TTS for each segment (request shaping + deferred retry queue);
+        # streaming mode decodes each segment straight into the timeline
+        mark_job_stage(task_id, 'tts')
+        stream_mixer = (TimelineMixer(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, voice_volume / 100.0,
+                                      duration=max((seg['end'] for seg in segments), default=0))
+                            if TTS_STREAM_CONFIG['enabled'] else None)
+        audio_segments, failed_segments = synthesize_segments(task_id, segments, voice_id, speech_rate, stream_mixer)
+        
+        # === KIỂM TRA TẤT CẢ SEGMENTS PHẢI THÀNH CÔNG ===
+        all_successful, success_count, fail_count = check_all_segments_successful(audio_segments, total_segments)
+        
+        logger.info("🎭" + "="*78)
+        logger.info(f"🎭 KIỂM TRA KẾT QUẢ TẠO LỒNG TIẾNG")
+        logger.info(f"✅ Thành công: {success_count}/{total_segments} segments")
+        if fail_count > 0:
+            logger.error(f"❌ Thất bại: {fail_count} segments")
+        logger.info("🎭" + "="*78)
+        
+        if not all_successful:
+            error_msg = f"❌ DỪNG XỬ LÝ: {fail_count}/{total_segments} segments thất bại! Tất cả câu thoại phải được tạo thành công mới có thể tiếp tục."
+            logger.error(error_msg)
+            
+            # Cleanup any successful temp files
+            for seg_audio in audio_segments:
+                if seg_audio['file'] and os.path.exists(seg_audio['file']):
+                    try:
+                        os.remove(seg_audio['file'])
+                    except:
+                        pass
+            
+            # Update task status with specific error
+            processing_tasks[task_id].update({
+                'status': 'error',
+                'error': f'Voice generation failed: {fail_count}/{total_segments} segments failed to generate. All segments must succeed.',
+                'success_count': success_count,
+                'fail_count': fail_count,
+                'total_segments': total_segments
+            })
+            
+            return False
+        
+        logger.info("🎊 TẤT CẢ SEGMENTS ĐÃ THÀNH CÔNG! Tiếp tục tạo timeline audio...")
+        
+        # FIXED: Combine all segments into one audio file (voice_volume apply khi mix, mọi đường mix cùng một gain)
+        voice_output = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_voice.wav")
+        
+        if audio_segments:
+            logger.info(f"🎛️ Tạo timeline audio (voice volume {voice_volume}%)")
+            
+            # Create timeline audio với volume control
+            total_duration = max(seg['end'] for seg in segments)
             
+            # In-process mix (float32 timeline); ffmpeg filter graph chỉ còn là fallback
+            mark_job_stage(task_id, 'mix')
+            mix_start, mix_method = time.monotonic(), 'in_process'
+            if stream_mixer is not None:
+                stream_mixer.write(voice_output, total_duration)
+                mix_method = 'stream'
+                logger.info("✅ Timeline audio streamed in-process!")
+            elif mix_timeline_in_process(audio_segments, total_duration, voice_output, voice_volume / 100.0):
+                logger.info("✅ Timeline audio created in-process!")
+            else:
+                mix_method = 'ffmpeg'
+                FALLBACKS_TOTAL.inc(kind='ffmpeg_mix')
+                mix_timeline_with_ffmpeg(audio_segments, total_duration, voice_output, voice_volume / 100.0, task_id)
+            TIMELINE_MIX_SECONDS.observe(time.monotonic() - mix_start, method=mix_method)
+            
+            # Cleanup temp files
+            for seg_audio in audio_segments:
+                if seg_audio['file'] and os.path.exists(seg_audio['file']):
+                    os.remove(seg_audio['file'])
+        
+        # Update task with voice path
+        processing_tasks[task_id]['voice_path'] = voice_output
+        logger.info(f"Voice generated for task {task_id}")
+        
+        # Log completion summary
+        successful_segments = len(audio_segments)
+        logger.info("🎉" + "="*78)
+        logger.info(f"🎉 HOÀN THÀNH TẠO LỒNG TIẾNG!")
+        logger.info(f"✅ Thành công: {successful_segments}/{total_segments} segments")
+        logger.info(f"🎯 Điều kiện: TẤT CẢ segments đã thành công - được phép tiếp tục!")
+        logger.info("🎉" + "="*78)
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Voice generation error: {e}")
+        return False
+
+# === TTS REQUEST SHAPING ===
+
+# Gộp các câu rất ngắn thành một request, tách câu quá dài theo ranh giới câu
+TTS_SHAPING_CONFIG = {
+    'enabled': True,
+    'short_words': 3,            # Segment <= 3 từ được coi là ngắn
+    'max_batch_segments': 6,
+    'max_batch_words': 30,
+    'max_batch_gap': 1.5,        # Chỉ gộp segment cách nhau < 1.5s
+    'max_chars': 300,            # Text dài hơn được tách theo câu và synthesize song song
+    'silence_db': -40.0,         # Ngưỡng im lặng (so với peak) khi cắt không có WordBoundary
+    'min_silence_seconds': 0.08
+}
+
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?…。！？])\s+')
+
+def split_text_for_tts(text, max_chars=None):
+    """Tách text dài theo câu (rồi theo dấu phẩy / khoảng trắng) thành các đoạn <= max_chars"""
+    max_chars = max_chars or TTS_SHAPING_CONFIG['max_chars']
+    if len(text) <= max_chars:
+        return [text]
+
+    units = []
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(', ', 0, max_chars)
+            if cut <= 0:
+                cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            units.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            units.append(sentence)
+
+    pieces = []
+    for unit in units:
+        if pieces and len(pieces[-1]) + 1 + len(unit) <= max_chars:
+            pieces[-1] = f"{pieces[-1]} {unit}"
+        else:
+            pieces.append(unit)
+    return pieces
+
+def shape_tts_requests(segments, config=None):
+    """
+    Group subtitle segments into TTS requests.
+
+    Returns:
+        list: dicts with kind ('single' | 'batch' | 'split') and indices into segments
+    """
+    config = config or TTS_SHAPING_CONFIG
+    requests_plan = []
+    batch = []
+
+    def flush():
+        if len(batch) > 1:
+            requests_plan.append({'kind': 'batch', 'indices': list(batch)})
+        elif batch:
+            requests_plan.append({'kind': 'single', 'indices': list(batch)})
+        batch.clear()
+
+    for i, segment in enumerate(segments):
+        text = segment['text'].strip()
+        words = len(text.split())
+        if not text:
+            logger.info(f"⏭️ Bỏ qua segment {i+1} (không có text)")
+            flush()
+            continue
+        if not config['enabled']:
+            requests_plan.append({'kind': 'single', 'indices': [i]})
+            continue
+        if words <= config['short_words']:
+            if batch:
+                previous = segments[batch[-1]]
+                batch_words = sum(len(segments[j]['text'].split()) for j in batch)
+                if (segment['start'] - previous['end'] > config['max_batch_gap']
+                        or len(batch) >= config['max_batch_segments']
+                        or batch_words + words > config['max_batch_words']):
+                    flush()
+            batch.append(i)
+            continue
+        flush()
+        kind = 'split' if len(text) > config['max_chars'] else 'single'
+        requests_plan.append({'kind': kind, 'indices': [i]})
+    flush()
+    return requests_plan
+
+def join_batch_texts(texts):
+    """Nối các câu ngắn bằng khoảng trắng, giữ nguyên dấu câu gốc (không thêm dấu để không đổi ngữ điệu);
+    trả về (text, vị trí bắt đầu từng câu)"""
+    starts, position = [], 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + 1
+    return ' '.join(texts), starts
+
+def find_cuts_from_boundaries(boundaries, joined_text, line_starts):
+    """Điểm cắt (giây) giữa các câu từ Edge TTS WordBoundary; None nếu không map được"""
+    line_of_word = []
+    cursor = 0
+    for offset, duration, word in boundaries:
+        position = joined_text.find(word, cursor)
+        if position < 0:
+            return None
+        cursor = position + len(word)
+        line = max(k for k, start in enumerate(line_starts) if start <= position)
+        line_of_word.append((line, offset, offset + duration))
+
+    cuts = []
+    for line in range(1, len(line_starts)):
+        previous_words = [w for w in line_of_word if w[0] == line - 1]
+        line_words = [w for w in line_of_word if w[0] == line]
+        if not previous_words or not line_words:
+            return None
+        cuts.append((previous_words[-1][2] + line_words[0][1]) / 2)
+    return cuts
+
+def find_cuts_from_silence(samples, sample_rate, texts, config=None):
+    """Điểm cắt (giây) tại các khoảng im lặng gần vị trí dự kiến (tỷ lệ theo số ký tự); None nếu không tìm được"""
+    config = config or TTS_SHAPING_CONFIG
+    mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+    frame = max(1, int(0.01 * sample_rate))
+    frames = len(mono) // frame
+    if frames == 0:
+        return None
+    rms = np.sqrt(np.mean(mono[:frames * frame].reshape(frames, frame) ** 2, axis=1) + 1e-12)
+    threshold = rms.max() * (10 ** (config['silence_db'] / 20))
+    silent = rms < threshold
+
+    # Các khoảng im lặng đủ dài (bỏ im lặng đầu/cuối file)
+    gaps, run_start = [], None
+    for k, is_silent in enumerate(np.append(silent, False)):
+        if is_silent and run_start is None:
+            run_start = k
+        elif not is_silent and run_start is not None:
+            if run_start > 0 and k < frames and (k - run_start) * 0.01 >= config['min_silence_seconds']:
+                gaps.append((run_start + k) / 2 * 0.01)
+            run_start = None
+
+    total_chars = sum(len(t) for t in texts)
+    duration = len(mono) / sample_rate
+    cuts, cumulative = [], 0
+    for text in texts[:-1]:
+        cumulative += len(text)
+        expected = duration * cumulative / total_chars
+        candidates = [g for g in gaps if not cuts or g > cuts[-1]]
+        if not candidates:
+            return None
+        cuts.append(min(candidates, key=lambda g: abs(g - expected)))
+    return cuts
+
+async def generate_speech_batch(tts_manager, texts, voice_id, output_paths, speed=1.0):
+    """
+    Synthesize several short lines in one TTS request and cut the audio back per line.
+
+    Cuts come from Edge TTS WordBoundary offsets when available, otherwise from silence
+    detection. Returns False (callers fall back to per-line requests) if the audio
+    can't be split confidently. output_paths may be file paths or PCMSinks.
+    """
+    joined_text, line_starts = join_batch_texts(texts)
+    batch_audio = BufferSink()
+    boundaries = []
+    success = await tts_manager.generate_speech(
+        joined_text, voice_id, batch_audio, speed, fail_fast=True, boundaries=boundaries
+    )
+    if not success or batch_audio.frames == 0:
+        return False
+
+    sample_rate = AUDIO_SAMPLE_RATE
+    samples = batch_audio.samples()
+    cuts = find_cuts_from_boundaries(boundaries, joined_text, line_starts) if boundaries else None
+    if cuts is None:
+        cuts = find_cuts_from_silence(samples, sample_rate, texts)
+    if cuts is None:
+        logger.warning(f"✂️ Không cắt được batch {len(texts)} câu, chuyển sang từng câu riêng")
+        return False
+
+    edges = [0] + [int(cut * sample_rate) for cut in cuts] + [len(samples)]
+    for path, start, end in zip(output_paths, edges[:-1], edges[1:]):
+        write_audio_output(path, samples[start:end])
+        commit_audio_output(path)
+    return True
+
+async def generate_speech_split(tts_manager, text, voice_id, output_path, speed=1.0, config=None, fail_fast=False,
+                                retry_pass='retry'):
+    """Synthesize an oversized text as sentence-sized pieces in parallel, then join them"""
+    pieces = split_text_for_tts(text)
+    piece_audio = [BufferSink() for _ in pieces]
+    results = await asyncio.gather(*[
+        generate_speech_with_retry(tts_manager, piece, voice_id, audio, speed, config, fail_fast=fail_fast, retry_pass=retry_pass)
+        for piece, audio in zip(pieces, piece_audio)
+    ])
+    if not all(results):
+        return False
+    write_audio_output(output_path, np.concatenate([audio.samples() for audio in piece_audio]))
+    commit_audio_output(output_path)
+    return True
+
+def synthesize_segments(task_id, segments, voice_id, speech_rate, mixer=None):
+    """
+    First pass + deferred retries for all segments of a voice job, with request shaping.
+
+    Args:
+        mixer: TimelineMixer; when given, audio is decoded straight into each segment's
+            slot on the timeline instead of a temp WAV per segment ('file' is None)
+
+    Returns:
+        tuple: (audio_segments that succeeded, segments that still failed)
+    """
+    audio_segments = []
+    deferred_segments = []  # Segment lỗi ở lượt đầu, retry ở cuối
+    total_segments = len(segments)
+    plan = shape_tts_requests(segments)
+    processing_tasks[task_id]['tts_shaping'] = {
+        'segments': total_segments,
+        'requests': len(plan),
+        'batched_segments': sum(len(r['indices']) for r in plan if r['kind'] == 'batch'),
+        'split_segments': sum(1 for r in plan if r['kind'] == 'split')
+    }
+    logger.info(f"✂️ TTS shaping: {processing_tasks[task_id]['tts_shaping']}")
+
+    def segment_item(i):
+        segment = segments[i]
+        if mixer is not None:
+            temp_file, output = None, TimelineSlot(mixer, segment['start'])
+        else:
+            temp_file = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_segment_{i}.wav")
+            output = temp_file
+        return {
+            'file': temp_file,
+            'output': output,
+            'text': segment['text'].strip(),
+            'start': segment['start'],
+            'end': segment['end'],
+            'duration': segment['end'] - segment['start']
+        }
+
+    for request_plan in plan:
+        indices = request_plan['indices']
+        items = [segment_item(i) for i in indices]
+        first = items[0]
+        i = indices[0]
+
+        # Enhanced logging with dialogue content and timing
+        logger.info("="*80)
+        logger.info(f"🎤 TẠO LỒNG TIẾNG [{i+1}/{total_segments}] ({request_plan['kind']}, {len(items)} câu) - Thời gian: {first['start']:.1f}s → {items[-1]['end']:.1f}s")
+        for item in items:
+            logger.info(f"📝 Câu thoại: \"{item['text']}\"")
+        logger.info("="*80)
+
+        processing_tasks[task_id].update({
+            'progress': 20 + (i * 60 / total_segments),
+            'current_step': f'🎤 Đang tạo lồng tiếng [{i+1}/{total_segments}]',
+            'current_dialogue': first['text'][:50] + '...' if len(first['text']) > 50 else first['text'],
+            'current_timing': f"{first['start']:.1f}s - {items[-1]['end']:.1f}s"
+        })
+
+        if request_plan['kind'] == 'batch':
+            success = run_segment_tts(generate_speech_batch(
+                tts_manager, [item['text'] for item in items], voice_id, [item['output'] for item in items], speech_rate
+            ), *[item['output'] for item in items])
+            if not success:
+                # Batch không cắt được: từng câu đi riêng ngay trong lượt đầu
+                for item in items:
+                    if run_segment_tts(generate_speech_first_pass(tts_manager, item['text'], voice_id, item['output'], speech_rate),
+                                       item['output']):
+                        audio_segments.append(item)
+                    else:
+                        deferred_segments.append(item)
+                continue
+        elif request_plan['kind'] == 'split':
+            success = run_segment_tts(generate_speech_split(
+                tts_manager, first['text'], voice_id, first['output'], speech_rate,
+                dict(TTS_RETRY_CONFIG, max_retries=0), fail_fast=True, retry_pass='first'
+            ), first['output'])
+        else:
+            success = run_segment_tts(
+                generate_speech_first_pass(tts_manager, first['text'], voice_id, first['output'], speech_rate),
+                first['output']
+            )
+
+        if success and all(audio_output_size(item['output']) > 0 for item in items):
+            audio_size = sum(audio_output_size(item['output']) for item in items) / 1024  # KB
+            logger.info(f"✅ THÀNH CÔNG! File audio: {audio_size:.1f}KB")
+            audio_segments.extend(items)
+        else:
+            # Không chặn các segment sau: retry ở cuối job
+            logger.warning(f"⏭️ Hoãn segment, sẽ thử lại sau: \"{first['text'][:50]}...\"")
+            deferred_segments.extend(items)
+
+        logger.info("")  # Add blank line for readability
+
+    # Deferred retry queue: các segment lỗi được thử lại sau khi phần còn lại đã xong
+    failed_segments = drain_deferred_segments(task_id, deferred_segments, voice_id, speech_rate, audio_segments.append)
+    for failed in failed_segments:
+        logger.error(f"❌ THẤT BẠI! Không thể tạo TTS cho: \"{failed['text'][:50]}...\"")
+    return audio_segments, failed_segments
+
+# === PIPELINED TRANSCRIBE-AND-DUB ===
+
+# ASR → TTS → mix chạy chồng lên nhau qua một queue có giới hạn
+PIPELINE_CONFIG = {
+    'queue_size': 16,       # Backpressure: ASR chờ khi TTS chưa kịp xử lý
+    'tts_workers': int(CPU_PROFILE.get('tts_concurrency', 2))  # Số segment TTS chạy song song (timeline: AUDIO_SAMPLE_RATE / AUDIO_CHANNELS)
+}
+
+# Queue ASR → TTS của các pipeline đang chạy (gauge queue depth trên /metrics)
+active_segment_queues = weakref.WeakSet()
+
+class TimelineMixer:
+    """Cộng dồn audio từng segment vào một timeline PCM float32 ngay khi segment xong"""
+
+    def __init__(self, sample_rate=44100, channels=2, gain=1.0, duration=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.gain = gain
+        self.buffer = np.zeros((0, channels), dtype=np.float32)
+        self.length = 0  # Số frame đã có audio; buffer có thể được cấp phát dư
+        self.lock = threading.Lock()
+        if duration:
+            self.reserve(duration)
+
+    def reserve(self, duration):
+        """Cấp phát trước timeline cho duration (giây) đã biết, tránh phải grow khi mix"""
+        with self.lock:
+            self._grow(int(duration * self.sample_rate))
+
+    def _grow(self, frames):
+        # Gọi khi đang giữ lock; tăng capacity theo cấp số nhân để mix cả timeline vẫn O(N)
+        if frames <= len(self.buffer):
+            return
+        grown = np.zeros((max(frames, 2 * len(self.buffer)), self.channels), dtype=np.float32)
+        grown[:self.length] = self.buffer[:self.length]
+        self.buffer = grown
+
+    def decode(self, file_path):
+        return decode_audio_pcm(file_path, self.sample_rate, self.channels)
+
+    def add_file(self, file_path, start):
+        """Mix một segment vào timeline tại vị trí start (giây)"""
+        self.add_samples(self.decode(file_path), start)
+
+    def add_samples(self, samples, start):
+        """Cộng PCM float32 (n, channels) vào timeline tại vị trí start (giây)"""
+        self.add_frames(samples, int(start * self.sample_rate))
+
+    def add_frames(self, samples, offset):
+        """Cộng PCM vào timeline tại sample offset"""
+        samples = samples * self.gain
+        end = offset + len(samples)
+        with self.lock:
+            self._grow(end)
+            self.buffer[offset:end] += samples
+            self.length = max(self.length, end)
+
+    def write(self, output_path, duration):
+        """Ghi timeline ra WAV pcm_s16le, cắt/pad đúng duration (như amix duration=first)"""
+        total = int(duration * self.sample_rate)
+        with self.lock:
+            # Phần sau length luôn là 0 nên chỉ cần grow tới total rồi ghi view, không copy thêm
+            self._grow(total)
+            write_wav_pcm(output_path, self.buffer[:total], self.sample_rate)
+
+class TimelineSlot(BufferSink):
+    """Vị trí của một segment trên TimelineMixer: audio của lần thử hiện tại được giữ riêng,
+    chỉ cộng vào timeline khi commit() nên reset() khi retry không phải trừ lại từ timeline"""
+
+    def __init__(self, mixer, start):
+        super().__init__()
+        self.mixer = mixer
+        self.offset = int(start * mixer.sample_rate)
+        self.committed = 0  # Số frame đã nằm trên timeline
+
+    def commit(self):
+        for samples in self.chunks:
+            self.mixer.add_frames(samples, self.offset + self.committed)
+            self.committed += len(samples)
+        self.chunks = []
+
+    def reset(self):
+        self.chunks = []
+        self.frames = self.committed
+
+def mix_timeline_in_process(audio_segments, total_duration, output_path, gain=1.0):
+    """Mix các segment lên timeline trong bộ nhớ (thay filter graph adelay+amix của ffmpeg).
+    gain = voice_volume / 100, giống hệt fallback ffmpeg và stream mixer"""
+    try:
+        mixer = TimelineMixer(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, gain, total_duration)
+        for seg_audio in audio_segments:
+            mixer.add_file(seg_audio['file'], seg_audio['start'])
+        mixer.write(output_path, total_duration)
+        return True
+    except Exception as e:
+        logger.error(f"In-process timeline mix failed: {e}")
+        return False
+
+def mix_timeline_with_ffmpeg(audio_segments, total_duration, output_path, gain=1.0, task_id=None):
+    """Fallback: mix timeline bằng filter graph volume+adelay+amix của ffmpeg.
+    Cùng gain với mix_timeline_in_process để voice.wav có cùng mức âm lượng"""
+    # Prepare all inputs
+    inputs = ['-f', 'lavfi', '-i', f'anullsrc=duration={total_duration}:sample_rate={AUDIO_SAMPLE_RATE}:channel_layout=stereo']
+    for seg_audio in audio_segments:
+        inputs.extend(['-i', seg_audio['file']])
+
+    # Apply volume và delay cho từng segment
+    filter_parts = []
+    for i, seg_audio in enumerate(audio_segments, 1):
+        delay_ms = int(seg_audio["start"] * 1000)
+        filter_parts.append(f'[{i}:a]volume={gain},adelay={delay_ms}|{delay_ms}[seg{i}]')
+    if not filter_parts:
+        logger.info("No segments to mix, skipping...")
+        return False
+
+    # Mix tất cả segments với base silent audio
+    mix_inputs = '[0:a]' + ''.join(f'[seg{i}]' for i in range(1, len(audio_segments) + 1))
+    filter_complex = ';'.join(filter_parts)
+    filter_complex += f';{mix_inputs}amix=inputs={len(audio_segments)+1}:duration=first:normalize=0[out]'
+    mix_cmd = ['ffmpeg'] + inputs + [
+        '-filter_complex', filter_complex,
+        '-map', '[out]',
+        '-c:a', 'pcm_s16le',  # Uncompressed for better quality
+        output_path, '-y'
+    ]
+
+    logger.info(f"🎵 Mixing {len(audio_segments)} segments với ffmpeg (gain {gain})...")
+    result = run_ffmpeg(mix_cmd, task_id, step='🎵 Mixing timeline', duration=total_duration)
+    if result.returncode == 0:
+        logger.info("✅ Timeline audio created with ffmpeg!")
+        return True
+
+    logger.error(f"Timeline mixing failed: {result.stderr}")
+    # FALLBACK: Use simpler method
+    logger.info("🔄 Fallback: Using simple sequential mixing...")
+
+    # Create silent base audio
+    silent_cmd = [
+        'ffmpeg', '-f', 'lavfi', '-i',
+        f'anullsrc=duration={total_duration}:sample_rate={AUDIO_SAMPLE_RATE}:channel_layout=stereo',
+        output_path, '-y'
+    ]
+    run_ffmpeg(silent_cmd, job_class='interactive')
+
+    # Mix từng segment một (vẫn apply cùng gain)
+    mixed_all = True
+    temp_output = output_path.replace('.wav', '_temp.wav')
+    for seg_audio in audio_segments:
+        delay_ms = int(seg_audio["start"] * 1000)
+        mix_cmd = [
+            'ffmpeg', '-i', output_path, '-i', seg_audio['file'],
+            '-filter_complex', f'[1:a]volume={gain},adelay={delay_ms}|{delay_ms}[delayed];[0:a][delayed]amix=inputs=2:duration=first:normalize=0[out]',
+            '-map', '[out]',
+            temp_output, '-y'
+        ]
+        result = run_ffmpeg(mix_cmd, task_id, step='🎵 Mixing timeline', duration=total_duration)
+        if result.returncode == 0:
+            os.replace(temp_output, output_path)
+        else:
+            mixed_all = False
+    return mixed_all
+
+def generate_voice_pipelined(task_id, segments, language, voice_type, speech_rate, voice_volume, voice_id=None, asr=None):
+    """
+    Overlapped ASR → TTS → timeline mix for create_video_with_voice.
+
+    Segments flow through a bounded queue: TTS for a segment starts as soon as it is
+    queued, and each finished segment is mixed into the timeline right away, so total
+    latency approaches the slowest stage instead of the sum of all stages.
+
+    Args:
+        segments: subtitle segments; when empty, `asr` is used to transcribe the video
+        asr: dict with model, language, precision, asr_backend, decode_profile
+
+    Returns:
+        bool: True if every segment was voiced and the timeline was written
+    """
+    selected_voice = select_tts_voice(language, voice_type, voice_id)
+    if not selected_voice:
+        raise Exception("No suitable voice found")
+    voice_id = selected_voice.id
+    logger.info(f"🚀 Pipelined dubbing with {selected_voice.name} ({selected_voice.provider.value})")
+
+    mark_job_stage(task_id, 'asr_tts_pipeline')
+    segment_queue = queue.Queue(maxsize=PIPELINE_CONFIG['queue_size'])
+    active_segment_queues.add(segment_queue)
+    mixer = TimelineMixer(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, voice_volume / 100.0)
+    state = {'queued': 0, 'voiced': 0, 'failed': [], 'deferred': [], 'asr_position': 0.0, 'audio_seconds': 0.0, 'tts_seconds': 0.0}
+    state_lock = threading.Lock()
+    pipeline_start = time.time()
+
+    def report_progress():
+        with state_lock:
+            done, queued = state['voiced'] + len(state['failed']) + len(state['deferred']), state['queued']
+            asr_part = ''
+            if asr and state['audio_seconds'] > 0:
+                asr_part = f"ASR {format_timestamp(state['asr_position'])[:8]} / {format_timestamp(state['audio_seconds'])[:8]} | "
+                asr_fraction = state['asr_position'] / state['audio_seconds']
+            else:
+                asr_fraction = 1.0
+        tts_fraction = done / queued if queued else 0.0
+        processing_tasks[task_id].update({
+            'progress': 20 + int(50 * (asr_fraction + tts_fraction) / 2),
+            'current_step': f'🚀 Pipeline: {asr_part}TTS {done}/{queued}'
+        })
+
+    def tts_worker():
+        while True:
+            item = segment_queue.get()
+            if item is None:
+                break
+            index, segment = item
             text = segment['text'].strip()
-            start_time = segment['start']
-            end_time = segment['end']
-            
-            # Enhanced logging with dialogue content and timing
-            logger.info("="*80)
-            logger.info(f"🎤 TẠO LỒNG TIẾNG [{i+1}/{total_segments}] - Thời gian: {start_time:.1f}s → {end_time:.1f}s")
-            logger.info(f"📝 Câu thoại: \"{text}\"")
-            logger.info("="*80)
-            
-            processing_tasks[task_id].update({
-                'progress': progress,
-                'current_step': f'🎤 Đang tạo lồng tiếng [{i+1}/{total_segments}]',
-                'current_dialogue': text[:50] + '...' if len(text) > 50 else text,
-                'current_timing': f'{start_time:.1f}s - {end_time:.1f}s'
-            })
-            
-            if not text:
-                logger.info(f"⏭️ Bỏ qua segment {i+1} (không có text)")
-                continue
-            
-            # Create temp audio file for this segment
-            temp_audio = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_segment_{i}.wav")
-            
-            # Run TTS using TTSManager with retry mechanism
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            success = loop.run_until_complete(
-                generate_speech_with_retry(tts_manager, text, voice_id, temp_audio, speech_rate)
-            )
-            loop.close()
-            
-            if success and os.path.exists(temp_audio):
-                audio_size = os.path.getsize(temp_audio) / 1024  # KB
-                logger.info(f"✅ THÀNH CÔNG! File audio: {audio_size:.1f}KB")
-                audio_segments.append({
-                    'file': temp_audio,
-                    'start': segment['start'],
-                    'end': segment['end'],
-                    'duration': segment['end'] - segment['start']
-                })
+            if TTS_STREAM_CONFIG['enabled']:
+                # Audio được decode thẳng vào slot của segment trên timeline
+                temp_audio, output = None, TimelineSlot(mixer, segment['start'])
             else:
-                logger.error(f"❌ THẤT BẠI! Không thể tạo TTS cho: \"{text[:50]}...\"")
-                
-            logger.info("")  # Add blank line for readability
-        
-        # === KIỂM TRA TẤT CẢ SEGMENTS PHẢI THÀNH CÔNG ===
-        all_successful, success_count, fail_count = check_all_segments_successful(audio_segments, total_segments)
-        
-        logger.info("🎭" + "="*78)
-        logger.info(f"🎭 KIỂM TRA KẾT QUẢ TẠO LỒNG TIẾNG")
-        logger.info(f"✅ Thành công: {success_count}/{total_segments} segments")
-        if fail_count > 0:
-            logger.error(f"❌ Thất bại: {fail_count} segments")
-        logger.info("🎭" + "="*78)
-        
-        if not all_successful:
-            error_msg = f"❌ DỪNG XỬ LÝ: {fail_count}/{total_segments} segments thất bại! Tất cả câu thoại phải được tạo thành công mới có thể tiếp tục."
-            logger.error(error_msg)
-            
-            # Cleanup any successful temp files
-            for seg_audio in audio_segments:
-                if os.path.exists(seg_audio['file']):
-                    try:
-                        os.remove(seg_audio['file'])
-                    except:
-                        pass
-            
-            # Update task status with specific error
-            processing_tasks[task_id].update({
-                'status': 'error',
-                'error': f'Voice generation failed: {fail_count}/{total_segments} segments failed to generate. All segments must succeed.',
-                'success_count': success_count,
-                'fail_count': fail_count,
-                'total_segments': total_segments
-            })
-            
-            return False
-        
-        logger.info("🎊 TẤT CẢ SEGMENTS ĐÃ THÀNH CÔNG! Tiếp tục tạo timeline audio...")
-        
-        # FIXED: Combine all segments into one audio file (volume will be applied during video combination)
-        voice_output = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_voice.wav")
-        
-        if audio_segments:
-            logger.info(f"🎛️ Tạo timeline audio (volume sẽ được apply trong video combination)")
-            
-            # Create timeline audio using FFmpeg với volume control
+                temp_audio = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_pipeline_{index}.wav")
+                output = temp_audio
+            tts_start = time.time()
+            if len(text) > TTS_SHAPING_CONFIG['max_chars']:
+                first_pass = generate_speech_split(tts_manager, text, voice_id, output, speech_rate,
+                                                   dict(TTS_RETRY_CONFIG, max_retries=0), fail_fast=True, retry_pass='first')
+            else:
+                first_pass = generate_speech_first_pass(tts_manager, text, voice_id, output, speech_rate)
+            success = bool(text) and run_segment_tts(first_pass, output)
+            item = {'index': index, 'text': text, 'file': temp_audio, 'output': output,
+                    'start': segment['start'], 'end': segment['end']}
+            if not success and text:
+                # Deferred retry queue: không chặn các segment khỏe phía sau
+                logger.warning(f"⏭️ Hoãn segment {index}, sẽ thử lại sau: \"{text[:50]}...\"")
+                with state_lock:
+                    state['deferred'].append(item)
+            else:
+                mix_segment(item)
+            with state_lock:
+                state['tts_seconds'] += time.time() - tts_start
+            report_progress()
+
+    def mix_segment(item):
+        try:
+            if item['file'] is not None:
+                mixer.add_file(item['file'], item['start'])  # Slot streaming đã nằm sẵn trên timeline
+            with state_lock:
+                state['voiced'] += 1
+        except Exception as e:
+            logger.error(f"❌ Mixing segment {item['index']} failed: {e}")
+            with state_lock:
+                state['failed'].append(item['index'])
+        finally:
+            if item['file'] and os.path.exists(item['file']):
+                os.remove(item['file'])
+
+    def enqueue(segment):
+        if not segment['text'].strip():
+            logger.info(f"⏭️ Bỏ qua segment {segment['start']:.1f}s (không có text)")
+            return
+        with state_lock:
+            index = state['queued']
+            state['queued'] += 1
+        segment_queue.put((index, segment))  # Chặn khi queue đầy (backpressure)
+
+    workers = [threading.Thread(target=tts_worker, daemon=True) for _ in range(PIPELINE_CONFIG['tts_workers'])]
+    for worker in workers:
+        worker.start()
+
+    asr_result = None
+    asr_seconds = 0.0
+    try:
+        if segments:
             total_duration = max(seg['end'] for seg in segments)
-            
-            # PHƯƠNG PHÁP MỚI: Tạo filter_complex cho tất cả segments cùng lúc
-            # Volume sẽ được apply trong video combination để tránh double application
-            
-            # Prepare all inputs
-            inputs = ['-f', 'lavfi', '-i', f'anullsrc=duration={total_duration}:sample_rate=44100:channel_layout=stereo']
-            
-            for seg_audio in audio_segments:
-                inputs.extend(['-i', seg_audio['file']])
-            
-            # Build filter complex for each segment (no volume to avoid double application)
-            filter_parts = []
-            
-            # Apply volume và delay cho từng segment
-            for i, seg_audio in enumerate(audio_segments, 1):
-                delay_ms = int(seg_audio["start"] * 1000)
-                # Áp dụng volume cố định theo slider người dùng
-                normalized_volume = voice_volume / 100.0  # Convert từ 0-100 về 0-1
-                filter_parts.append(f'[{i}:a]volume={normalized_volume},adelay={delay_ms}|{delay_ms}[seg{i}]')
-            
-            # Mix tất cả segments với base silent audio
-            if filter_parts:
-                # Tạo danh sách inputs cho amix
-                mix_inputs = '[0:a]'  # Base silent audio
-                for i in range(len(audio_segments)):
-                    mix_inputs += f'[seg{i+1}]'
-                
-                # Combine all filters
-                filter_complex = ';'.join(filter_parts)
-                filter_complex += f';{mix_inputs}amix=inputs={len(audio_segments)+1}:duration=first:normalize=0[out]'
-                
-                # Build final command
-                mix_cmd = ['ffmpeg'] + inputs + [
-                    '-filter_complex', filter_complex,
-                    '-map', '[out]',
-                    '-c:a', 'pcm_s16le',  # Uncompressed for better quality
-                    voice_output, '-y'
-                ]
-                
-                logger.info(f"🎵 Mixing {len(audio_segments)} segments without volume (volume applied later)...")
-                result = subprocess.run(mix_cmd, capture_output=True, text=True)
-                
-                if result.returncode != 0:
-                    logger.error(f"Timeline mixing failed: {result.stderr}")
-                    # FALLBACK: Use simpler method
-                    logger.info("🔄 Fallback: Using simple sequential mixing...")
-                    
-                    # Create silent base audio
-                    silent_cmd = [
-                        'ffmpeg', '-f', 'lavfi', '-i', 
-                        f'anullsrc=duration={total_duration}:sample_rate=44100:channel_layout=stereo',
-                        voice_output, '-y'
-                    ]
-                    subprocess.run(silent_cmd, capture_output=True)
-                    
-                    # Mix each segment (không apply volume để tránh double application)
-                    for seg_audio in audio_segments:
-                        temp_output = voice_output.replace('.wav', '_temp.wav')
-                        mix_cmd = [
-                            'ffmpeg', '-i', voice_output, '-i', seg_audio['file'],
-                            '-filter_complex', f'[1:a]adelay={int(seg_audio["start"]*1000)}|{int(seg_audio["start"]*1000)}[delayed];[0:a][delayed]amix=inputs=2:duration=first:normalize=0[out]',
-                            '-map', '[out]',
-                            temp_output, '-y'
-                        ]
-                        result = subprocess.run(mix_cmd, capture_output=True)
-                        if result.returncode == 0:
-                            os.replace(temp_output, voice_output)
-                else:
-                    logger.info("✅ Timeline audio created (without volume)!")
-            
-            # Cleanup temp files
-            for seg_audio in audio_segments:
-                if os.path.exists(seg_audio['file']):
-                    os.remove(seg_audio['file'])
-        
-        # Update task with voice path
-        processing_tasks[task_id]['voice_path'] = voice_output
-        logger.info(f"Voice generated for task {task_id}")
-        
-        # Log completion summary
-        successful_segments = len(audio_segments)
-        logger.info("🎉" + "="*78)
-        logger.info(f"🎉 HOÀN THÀNH TẠO LỒNG TIẾNG!")
-        logger.info(f"✅ Thành công: {successful_segments}/{total_segments} segments")
-        logger.info(f"🎯 Điều kiện: TẤT CẢ segments đã thành công - được phép tiếp tục!")
-        logger.info("🎉" + "="*78)
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"Voice generation error: {e}")
+            mixer.reserve(total_duration)
+            for segment in segments:
+                enqueue(segment)
+        else:
+            # ASR producer: mỗi window transcribe xong được đưa thẳng vào TTS
+            audio_path = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_audio.wav")
+            if not extract_audio_from_video(processing_tasks[task_id]['file_path'], audio_path, task_id):
+                raise Exception("Failed to extract audio")
+            engine = get_asr_engine(asr['model'], asr['precision'], asr.get('asr_backend'))
+            audio_input = whisper.load_audio(audio_path).astype(np.float32)
+            os.remove(audio_path)
+            mixer.reserve(len(audio_input) / whisper.audio.SAMPLE_RATE)
+            _, decode_options = get_decode_options(asr.get('decode_profile'))
+
+            def on_batch(new_segments, all_segments, position, total):
+                with state_lock:
+                    state['asr_position'], state['audio_seconds'] = position, total
+                processing_tasks[task_id]['segments'] = list(all_segments)
+                for segment in new_segments:
+                    enqueue(segment)
+                report_progress()
+
+            asr_start = time.time()
+            asr_result = transcribe_in_windows(engine, audio_input, asr.get('language'), on_batch, **decode_options)
+            asr_seconds = time.time() - asr_start
+            segments = asr_result['segments']
+            total_duration = len(audio_input) / whisper.audio.SAMPLE_RATE
+    finally:
+        for _ in workers:
+            segment_queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    # Drain deferred retry queue sau khi các segment khỏe đã được mix
+    for item in drain_deferred_segments(task_id, state['deferred'], voice_id, speech_rate, mix_segment):
+        logger.error(f"❌ THẤT BẠI! Không thể tạo TTS cho: \"{item['text'][:50]}...\"")
+        state['failed'].append(item['index'])
+        if item['file'] and os.path.exists(item['file']):
+            os.remove(item['file'])
+
+    if asr_result is not None:
+        srt_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_subtitles.srt")
+        with open(srt_path, 'w', encoding='utf-8') as f:
+            f.write(create_srt_content(segments))
+        processing_tasks[task_id].update({
+            'srt_path': srt_path,
+            'segments': segments,
+            'transcription': asr_result['text'],
+            'detected_language': asr_result.get('language', 'unknown'),
+            'model_used': asr['model']
+        })
+
+    total_segments = state['queued']
+    fail_count = len(state['failed'])
+    if fail_count > 0:
+        logger.error(f"❌ DỪNG XỬ LÝ: {fail_count}/{total_segments} segments thất bại!")
+        processing_tasks[task_id].update({
+            'status': 'error',
+            'error': f'Voice generation failed: {fail_count}/{total_segments} segments failed to generate. All segments must succeed.',
+            'success_count': state['voiced'],
+            'fail_count': fail_count,
+            'total_segments': total_segments
+        })
         return False
 
-def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path, subtitle_style=None, voice_volume=50.0):
-    """Ghép video, audio và subtitles với hỗ trợ overlay bar"""
+    voice_output = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_voice.wav")
+    mark_job_stage(task_id, 'mix')
+    with TIMELINE_MIX_SECONDS.time(method='pipeline'):
+        mixer.write(voice_output, total_duration)
+
+    pipeline_stats = {
+        'segments': total_segments,
+        'asr_seconds': round(asr_seconds, 2),
+        'tts_seconds': round(state['tts_seconds'], 2),
+        'deferred_segments': len(state['deferred']),
+        'wall_seconds': round(time.time() - pipeline_start, 2),
+        'tts_workers': PIPELINE_CONFIG['tts_workers'],
+        'streamed_to_timeline': TTS_STREAM_CONFIG['enabled']
+    }
+    processing_tasks[task_id].update({
+        'voice_path': voice_output,
+        'pipeline_stats': pipeline_stats
+    })
+    logger.info(f"🎉 Pipelined dubbing done: {pipeline_stats}")
+    return True
+
+def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path, subtitle_style=None, voice_volume=50.0,
+                                  task_id=None, progress_range=None):
+    """Ghép video, audio và subtitles với hỗ trợ overlay bar (progress_range: % của task trong lúc encode)"""
     logger.info("🚀 STARTING FIXED VIDEO COMBINATION")
     logger.info(f"Video: {video_path}")
     logger.info(f"Audio: {audio_path}")
@@ -1052,7 +4036,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             # Step 1: Check if original video has audio
             probe_cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'a:0', 
                         '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', video_path]
-            probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
+            probe_result = run_ffmpeg(probe_cmd)
             has_original_audio = probe_result.returncode == 0 and 'audio' in probe_result.stdout
             
             # Step 2: Create video with voice audio
@@ -1078,7 +4062,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                 ]
             
             logger.info("Step 1: Adding voice audio to video...")
-            result = subprocess.run(audio_cmd, capture_output=True, text=True, timeout=300)
+            result = run_ffmpeg(audio_cmd, task_id, step='🎵 Adding voice audio', job_class='render')
             
             if result.returncode != 0:
                 logger.error(f"Audio mixing failed: {result.stderr}")
@@ -1089,7 +4073,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     '-c:v', 'copy', '-c:a', 'aac',
                     '-shortest', temp_video_audio, '-y'
                 ]
-                result = subprocess.run(fallback_cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(fallback_cmd, task_id, step='🎵 Adding voice audio', job_class='render')
                 if result.returncode != 0:
                     raise Exception(f"Audio processing failed: {result.stderr}")
             
@@ -1107,7 +4091,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             
             # Convert SRT to ASS trong working directory
             srt_to_ass_cmd = ['ffmpeg', '-i', working_srt, working_ass, '-y']
-            ass_result = subprocess.run(srt_to_ass_cmd, capture_output=True, text=True)
+            ass_result = run_ffmpeg(srt_to_ass_cmd, job_class='interactive')
             
             subtitle_success = False
             
@@ -1119,7 +4103,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     '-c:a', 'copy',
                     output_path, '-y'
                 ]
-                result = subprocess.run(subtitle_cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(subtitle_cmd, task_id, progress_range, '🔥 Burning subtitles', job_class='render')
                 subtitle_success = result.returncode == 0
                 
                 if subtitle_success:
@@ -1136,7 +4120,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     '-c:a', 'copy',
                     output_path, '-y'
                 ]
-                result = subprocess.run(subtitle_cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(subtitle_cmd, task_id, progress_range, '🔥 Burning subtitles', job_class='render')
                 subtitle_success = result.returncode == 0
                 
                 if subtitle_success:
@@ -1147,8 +4131,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             # Final fallback: Video without subtitles
             if not subtitle_success:
                 logger.warning("All subtitle methods failed, creating video without subtitles")
-                subprocess.run(['ffmpeg', '-i', temp_video_audio, '-c', 'copy', output_path, '-y'], 
-                             capture_output=True)
+                run_ffmpeg(['ffmpeg', '-i', temp_video_audio, '-c', 'copy', output_path, '-y'], job_class='interactive')
                 success = True
             else:
                 success = True
@@ -1169,7 +4152,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             # Check if video has audio
             probe_cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'a:0', 
                         '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', video_path]
-            probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
+            probe_result = run_ffmpeg(probe_cmd)
             has_audio = probe_result.returncode == 0 and 'audio' in probe_result.stdout
             
             if has_audio:
@@ -1191,7 +4174,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     output_path, '-y'
                 ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = run_ffmpeg(cmd, task_id, progress_range, '🎵 Mixing audio', job_class='render')
             success = result.returncode == 0
             
         elif srt_path:
@@ -1206,7 +4189,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             shutil.copy2(srt_path, working_srt)
             
             # Try ASS first with Vietnamese font
-            ass_result = subprocess.run(['ffmpeg', '-i', working_srt, working_ass, '-y'], capture_output=True)
+            ass_result = run_ffmpeg(['ffmpeg', '-i', working_srt, working_ass, '-y'], job_class='interactive')
             subtitle_success = False
             
             if ass_result.returncode == 0 and os.path.exists(working_ass):
@@ -1217,7 +4200,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     '-c:a', 'copy',
                     output_path, '-y'
                 ]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(cmd, task_id, progress_range, '🔥 Burning subtitles', job_class='render')
                 subtitle_success = result.returncode == 0
                 
                 if subtitle_success:
@@ -1233,7 +4216,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
                     '-c:a', 'copy',
                     output_path, '-y'
                 ]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(cmd, task_id, progress_range, '🔥 Burning subtitles', job_class='render')
                 subtitle_success = result.returncode == 0
                 
                 if subtitle_success:
@@ -1243,7 +4226,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             if not subtitle_success:
                 logger.warning("Subtitle processing failed, copying video without subtitles")
                 cmd = ['ffmpeg', '-i', video_path, '-c', 'copy', output_path, '-y']
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+                result = run_ffmpeg(cmd, task_id, progress_range, '📦 Copying video', job_class='interactive')
                 success = True
             else:
                 success = True
@@ -1257,7 +4240,7 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
             # Case 4: Video only
             logger.info("🎯 Strategy: Simple video copy")
             cmd = ['ffmpeg', '-i', video_path, '-c', 'copy', output_path, '-y']
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = run_ffmpeg(cmd, task_id, progress_range, '📦 Copying video', job_class='interactive')
             success = result.returncode == 0
         
         # Final verification
@@ -1284,9 +4267,101 @@ def combine_video_audio_subtitles(video_path, audio_path, srt_path, output_path,
         logger.error(f"Traceback: {traceback.format_exc()}")
         return False
 
+# Packaging mặc định cho video cuối: fast-start MP4 luôn bật, HLS tùy chọn theo request
+RENDER_PACKAGING_DEFAULTS = {
+    'faststart': True,   # Chuyển moov atom lên đầu file để trình duyệt phát ngay
+    'hls': False,        # Xuất thêm HLS (playlist + segments) trong cùng lần encode
+    'hls_time': 4        # Độ dài mỗi segment HLS (giây)
+}
+
+def resolve_packaging_options(packaging):
+    """Gộp packaging của request với RENDER_PACKAGING_DEFAULTS; ValueError nếu packaging không hợp lệ"""
+    if packaging is None:
+        packaging = {}
+    if not isinstance(packaging, dict):
+        raise ValueError("'packaging' must be an object, e.g. {\"hls\": true}")
+    options = dict(RENDER_PACKAGING_DEFAULTS)
+    options.update(packaging)
+    hls_time = options.get('hls_time')
+    if isinstance(hls_time, bool) or not isinstance(hls_time, (int, float)) or hls_time < 1:
+        raise ValueError("'packaging.hls_time' must be a number of seconds >= 1")
+    return options
+
+def get_hls_output_dir(output_path):
+    """Thư mục chứa playlist/segments HLS tương ứng với một file output MP4"""
+    return os.path.splitext(output_path)[0] + '_hls'
+
+def build_packaging_output_args(output_path, packaging=None):
+    """
+    Build the output half of an ffmpeg command for the requested packaging.
+
+    Plain MP4 keeps the old ``output_path -y`` form (optionally with
+    ``-movflags +faststart``). When HLS is requested the tee muxer writes the
+    MP4 and an event playlist from the same encode, so the playlist is
+    playable as soon as its first segment is on disk.
+
+    Returns:
+        tuple: (ffmpeg args, hls playlist path or None)
+    """
+    options = resolve_packaging_options(packaging)
+
+    # Segment của lần render trước không còn khớp với video mới (kể cả khi lần này không xuất HLS)
+    hls_dir = get_hls_output_dir(output_path)
+    if os.path.isdir(hls_dir):
+        import shutil
+        shutil.rmtree(hls_dir, ignore_errors=True)
+
+    if not options.get('hls'):
+        args = ['-movflags', '+faststart'] if options.get('faststart') else []
+        return args + [output_path, '-y'], None
+
+    os.makedirs(hls_dir, exist_ok=True)
+    playlist_path = os.path.join(hls_dir, 'playlist.m3u8')
+    segment_pattern = os.path.join(hls_dir, 'segment_%05d.ts')
+
+    mp4_options = 'movflags=+faststart' if options.get('faststart') else ''
+    hls_options = ':'.join([
+        'f=hls',
+        f"hls_time={int(options.get('hls_time', 4))}",
+        'hls_list_size=0',
+        'hls_playlist_type=event',
+        'hls_flags=independent_segments',
+        f'hls_segment_filename={segment_pattern}'
+    ])
+    tee_target = f'[{mp4_options}]{output_path}|[{hls_options}]{playlist_path}'
+
+    # Tee muxer cần global header để MP4 và MPEG-TS dùng chung một bitstream
+    # -force_key_frames để cắt segment đúng hls_time thay vì theo GOP của x264
+    args = [
+        '-force_key_frames', f"expr:gte(t,n_forced*{int(options.get('hls_time', 4))})",
+        '-flags', '+global_header',
+        '-f', 'tee', tee_target, '-y'
+    ]
+    return args, playlist_path
+
+def publish_hls_playlist(task_id, output_path, packaging=None):
+    """Ghi URL playlist HLS vào task trước khi encode để frontend phát ngay khi có segment đầu"""
+    options = resolve_packaging_options(packaging)
+    if not options.get('hls'):
+        # Render lại không có HLS: bỏ playlist của lần trước khỏi task
+        for key in ('hls_dir', 'hls_playlist_path', 'hls_url'):
+            processing_tasks[task_id].pop(key, None)
+        return
+    
+    hls_dir = get_hls_output_dir(output_path)
+    processing_tasks[task_id].update({
+        'hls_dir': hls_dir,
+        'hls_playlist_path': os.path.join(hls_dir, 'playlist.m3u8'),
+        'hls_url': f'/api/hls/{task_id}/playlist.m3u8'
+    })
+
 def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path, output_path, 
-                                             subtitle_style=None, voice_volume=50.0, overlay_settings=None, audio_settings=None):
-    """Ghép video, audio, subtitles và overlay bar với audio level normalization"""
+                                             subtitle_style=None, voice_volume=50.0, overlay_settings=None, audio_settings=None,
+                                             packaging=None, task_id=None, progress_range=None):
+    """
+    Ghép video, audio, subtitles và overlay bar với audio level normalization.
+    progress_range: (start, end) % của task được cập nhật theo tiến độ encode thật của ffmpeg.
+    """
     logger.info("🚀 STARTING VIDEO COMBINATION WITH OVERLAY")
     logger.info(f"Video: {video_path}")
     logger.info(f"Audio: {audio_path}")
@@ -1295,9 +4370,10 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
     logger.info(f"Output: {output_path}")
     
     try:
+        mark_job_stage(task_id, 'prepare_render')
         # First, get video dimensions for overlay calculation
         probe_cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', video_path]
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
+        probe_result = run_ffmpeg(probe_cmd)
         
         video_width, video_height = 1920, 1080  # Default
         if probe_result.returncode == 0:
@@ -1329,7 +4405,7 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
             # Try ASS conversion first
             working_ass = 'temp_subtitles.ass'
             ass_cmd = ['ffmpeg', '-i', working_srt, working_ass, '-y']
-            ass_result = subprocess.run(ass_cmd, capture_output=True)
+            ass_result = run_ffmpeg(ass_cmd, job_class='interactive')
             
             if ass_result.returncode == 0 and os.path.exists(working_ass):
                 filters.append(f'ass={working_ass}')
@@ -1350,7 +4426,7 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
             # Check if original video has audio
             probe_cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'a:0', 
                         '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', video_path]
-            probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
+            probe_result = run_ffmpeg(probe_cmd)
             has_original_audio = probe_result.returncode == 0 and 'audio' in probe_result.stdout
             
             # Calculate volume levels from audio settings
@@ -1369,6 +4445,7 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
             
             # ENHANCED AUDIO ANALYSIS
             logger.info(f"🔍 ANALYZING AUDIO LEVELS...")
+            mark_job_stage(task_id, 'loudness_analysis')
             
             # Analyze voice audio levels
             voice_levels = analyze_audio_levels(audio_path)
@@ -1383,7 +4460,7 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
                 temp_orig_audio = 'temp_original_audio.wav'
                 try:
                     extract_cmd = ['ffmpeg', '-i', video_path, '-q:a', '0', '-map', 'a', temp_orig_audio, '-y']
-                    extract_result = subprocess.run(extract_cmd, capture_output=True, timeout=30)
+                    extract_result = run_ffmpeg(extract_cmd, task_id, step='🔍 Extracting original audio')
                     
                     if extract_result.returncode == 0 and os.path.exists(temp_orig_audio):
                         original_levels = analyze_audio_levels(temp_orig_audio)
@@ -1494,12 +4571,18 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
         # Output settings
         cmd.extend([
             '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
-            '-c:a', 'aac', '-b:a', '128k',
-            output_path, '-y'
+            '-c:a', 'aac', '-b:a', '128k'
         ])
+        output_args, hls_playlist = build_packaging_output_args(output_path, packaging)
+        cmd.extend(output_args)
+        if hls_playlist:
+            logger.info(f"📺 HLS packaging enabled: {hls_playlist}")
         
         logger.info(f"🎬 Running FFmpeg command...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        mark_job_stage(task_id, 'encode')
+        result = run_ffmpeg(cmd, task_id, progress_range, '🎬 Rendering final video', job_class='render')
+        if result.returncode == 0:
+            FINAL_ENCODE_SECONDS.observe(result.elapsed)
         
         # Cleanup temp files
         for temp_file in ['temp_subtitles.srt', 'temp_subtitles.ass']:
@@ -1512,6 +4595,7 @@ def combine_video_audio_subtitles_with_overlay(video_path, audio_path, srt_path,
             
             # FINAL AUDIO VERIFICATION
             logger.info(f"🔍 VERIFYING FINAL AUDIO LEVELS...")
+            mark_job_stage(task_id, 'verify_audio')
             final_levels = analyze_audio_levels(output_path)
             logger.info(f"📊 Final Video Audio Analysis:")
             logger.info(f"   Mean Level: {final_levels['mean_volume']:.1f} dB")
@@ -1650,6 +4734,7 @@ def create_overlay_bar_filter(overlay_settings, video_width=1920, video_height=1
     
     return filter_chain
 
+@LOUDNESS_ANALYSIS_SECONDS.time()
 def analyze_audio_levels(audio_path):
     """Phân tích mức độ âm lượng của file audio với multiple methods"""
     default_levels = {'mean_volume': -20.0, 'max_volume': -3.0, 'rms_db': -20.0}
@@ -1665,7 +4750,7 @@ def analyze_audio_levels(audio_path):
             'ffmpeg', '-i', audio_path, '-af', 'volumedetect', 
             '-f', 'null', '-', '-v', 'info'
         ]
-        result = subprocess.run(detect_cmd, capture_output=True, text=True, timeout=30)
+        result = run_ffmpeg(detect_cmd, job_class='analysis')
         
         # Parse from stderr (volumedetect outputs to stderr)
         if result.returncode == 0 and result.stderr:
@@ -1690,7 +4775,7 @@ def analyze_audio_levels(audio_path):
                     '-i', f'amovie={audio_path},astats=metadata=1:reset=1', 
                     '-show_entries', 'frame_tags=lavfi.astats.Overall.RMS_level,lavfi.astats.Overall.Peak_level',
                     '-of', 'csv=p=0', '-v', 'quiet']
-        astats_result = subprocess.run(astats_cmd, capture_output=True, text=True)
+        astats_result = run_ffmpeg(astats_cmd, job_class='analysis')
         
         if astats_result.returncode == 0 and astats_result.stdout.strip():
             lines = astats_result.stdout.strip().split('\n')
@@ -1735,7 +4820,7 @@ def analyze_audio_levels(audio_path):
             'ffmpeg', '-i', audio_path, '-af', 'loudnorm=print_format=json', 
             '-f', 'null', '-', '-v', 'warning'
         ]
-        loudnorm_result = subprocess.run(loudnorm_cmd, capture_output=True, text=True, timeout=30)
+        loudnorm_result = run_ffmpeg(loudnorm_cmd, job_class='analysis')
         
         if loudnorm_result.returncode == 0 and loudnorm_result.stderr:
             import re
@@ -1762,7 +4847,7 @@ def analyze_audio_levels(audio_path):
         # Method 4: Basic probe (last resort)
         logger.debug("Trying basic probe...")
         basic_cmd = ['ffprobe', '-i', audio_path, '-v', 'quiet', '-print_format', 'json', '-show_format']
-        basic_result = subprocess.run(basic_cmd, capture_output=True, text=True, timeout=30)
+        basic_result = run_ffmpeg(basic_cmd)
         
         if basic_result.returncode == 0:
             # File exists and is readable, use smart defaults based on file type
@@ -1911,6 +4996,7 @@ def create_overlay_bar_filter(overlay_settings, video_width=1920, video_height=1
     
     return filter_chain
 
+@LOUDNESS_ANALYSIS_SECONDS.time()
 def analyze_audio_levels(audio_path):
     """Phân tích mức độ âm lượng của file audio với multiple methods"""
     default_levels = {'mean_volume': -20.0, 'max_volume': -3.0, 'rms_db': -20.0}
@@ -1926,7 +5012,7 @@ def analyze_audio_levels(audio_path):
             'ffmpeg', '-i', audio_path, '-af', 'volumedetect', 
             '-f', 'null', '-', '-v', 'info'
         ]
-        result = subprocess.run(detect_cmd, capture_output=True, text=True, timeout=30)
+        result = run_ffmpeg(detect_cmd, job_class='analysis')
         
         # Parse from stderr (volumedetect outputs to stderr)
         if result.returncode == 0 and result.stderr:
@@ -1951,7 +5037,7 @@ def analyze_audio_levels(audio_path):
                     '-i', f'amovie={audio_path},astats=metadata=1:reset=1', 
                     '-show_entries', 'frame_tags=lavfi.astats.Overall.RMS_level,lavfi.astats.Overall.Peak_level',
                     '-of', 'csv=p=0', '-v', 'quiet']
-        astats_result = subprocess.run(astats_cmd, capture_output=True, text=True)
+        astats_result = run_ffmpeg(astats_cmd, job_class='analysis')
         
         if astats_result.returncode == 0 and astats_result.stdout.strip():
             lines = astats_result.stdout.strip().split('\n')
@@ -1996,7 +5082,7 @@ def analyze_audio_levels(audio_path):
             'ffmpeg', '-i', audio_path, '-af', 'loudnorm=print_format=json', 
             '-f', 'null', '-', '-v', 'warning'
         ]
-        loudnorm_result = subprocess.run(loudnorm_cmd, capture_output=True, text=True, timeout=30)
+        loudnorm_result = run_ffmpeg(loudnorm_cmd, job_class='analysis')
         
         if loudnorm_result.returncode == 0 and loudnorm_result.stderr:
             import re
@@ -2023,7 +5109,7 @@ def analyze_audio_levels(audio_path):
         # Method 4: Basic probe (last resort)
         logger.debug("Trying basic probe...")
         basic_cmd = ['ffprobe', '-i', audio_path, '-v', 'quiet', '-print_format', 'json', '-show_format']
-        basic_result = subprocess.run(basic_cmd, capture_output=True, text=True, timeout=30)
+        basic_result = run_ffmpeg(basic_cmd)
         
         if basic_result.returncode == 0:
             # File exists and is readable, use smart defaults based on file type
@@ -2077,17 +5163,21 @@ def upload_video():
     filename = secure_filename(file.filename)
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
     
+    # Initialize task status (task có trước khi lưu file để timeline ghi được stage upload)
+    processing_tasks[task_id] = {
+        'status': 'uploading',
+        'progress': 0,
+        'file_path': file_path,
+        'filename': filename,
+        'created_at': time.time()
+    }
+    
     try:
-        file.save(file_path)
-        
-        # Initialize task status
-        processing_tasks[task_id] = {
-            'status': 'uploaded',
-            'progress': 0,
-            'file_path': file_path,
-            'filename': filename,
-            'created_at': time.time()
-        }
+        mark_job_stage(task_id, 'upload', 'upload_video')
+        with UPLOAD_SECONDS.time():
+            file.save(file_path)
+        finish_job_stage()
+        processing_tasks[task_id]['status'] = 'uploaded'
         
         logger.info(f"Video uploaded: {filename} (Task: {task_id})")
         
@@ -2098,6 +5188,8 @@ def upload_video():
         })
         
     except Exception as e:
+        finish_job_stage(e)
+        processing_tasks.pop(task_id, None)
         logger.error(f"Upload error: {e}")
         return jsonify({'error': 'Upload failed'}), 500
 
@@ -2110,6 +5202,14 @@ def generate_subtitles(task_id):
     data = request.get_json()
     model_name = data.get('model', 'large-v3')
     language = data.get('language', 'auto')
+    precision = resolve_whisper_precision(data.get('precision'))  # fp32 / int8 (CPU)
+    asr_backend = data.get('asr_backend')  # openai_whisper / faster_whisper (mặc định theo ASR_CONFIG)
+    # mode='draft_refine': model nhỏ cho draft SRT ngay, model lớn chỉ chạy lại đoạn không tự tin
+    draft_model = data.get('draft_model', REFINE_CONFIG['draft_model'])
+    draft_refine = data.get('mode') == 'draft_refine' and draft_model != model_name
+    decode_profile, decode_options = get_decode_options(data.get('decode_profile'))  # fast / balanced / accurate
+    stream_segments = data.get('stream', False) is True  # Opt-in: publish segments lên task theo từng window
+    profile_mode = resolve_profile_mode(data.get('profile'))  # true / 'sampling' / 'cprofile'
     
     def process_video():
         try:
@@ -2122,8 +5222,9 @@ def generate_subtitles(task_id):
             file_path = processing_tasks[task_id]['file_path']
             
             # Extract audio
+            mark_job_stage(task_id, 'extract_audio', 'generate_subtitles')
             audio_path = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_audio.wav")
-            if not extract_audio_from_video(file_path, audio_path):
+            if not extract_audio_from_video(file_path, audio_path, task_id, (10, 30)):
                 raise Exception("Failed to extract audio")
             
             processing_tasks[task_id].update({
@@ -2131,17 +5232,14 @@ def generate_subtitles(task_id):
                 'current_step': f'Loading Whisper {model_name}...'
             })
             
-            # Load Whisper model
-            model = get_whisper_model(model_name)
+            # Load ASR engine (openai-whisper / faster-whisper)
+            mark_job_stage(task_id, 'load_model', 'generate_subtitles')
+            engine = get_asr_engine(draft_model if draft_refine else model_name, precision, asr_backend)
             
             processing_tasks[task_id].update({
                 'progress': 50,
                 'current_step': 'Transcribing audio...'
             })
-            
-            # Perform transcription using the robust model loading logic
-            if not model:
-                raise Exception(f"Whisper model '{model_name}' could not be loaded.")
 
             # Log GPU memory usage if applicable
             if gpu_manager.get_device().type == 'cuda':
@@ -2149,34 +5247,85 @@ def generate_subtitles(task_id):
                 logger.info(f"GPU memory before transcription: {vram_used:.2f}GB / {gpu_manager.get_vram_gb():.2f}GB")
 
             # --- FORCE FP32 PIPELINE FOR WHISPER SUBTITLE GENERATION ---
-            logger.info(f"Starting transcription on {gpu_manager.get_info()} with FP32 precision (forced, no FP16).")
+            logger.info(f"Starting transcription on {gpu_manager.get_info()} with {engine.backend.value} ({precision} weights, no FP16).")
 
             # 1. Load audio as float32 only
+            mark_job_stage(task_id, 'transcribe', 'generate_subtitles')
             logger.info("Loading audio for transcription (forced float32)...")
             audio_input = whisper.load_audio(audio_path).astype(np.float32)
 
-            # 2. Manual language detection using float32
-            transcription_language = language
-            if transcription_language == 'auto' or transcription_language is None:
-                logger.info("Performing manual language detection (float32 pipeline)...")
-                try:
-                    audio_for_detection = whisper.pad_or_trim(audio_input)
-                    mel = whisper.log_mel_spectrogram(audio_for_detection).to(model.device)
-                    # Ensure mel is float32
-                    mel = mel.float()
-                    _, probs = model.detect_language(mel)
-                    detected_language = max(probs, key=probs.get)
-                    transcription_language = detected_language
-                    logger.info(f"Language manually detected: {transcription_language}")
-                except Exception as e:
-                    logger.error(f"Manual language detection failed: {e}. Proceeding without language hint.")
-                    transcription_language = None
+            # 2. Language detection + transcription (engine giữ nguyên segments contract của Whisper)
+            transcribe_start = time.time()
+            logger.info(f"Decode profile: {decode_profile} {decode_options}")
+            if stream_segments:
+                # Progress theo vị trí audio: 50 → 80 (hoặc 65 khi còn bước refine)
+                progress_end = 65 if draft_refine else 80
+
+                def publish_batch(new_segments, all_segments, position, total):
+                    processing_tasks[task_id].update({
+                        'progress': 50 + int((progress_end - 50) * position / total) if total > 0 else progress_end,
+                        'current_step': f'Transcribing audio... {format_timestamp(position)[:8]} / {format_timestamp(total)[:8]}',
+                        'segments': list(all_segments),
+                        'segments_partial': True,
+                        'transcribed_seconds': round(position, 2)
+                    })
 
-            # 3. Transcribe using float32 audio (no fp16 argument)
-            logger.info(f"Starting transcription with language: {transcription_language or 'auto'} (FP32 pipeline)")
-            result = model.transcribe(audio_input, language=transcription_language, verbose=True)
+                result = transcribe_in_windows(engine, audio_input, language, publish_batch, **decode_options)
+            else:
+                result = engine.transcribe(audio_input, language=language, **decode_options)
+            
+            refine_stats = None
+            if draft_refine:
+                # Publish draft SRT ngay để timeline editor hiển thị trong lúc refine
+                draft_srt_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_subtitles.srt")
+                with open(draft_srt_path, 'w', encoding='utf-8') as f:
+                    f.write(create_srt_content(result['segments']))
+                draft_seconds = time.time() - transcribe_start
+                processing_tasks[task_id].update({
+                    'progress': 65,
+                    'current_step': f'Draft ready ({draft_model}) - refining with {model_name}...',
+                    'srt_path': draft_srt_path,
+                    'segments': result['segments'],
+                    'draft_ready': True,
+                    'draft_model': draft_model
+                })
+                
+                mark_job_stage(task_id, 'refine', 'generate_subtitles')
+                refine_engine = get_asr_engine(model_name, precision, asr_backend)
+                result, refine_stats = refine_transcription(
+                    result, audio_input, refine_engine, result.get('language') or language, **decode_options
+                )
+                refine_stats.update({
+                    'draft_model': draft_model,
+                    'refine_model': model_name,
+                    'draft_seconds': round(draft_seconds, 2),
+                    'refine_seconds': round(time.time() - transcribe_start - draft_seconds, 2)
+                })
+                logger.info(f"🔁 Refine stats: {refine_stats}")
+            transcribe_seconds = time.time() - transcribe_start
             # --- END FP32 ONLY PIPELINE ---
             
+            # Speed/accuracy report để so sánh fp32 vs int8 giữa các job
+            audio_seconds = len(audio_input) / whisper.audio.SAMPLE_RATE
+            segment_logprobs = [seg['avg_logprob'] for seg in result['segments'] if 'avg_logprob' in seg]
+            transcription_stats = {
+                'asr_backend': engine.backend.value,
+                'decode_profile': decode_profile,
+                'streamed': bool(stream_segments),
+                'precision': precision,
+                'device': str(gpu_manager.get_device()),
+                'threads': torch.get_num_threads(),
+                'audio_seconds': round(audio_seconds, 2),
+                'transcribe_seconds': round(transcribe_seconds, 2),
+                'real_time_factor': round(transcribe_seconds / audio_seconds, 3) if audio_seconds > 0 else None,
+                'mean_avg_logprob': round(sum(segment_logprobs) / len(segment_logprobs), 4) if segment_logprobs else None
+            }
+            logger.info(f"⏱️ Transcription stats: {transcription_stats}")
+            if audio_seconds > 0:
+                TRANSCRIPTION_SECONDS_PER_AUDIO_MINUTE.observe(transcribe_seconds / (audio_seconds / 60),
+                                                               backend=engine.backend.value, model=model_name,
+                                                               precision=precision)
+            
             # Memory cleanup after transcription
             if GPU_CONFIG.get("memory_optimization", True):
                 import gc
@@ -2191,6 +5340,7 @@ def generate_subtitles(task_id):
             })
             
             # Create SRT content
+            mark_job_stage(task_id, 'write_srt', 'generate_subtitles')
             srt_content = create_srt_content(result['segments'])
             
             # Save SRT file
@@ -2206,6 +5356,14 @@ def generate_subtitles(task_id):
                 'transcription': result['text'],
                 'detected_language': result.get('language', 'unknown'),
                 'model_used': model_name,
+                'whisper_precision': precision,
+                'asr_backend': engine.backend.value,
+                'transcription_mode': 'draft_refine' if draft_refine else 'standard',
+                'decode_profile': decode_profile,
+                'segments_partial': False,
+                'segments_streamed': bool(stream_segments) and not draft_refine,
+                'refine_stats': refine_stats,
+                'transcription_stats': transcription_stats,
                 'segments': result['segments']
             })
             
@@ -2213,9 +5371,11 @@ def generate_subtitles(task_id):
             if os.path.exists(audio_path):
                 os.remove(audio_path)
                 
+            finish_job_stage()
             logger.info(f"Subtitles generated for task {task_id}")
             
         except Exception as e:
+            finish_job_stage(e)
             logger.error(f"Subtitle generation error: {e}")
             processing_tasks[task_id].update({
                 'status': 'error',
@@ -2223,7 +5383,7 @@ def generate_subtitles(task_id):
             })
     
     # Start processing in background
-    thread = threading.Thread(target=process_video)
+    thread = threading.Thread(target=run_profiled, args=(task_id, 'generate_subtitles', profile_mode, process_video))
     thread.daemon = True
     thread.start()
     
@@ -2338,8 +5498,6 @@ def generate_voice(task_id):
             final_voice_id = selected_voice.id
             provider_name = selected_voice.provider.value
             
-            # Create TTS for each segment
-            audio_segments = []
             total_segments = len(segments)
             
             # Log overview of voice generation task
@@ -2351,54 +5509,12 @@ def generate_voice(task_id):
             logger.info(f"⚡ Tốc độ: {speech_rate}x")
             logger.info("🎬" + "="*78)
             
-            for i, segment in enumerate(segments):
-                progress = 20 + (i * 60 / total_segments)
-                
-                text = segment['text'].strip()
-                start_time = segment['start']
-                end_time = segment['end']
-                
-                # Enhanced logging with dialogue content and timing
-                logger.info("="*80)
-                logger.info(f"🎤 TẠO LỒNG TIẾNG [{i+1}/{total_segments}] - Thời gian: {start_time:.1f}s → {end_time:.1f}s")
-                logger.info(f"📝 Câu thoại: \"{text}\"")
-                logger.info("="*80)
-                
-                processing_tasks[task_id].update({
-                    'progress': progress,
-                    'current_step': f'🎤 Đang tạo lồng tiếng [{i+1}/{total_segments}]',
-                    'current_dialogue': text[:50] + '...' if len(text) > 50 else text,
-                    'current_timing': f'{start_time:.1f}s - {end_time:.1f}s'
-                })
-                
-                if not text:
-                    logger.info(f"⏭️ Bỏ qua segment {i+1} (không có text)")
-                    continue
-                
-                # Create temp audio file for this segment
-                temp_audio = os.path.join(app.config['TEMP_FOLDER'], f"{task_id}_segment_{i}.wav")
-                
-                # Run TTS using new Multi-AI TTS Manager with retry mechanism
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                success = loop.run_until_complete(
-                    generate_speech_with_retry(tts_manager, text, final_voice_id, temp_audio, speech_rate)
-                )
-                loop.close()
-                
-                if success and os.path.exists(temp_audio):
-                    audio_size = os.path.getsize(temp_audio) / 1024  # KB
-                    logger.info(f"✅ THÀNH CÔNG! File audio: {audio_size:.1f}KB")
-                    audio_segments.append({
-                        'file': temp_audio,
-                        'start': segment['start'],
-                        'end': segment['end'],
-                        'duration': segment['end'] - segment['start']
-                    })
-                else:
-                    logger.error(f"❌ THẤT BẠI! Không thể tạo TTS cho: \"{text[:50]}...\"")
-                    
-                logger.info("")  # Add blank line for readability
+            # Create TTS for each segment (request shaping + deferred retry queue)
+            mark_job_stage(task_id, 'tts', 'generate_voice')
+            stream_mixer = (TimelineMixer(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, voice_volume / 100.0,
+                                          duration=max((seg['end'] for seg in segments), default=0))
+                                if TTS_STREAM_CONFIG['enabled'] else None)
+            audio_segments, failed_segments = synthesize_segments(task_id, segments, final_voice_id, speech_rate, stream_mixer)
             
             # === KIỂM TRA TẤT CẢ SEGMENTS PHẢI THÀNH CÔNG ===
             all_successful, success_count, fail_count = check_all_segments_successful(audio_segments, total_segments)
@@ -2416,7 +5532,7 @@ def generate_voice(task_id):
                 
                 # Cleanup any successful temp files
                 for seg_audio in audio_segments:
-                    if os.path.exists(seg_audio['file']):
+                    if seg_audio['file'] and os.path.exists(seg_audio['file']):
                         try:
                             os.remove(seg_audio['file'])
                         except:
@@ -2440,82 +5556,29 @@ def generate_voice(task_id):
                 'current_step': 'Combining audio segments...'
             })
             
-            # FIXED: Combine all segments into one audio file (volume will be applied during video combination)
+            # FIXED: Combine all segments into one audio file (voice_volume apply khi mix, mọi đường mix cùng một gain)
             voice_output = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_voice.wav")
             
             if audio_segments:
-                logger.info(f"🎛️ Tạo timeline audio (volume sẽ được apply trong video combination)")
+                logger.info(f"🎛️ Tạo timeline audio (voice volume {voice_volume}%)")
                 
-                # Create timeline audio using FFmpeg với volume control
+                # Create timeline audio với volume control
                 total_duration = max(seg['end'] for seg in segments)
                 
-                # PHƯƠNG PHÁP MỚI: Tạo filter_complex cho tất cả segments cùng lúc
-                # Volume sẽ được apply trong video combination để tránh double application
-                
-                # Prepare all inputs
-                inputs = ['-f', 'lavfi', '-i', f'anullsrc=duration={total_duration}:sample_rate=44100:channel_layout=stereo']
-                
-                for seg_audio in audio_segments:
-                    inputs.extend(['-i', seg_audio['file']])
-                
-                # Build filter complex for each segment (no volume to avoid double application)
-                filter_parts = []
-                
-                # Apply delay cho từng segment (không apply volume ở đây để tránh double application)
-                for i, seg_audio in enumerate(audio_segments, 1):
-                    delay_ms = int(seg_audio["start"] * 1000)
-                    # Chỉ apply delay, volume sẽ được apply trong video combination
-                    filter_parts.append(f'[{i}:a]adelay={delay_ms}|{delay_ms}[seg{i}]')
-                
-                # Mix tất cả segments với base silent audio
-                if filter_parts:
-                    # Tạo danh sách inputs cho amix
-                    mix_inputs = '[0:a]'  # Base silent audio
-                    for i in range(len(audio_segments)):
-                        mix_inputs += f'[seg{i+1}]'
-                    
-                    # Combine all filters
-                    filter_complex = ';'.join(filter_parts)
-                    filter_complex += f';{mix_inputs}amix=inputs={len(audio_segments)+1}:duration=first:normalize=0[out]'
-                    
-                    # Build final command
-                    mix_cmd = ['ffmpeg'] + inputs + [
-                        '-filter_complex', filter_complex,
-                        '-map', '[out]',
-                        '-c:a', 'pcm_s16le',  # Uncompressed for better quality
-                        voice_output, '-y'
-                    ]
-                    
-                    logger.info(f"🎵 Mixing {len(audio_segments)} segments without volume (volume applied later)...")
-                    result = subprocess.run(mix_cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        logger.error(f"Timeline mixing failed: {result.stderr}")
-                        # FALLBACK: Use simpler method
-                        logger.info("🔄 Fallback: Using simple sequential mixing...")
-                        
-                        # Create silent base audio
-                        silent_cmd = [
-                            'ffmpeg', '-f', 'lavfi', '-i', 
-                            f'anullsrc=duration={total_duration}:sample_rate=44100:channel_layout=stereo',
-                            voice_output, '-y'
-                        ]
-                        subprocess.run(silent_cmd, capture_output=True)
-                        
-                        # Mix each segment (không apply volume để tránh double application)
-                        for seg_audio in audio_segments:
-                            temp_output = voice_output.replace('.wav', '_temp.wav')
-                            mix_cmd = [
-                                'ffmpeg', '-i', voice_output, '-i', seg_audio['file'],
-                                '-filter_complex', f'[1:a]adelay={int(seg_audio["start"]*1000)}|{int(seg_audio["start"]*1000)}[delayed];[0:a][delayed]amix=inputs=2:duration=first:normalize=0[out]',
-                                '-map', '[out]',
-                                temp_output, '-y'
-                            ]
-                            result = subprocess.run(mix_cmd, capture_output=True)
-                            if result.returncode == 0:
-                                os.replace(temp_output, voice_output)
+                # In-process mix (float32 timeline); ffmpeg filter graph chỉ còn là fallback
+                mark_job_stage(task_id, 'mix')
+                mix_start, mix_method = time.monotonic(), 'in_process'
+                if stream_mixer is not None:
+                    stream_mixer.write(voice_output, total_duration)
+                    mix_method = 'stream'
+                    logger.info("✅ Timeline audio streamed in-process!")
+                elif mix_timeline_in_process(audio_segments, total_duration, voice_output, voice_volume / 100.0):
+                    logger.info("✅ Timeline audio created in-process!")
                 else:
-                    logger.info("No segments to mix, skipping...")
+                    mix_method = 'ffmpeg'
+                    FALLBACKS_TOTAL.inc(kind='ffmpeg_mix')
+                    mix_timeline_with_ffmpeg(audio_segments, total_duration, voice_output, voice_volume / 100.0, task_id)
+                TIMELINE_MIX_SECONDS.observe(time.monotonic() - mix_start, method=mix_method)
             
             processing_tasks[task_id].update({
                 'status': 'voice_completed',
@@ -2539,11 +5602,15 @@ def generate_voice(task_id):
             logger.info(f"Voice generated for task {task_id}")
             
         except Exception as e:
+            finish_job_stage(e)
             logger.error(f"Voice generation error: {e}")
             processing_tasks[task_id].update({
                 'status': 'error',
                 'error': str(e)
             })
+        finally:
+            # Các nhánh return sớm (segment lỗi) cũng đóng stage đang chạy
+            finish_job_stage()
     
     # Start processing in background
     thread = threading.Thread(target=process_tts)
@@ -2568,9 +5635,15 @@ def create_video_with_voice(task_id):
         speech_rate = data.get('speech_rate', 1.5)
         voice_volume = data.get('voice_volume', 83.0)  # Default voice volume 83%
         segments = data.get('segments', [])
+        # pipeline=True: ASR → TTS → mix chạy chồng lên nhau; không có segments thì transcribe luôn
+        pipelined = bool(data.get('pipeline', False))
         
-        if not segments and 'segments' not in processing_tasks[task_id]:
+        if not segments and 'segments' not in processing_tasks[task_id] and not pipelined:
             return jsonify({'error': 'No subtitle segments found'}), 400
+        try:
+            resolve_packaging_options(data.get('packaging'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         def process_combined():
             try:
@@ -2579,6 +5652,7 @@ def create_video_with_voice(task_id):
                     'progress': 10,
                     'current_step': 'Preparing files...'
                 })
+                mark_job_stage(task_id, 'prepare', 'create_video_with_voice')
                 
                 # Get paths
                 video_path = processing_tasks[task_id]['file_path']
@@ -2601,7 +5675,7 @@ def create_video_with_voice(task_id):
                                 srt_content = f.read()
                             segments = parse_srt_content(srt_content)
                     
-                    if not segments:
+                    if not segments and not pipelined:
                         raise Exception("No subtitle segments found for voice generation")
                     
                     processing_tasks[task_id].update({
@@ -2609,10 +5683,23 @@ def create_video_with_voice(task_id):
                         'current_step': 'Generating voice first...'
                     })
                     
-                    # Generate voice using internal function
-                    voice_success = generate_voice_internal(
-                        task_id, segments, language, voice_type, speech_rate, voice_volume, voice_id
-                    )
+                    if pipelined:
+                        asr_options = None if segments else {
+                            'model': data.get('model', 'large-v3'),
+                            'language': data.get('source_language', 'auto'),
+                            'precision': resolve_whisper_precision(data.get('precision')),
+                            'asr_backend': data.get('asr_backend'),
+                            'decode_profile': data.get('decode_profile')
+                        }
+                        voice_success = generate_voice_pipelined(
+                            task_id, segments, language, voice_type, speech_rate, voice_volume, voice_id, asr_options
+                        )
+                        srt_path = processing_tasks[task_id].get('srt_path')
+                    else:
+                        # Generate voice using internal function
+                        voice_success = generate_voice_internal(
+                            task_id, segments, language, voice_type, speech_rate, voice_volume, voice_id
+                        )
                     
                     if not voice_success or not os.path.exists(audio_path):
                         raise Exception("Failed to generate voice")
@@ -2625,6 +5712,9 @@ def create_video_with_voice(task_id):
                 # Parse audio settings from request
                 audio_settings = data.get('audio_settings')
                 
+                # Parse packaging options (fast-start MP4 / HLS) from request
+                packaging = data.get('packaging')
+                
                 # Output path
                 output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}_final.mp4")
                 
@@ -2632,11 +5722,13 @@ def create_video_with_voice(task_id):
                     'progress': 70,
                     'current_step': 'Creating final video...'
                 })
+                publish_hls_playlist(task_id, output_path, packaging)
                 
                 # Combine everything with overlay support
                 success = combine_video_audio_subtitles_with_overlay(
                     video_path, audio_path, srt_path, output_path, 
-                    subtitle_style=None, voice_volume=voice_volume, overlay_settings=overlay_settings, audio_settings=audio_settings
+                    subtitle_style=None, voice_volume=voice_volume, overlay_settings=overlay_settings, audio_settings=audio_settings,
+                    packaging=packaging, task_id=task_id, progress_range=(70, 99)
                 )
                 
                 if success:
@@ -2647,10 +5739,12 @@ def create_video_with_voice(task_id):
                         'final_video_path': output_path
                     })
                     logger.info(f"Combined video created for task {task_id}: {output_path}")
+                    finish_job_stage()
                 else:
                     raise Exception("Failed to create final video")
                     
             except Exception as e:
+                finish_job_stage(e)
                 logger.error(f"Combined processing error: {e}")
                 processing_tasks[task_id].update({
                     'status': 'error',
@@ -2675,6 +5769,11 @@ def create_final_video(task_id):
         return jsonify({'error': 'Task not found'}), 404
     
     data = request.get_json()
+    profile_mode = resolve_profile_mode(data.get('profile'))  # true / 'sampling' / 'cprofile'
+    try:
+        resolve_packaging_options(data.get('packaging'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     def process_final():
         try:
@@ -2683,6 +5782,7 @@ def create_final_video(task_id):
                 'progress': 10,
                 'current_step': 'Preparing final video...'
             })
+            mark_job_stage(task_id, 'prepare', 'create_final_video')
             
             # Get file paths
             video_path = processing_tasks[task_id]['file_path']
@@ -2714,10 +5814,15 @@ def create_final_video(task_id):
             # Get voice volume
             voice_volume = data.get('voice_volume', 83.0)
             
+            # Parse packaging options (fast-start MP4 / HLS) from request
+            packaging = data.get('packaging')
+            publish_hls_playlist(task_id, output_path, packaging)
+            
             # Combine everything with overlay support
             success = combine_video_audio_subtitles_with_overlay(
                 video_path, audio_path, srt_path, output_path, 
-                subtitle_style=None, voice_volume=voice_volume, overlay_settings=overlay_settings, audio_settings=audio_settings
+                subtitle_style=None, voice_volume=voice_volume, overlay_settings=overlay_settings, audio_settings=audio_settings,
+                packaging=packaging, task_id=task_id, progress_range=(50, 99)
             )
             
             if success:
@@ -2728,10 +5833,12 @@ def create_final_video(task_id):
                     'final_video_path': output_path
                 })
                 logger.info(f"Combined video created for task {task_id}: {output_path}")
+                finish_job_stage()
             else:
                 raise Exception("Failed to create final video")
                 
         except Exception as e:
+            finish_job_stage(e)
             logger.error(f"Final video creation error: {e}")
             processing_tasks[task_id].update({
                 'status': 'error',
@@ -2739,7 +5846,7 @@ def create_final_video(task_id):
             })
     
     # Start processing in background  
-    thread = threading.Thread(target=process_final)
+    thread = threading.Thread(target=run_profiled, args=(task_id, 'create_final_video', profile_mode, process_final))
     thread.daemon = True
     thread.start()
     
@@ -2753,23 +5860,102 @@ def get_status(task_id):
     
     return jsonify(processing_tasks[task_id])
 
+def artifact_etag(file_path):
+    """Strong ETag từ mtime + size (không hash nội dung, file có thể vài GB)"""
+    stat = os.stat(file_path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def send_json_with_etag(body, etag):
+    """Trả JSON đã serialize sẵn kèm ETag; If-None-Match khớp → 304 không body"""
+    response = Response(mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    response.set_data(body)
+    return response
+
+def send_artifact(file_path, mimetype=None, as_attachment=True):
+    """
+    Serve an output file through flask.send_file with ETag, If-None-Match, Range and If-Range.
+
+    - Matching If-None-Match returns 304; one byte range returns 206, an unsatisfiable one 416.
+    - Multi-range requests get the whole file as 200 (allowed by RFC 9110; werkzeug would 416).
+    - SENDFILE_MODE='x-sendfile' (USE_X_SENDFILE) / 'x-accel' hands the body to the front proxy,
+      which serves ranges from the file itself; otherwise send_file wraps the file with the
+      server's wsgi.file_wrapper (gunicorn/waitress use os.sendfile).
+    """
+    etag = artifact_etag(file_path)
+    sendfile_mode = app.config.get('SENDFILE_MODE')
+    byte_range = request.range
+    if sendfile_mode or (byte_range is not None and len(byte_range.ranges) > 1):
+        request.environ.pop('HTTP_RANGE', None)
+
+    if sendfile_mode == 'x-accel':
+        # nginx: OUTPUT_FOLDER phải được khai báo là internal location SENDFILE_ACCEL_PREFIX
+        rel_path = os.path.relpath(file_path, app.config['OUTPUT_FOLDER']).replace(os.sep, '/')
+        response = Response(mimetype=mimetype or mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{app.config['SENDFILE_ACCEL_PREFIX'].rstrip('/')}/{rel_path}"
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
+        response.set_etag(etag)
+        response.last_modified = os.stat(file_path).st_mtime
+        response.cache_control.no_cache = True  # Luôn revalidate: file được ghi đè khi render lại
+        return response.make_conditional(request.environ)
+
+    response = send_file(os.path.abspath(file_path), mimetype=mimetype, as_attachment=as_attachment,
+                         conditional=True, etag=etag)
+    response.accept_ranges = 'bytes'  # werkzeug chỉ gửi khi request có Range; <video> cần biết để seek
+    return response
+
 @app.route('/api/download/<task_id>/<file_type>')
 def download_file(task_id, file_type):
     """Download file results"""
     if task_id not in processing_tasks:
         return jsonify({'error': 'Task not found'}), 404
-    
+
     task = processing_tasks[task_id]
-    
-    if file_type == 'srt' and 'srt_path' in task:
-        return send_file(task['srt_path'], as_attachment=True)
-    elif file_type == 'voice' and 'voice_path' in task:
-        return send_file(task['voice_path'], as_attachment=True)
-    elif file_type == 'final' and 'final_video_path' in task:
-        return send_file(task['final_video_path'], as_attachment=True)
+
+    file_keys = {
+        'srt': ('srt_path', 'application/x-subrip'),
+        'voice': ('voice_path', 'audio/wav'),
+        'final': ('final_video_path', 'video/mp4'),
+        # Artifacts của request chạy với 'profile'
+        'profile_stacks': ('profile_stacks_path', 'text/plain'),
+        'profile_allocations': ('profile_allocations_path', 'application/json'),
+        'profile_pstats': ('profile_pstats_path', 'application/octet-stream'),
+    }
+
+    if file_type in file_keys and file_keys[file_type][0] in task:
+        file_key, mimetype = file_keys[file_type]
+        file_path = task[file_key]
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'File not found'}), 404
+        # ?inline=1 để <video> trong trình duyệt preview/seek trực tiếp
+        as_attachment = request.args.get('inline') != '1'
+        return send_artifact(file_path, mimetype, as_attachment=as_attachment)
     else:
         return jsonify({'error': 'File not found'}), 404
 
+@app.route('/api/hls/<task_id>/<path:filename>')
+def stream_hls(task_id, filename):
+    """Phát HLS playlist/segments của video cuối (có thể đang encode)"""
+    if task_id not in processing_tasks:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    hls_dir = processing_tasks[task_id].get('hls_dir')
+    if not hls_dir or not os.path.isdir(hls_dir):
+        return jsonify({'error': 'HLS output not found'}), 404
+    hls_dir = os.path.abspath(hls_dir)  # send_from_directory resolve path tương đối theo app.root_path
+    
+    if filename.endswith('.m3u8'):
+        # Playlist dạng event thay đổi liên tục trong lúc encode, không cho cache
+        response = send_from_directory(hls_dir, filename, mimetype='application/vnd.apple.mpegurl', max_age=0)
+        response.cache_control.no_cache = True
+        return response
+    return send_from_directory(hls_dir, filename, mimetype='video/mp2t')
+
 @app.route('/api/gpu_status')
 def gpu_status():
     """Lấy thông tin GPU"""
@@ -2784,7 +5970,31 @@ def gpu_status():
         'device': str(gpu_manager.device),
         'info': gpu_manager.get_info(),
         'vram_gb': gpu_manager.get_vram_gb(),
-        'should_use_fp16': gpu_manager.should_use_fp16()
+        'should_use_fp16': gpu_manager.should_use_fp16(),
+        'whisper_precision': resolve_whisper_precision(),
+        'whisper_precisions': WHISPER_PRECISIONS,
+        'cpu_threads': torch.get_num_threads()
+    })
+
+@app.route('/api/tuning')
+def tuning_status():
+    """Giá trị tuning đang áp dụng (từ cpu_config.json lúc khởi động, env có thể ghi đè)"""
+    tuning = CPU_PROFILE.get('tuning', {})
+    return jsonify({
+        'profile_path': CPU_CONFIG_PATH,
+        'profile_loaded': bool(CPU_PROFILE),
+        'autotuned_at': tuning.get('autotuned_at'),
+        'machine_profile': tuning.get('machine_profile'),
+        'active': {
+            'whisper_precision': WHISPER_CPU_CONFIG['precision'],
+            'whisper_intra_op_threads': torch.get_num_threads(),
+            'whisper_inter_op_threads': torch.get_num_interop_threads(),
+            'tts_concurrency': PIPELINE_CONFIG['tts_workers'],
+            'ffmpeg_threads': FFMPEG_CONFIG['threads'],
+            'ffmpeg_max_processes': FFMPEG_CONFIG['max_processes'],
+            'render_parallelism': FFMPEG_JOB_CLASSES['render']['max_concurrent']
+        },
+        'measurements': tuning.get('measurements')
     })
 
 @app.route('/api/cleanup', methods=['POST'])
@@ -2809,8 +6019,29 @@ def cleanup():
                     os.remove(task[file_key])
                     cleaned_count += 1
             
+            if task.get('hls_dir') and os.path.isdir(task['hls_dir']):
+                import shutil
+                shutil.rmtree(task['hls_dir'], ignore_errors=True)
+                cleaned_count += 1
+            
             del processing_tasks[task_id]
         
+        # Cleanup HLS segments / profile artifacts (mọi job của task, không chỉ job cuối ghi vào task)
+        # không còn task nào trỏ tới: task đã dọn ở trên hoặc bị mất sau restart
+        for entry in os.listdir(app.config['OUTPUT_FOLDER']):
+            entry_path = os.path.join(app.config['OUTPUT_FOLDER'], entry)
+            if entry.split('_')[0] in processing_tasks:
+                continue
+            if entry.endswith('_hls') and os.path.isdir(entry_path):
+                if entry.split('_')[0] in old_tasks or current_time - os.path.getmtime(entry_path) > 86400:
+                    import shutil
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                    cleaned_count += 1
+            elif '_profile_' in entry and os.path.isfile(entry_path):
+                if entry.split('_')[0] in old_tasks or current_time - os.path.getmtime(entry_path) > 86400:
+                    os.remove(entry_path)
+                    cleaned_count += 1
+        
         # Cleanup temp files
         for temp_file in os.listdir(app.config['TEMP_FOLDER']):
             temp_path = os.path.join(app.config['TEMP_FOLDER'], temp_file)
@@ -2831,7 +6062,7 @@ def cleanup():
 
 @app.route('/api/voices')
 def get_available_voices():
-    """Get available voices from all TTS providers"""
+    """Get available voices from all TTS providers (precomputed body, ETag → 304)"""
     try:
         language = request.args.get('language')
         provider = request.args.get('provider')
@@ -2844,38 +6075,10 @@ def get_available_voices():
             except ValueError:
                 return jsonify({'error': f'Invalid provider: {provider}'}), 400
         
-        voices = tts_manager.get_available_voices(language, provider_enum)
-        
-        # Convert voices to JSON-serializable format
-        voices_data = []
-        for voice in voices:
-            voices_data.append({
-                'id': voice.id,
-                'name': voice.name,
-                'language': voice.language,
-                'gender': voice.gender,
-                'provider': voice.provider.value,
-                'quality': voice.quality,
-                'description': voice.description,
-                'sample_rate': voice.sample_rate
-            })
-        
-        # Group by provider for better organization
-        providers_data = {}
-        for voice in voices_data:
-            provider_key = voice['provider']
-            if provider_key not in providers_data:
-                providers_data[provider_key] = {
-                    'name': provider_key.replace('_', ' ').title(),
-                    'voices': []
-                }
-            providers_data[provider_key]['voices'].append(voice)
-        
-        return jsonify({
-            'providers': providers_data,
-            'total_voices': len(voices_data),
-            'available_providers': list(providers_data.keys())
-        })
+        # Discovery chạy nền: lần gọi này trả catalogue hiện có, ETag đổi khi có thêm voice
+        tts_manager.ensure_voice_discovery()
+        body, etag = tts_manager.registry.voices_response(language, provider_enum)
+        return send_json_with_etag(body, etag)
         
     except Exception as e:
         logger.error(f"Error getting voices: {e}")
@@ -2885,6 +6088,7 @@ def get_available_voices():
 def get_tts_providers():
     """Get available TTS providers with their status"""
     try:
+        tts_manager.ensure_voice_discovery()
         providers_info = []
         
         for provider in TTSProvider:
@@ -2902,18 +6106,51 @@ def get_tts_providers():
                 'voice_count': len(provider_voices),
                 'requires_api_key': requires_api_key,
                 'api_key_configured': api_key_configured,
-                'status': 'ready' if (is_available and api_key_configured) else 'requires_setup'
+                'status': 'ready' if (is_available and api_key_configured) else 'requires_setup',
+                'rate_limit': tts_manager.rate_limiters[provider].stats(),
+                'hedging': tts_manager.hedge_trackers[provider].stats(),
+                'discovery': tts_manager.registry.discovery.get(provider, {}).get('status')
             })
         
-        return jsonify({
+        # Rate limit / hedging stats thay đổi theo tải: ETag theo nội dung, client vẫn nhận 304 khi không đổi
+        body = json.dumps({
             'providers': providers_info,
             'total_providers': len(providers_info)
-        })
+        }, ensure_ascii=False).encode('utf-8')
+        return send_json_with_etag(body, hashlib.sha1(body).hexdigest()[:16])
         
     except Exception as e:
         logger.error(f"Error getting providers: {e}")
         return jsonify({'error': 'Failed to get providers'}), 500
 
+def _count_jobs_by_status():
+    counts = {}
+    for task in list(processing_tasks.values()):
+        key = (task.get('status', 'unknown'),)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def _count_resident_whisper_models():
+    counts = {}
+    for cache_key in list(whisper_models):
+        key = ('faster_whisper' if cache_key.startswith('faster:') else 'openai_whisper',)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+metrics.gauge('jobs', 'Tasks by status', _count_jobs_by_status, labels=('status',))
+metrics.gauge('tts_pipeline_queue_depth', 'Segments waiting for TTS in running pipelines',
+              lambda: {(): sum(q.qsize() for q in list(active_segment_queues))})
+metrics.gauge('ffmpeg_active_processes', 'Running ffmpeg/ffprobe processes',
+              lambda: {(name,): n for name, n in ffmpeg_executor.stats()['active'].items()}, labels=('job_class',))
+metrics.gauge('ffmpeg_queued_jobs', 'ffmpeg jobs waiting for a concurrency slot',
+              lambda: {(name,): n for name, n in ffmpeg_executor.stats()['queued'].items()}, labels=('job_class',))
+metrics.gauge('whisper_models_resident', 'Whisper models loaded in memory',
+              _count_resident_whisper_models, labels=('backend',))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics theo Prometheus text format (sizing phần cứng từ số liệu thật)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 if __name__ == '__main__':
@@ -2940,4 +6177,5 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
     else:
         logger.info(f"App running locally on http://localhost:{port}")
-        app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
\ No newline at end of file
+        # APP_DEBUG=0: không debugger/reloader (load test, benchmark cần đúng một process phục vụ)
+        app.run(host='0.0.0.0', port=port, debug=os.getenv('APP_DEBUG', '1') != '0', threaded=True)
\ No newline at end of file
@@ -82,14 +82,15 @@ def create_optimized_config(system_info):
     print("\n📝 Creating optimized config...")
     
     # Determine optimal settings based on system
+    # CPU-only: large-v3 quá chậm kể cả khi quantize, medium int8 là mức cân bằng tốt nhất
     if system_info['memory_gb'] >= 16:
-        whisper_model = 'large-v3'
+        whisper_model = 'medium'
         batch_size = 16
     elif system_info['memory_gb'] >= 8:
-        whisper_model = 'medium'
+        whisper_model = 'small'
         batch_size = 8
     else:
-        whisper_model = 'small'
+        whisper_model = 'base'
         batch_size = 4
     
     config = {
@@ -100,7 +101,12 @@ def create_optimized_config(system_info):
         "batch_size": batch_size,
         "memory_limit_gb": system_info['memory_gb'] * 0.8,
         "temp_cleanup": True,
-        "progress_monitoring": True
+        "progress_monitoring": True,
+        "whisper_cpu": {
+            "precision": "fp32",  # Đổi sang int8 sau khi so sánh bằng whisper_cpu_benchmark.py
+            "intra_op_threads": system_info['cpu_cores'],
+            "inter_op_threads": 1
+        }
     }
     
     import json
@@ -110,6 +116,7 @@ def create_optimized_config(system_info):
     print("✅ CPU config saved to cpu_config.json")
     print(f"📋 Recommended Whisper model: {whisper_model}")
     print(f"🔧 Max concurrent processes: {config['max_concurrent_processes']}")
+    print(f"🧮 Whisper CPU precision: fp32 ({system_info['cpu_cores']} threads) - set whisper_cpu.precision to int8 to opt in")
 
 def optimize_ffmpeg_settings():
     """Create optimized FFmpeg settings"""
@@ -219,13 +226,15 @@ def show_recommendations(system_info):
         print("   🚨 Low disk space - clean up files urgently")
         print("   💡 Run: python -c \"import shutil; shutil.rmtree('temp', ignore_errors=True)\"")
     
-    print("\n📋 Whisper Model Recommendations:")
+    print("\n📋 Whisper Model Recommendations (CPU):")
     if system_info['memory_gb'] >= 16:
-        print("   🚀 Use 'large-v3' model (best quality)")
+        print("   🚀 Use 'medium' model with int8 precision (good balance)")
     elif system_info['memory_gb'] >= 8:
-        print("   ✅ Use 'medium' model (good balance)")
+        print("   ✅ Use 'small' model with int8 precision")
     else:
-        print("   ⚡ Use 'small' model (fastest)")
+        print("   ⚡ Use 'base' model with int8 precision (fastest)")
+    print("   📊 Compare fp32 vs int8 on your audio before opting in: python whisper_cpu_benchmark.py <audio>")
+    print("   🎛️ Measure threads / TTS / render concurrency for this machine: python autotune.py")
     
     print("\n🎬 Video Processing Tips:")
     print("   - Process one video at a time")
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Stage Benchmark - đo từng stage của pipeline trên media tổng hợp (ffmpeg lavfi)
+Fixtures deterministic (testsrc2 video, audio tone / giống giọng nói, SRT 10-5000 dòng),
+mỗi stage chạy riêng lẻ, kết quả ghi ra JSON để so sánh giữa các lần chạy (benchmark_compare.py)
+
+Usage:
+    python stage_benchmark.py [--stages parse_srt,timeline_mix,...] [--repeat 5] [--quick] [--output bench.json]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.append('.')
+import main_app
+from main_app import (
+    analyze_audio_levels,
+    combine_video_audio_subtitles_with_overlay,
+    create_overlay_bar_filter,
+    finish_job_stage,
+    get_asr_engine,
+    mark_job_stage,
+    mix_timeline_in_process,
+    parse_srt_content,
+    processing_tasks,
+    run_ffmpeg
+)
+
+SCHEMA_VERSION = 1
+
+# Kích thước fixtures; --quick dùng bản nhỏ để chạy nhanh trên CI / laptop
+FIXTURE_SPECS = {
+    'full': {
+        'video_seconds': 20,
+        'video_size': '1280x720',
+        'speech_seconds': 30,
+        'srt_lines': [10, 100, 1000, 5000],
+        'mix_segments': [50, 500],
+        'render_srt_lines': 100
+    },
+    'quick': {
+        'video_seconds': 5,
+        'video_size': '640x360',
+        'speech_seconds': 10,
+        'srt_lines': [10, 1000],
+        'mix_segments': [50],
+        'render_srt_lines': 20
+    }
+}
+
+OVERLAY_SETTINGS = {
+    'enabled': True, 'position': 'bottom', 'height': 80, 'width': 90, 'offset': 20,
+    'bgColor': '#000000', 'opacity': 0.6, 'borderWidth': 2, 'borderColor': '#ffffff',
+    'enableShadow': True, 'shadowX': 2, 'shadowY': 2, 'shadowBlur': 5, 'shadowColor': '#000000',
+    'blur': 10
+}
+
+SRT_WORDS = ['xin', 'chào', 'video', 'phụ', 'đề', 'hello', 'world', 'subtitle', 'timeline', 'giọng',
+             'nói', 'render', 'audio', 'the', 'quick', 'brown', 'fox', 'một', 'hai', 'ba']
+
+BITEXACT = ['-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact', '-map_metadata', '-1']
+
+
+def machine_profile():
+    """Khoá máy cho baseline: kiến trúc + số CPU + model CPU + GPU (không dùng hostname, Colab đổi mỗi phiên)"""
+    cpu_model = platform.processor() or 'cpu'
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    gpu = main_app.torch.cuda.get_device_name(0) if main_app.torch.cuda.is_available() else 'nogpu'
+    raw = f"{platform.machine()}-{os.cpu_count()}cpu-{cpu_model}-{gpu}"
+    slug = ''.join(c if c.isalnum() else '-' for c in raw.lower())
+    return '-'.join(part for part in slug.split('-') if part)
+
+
+def machine_info():
+    return {
+        'profile': machine_profile(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': main_app.torch.get_num_threads(),
+        'cuda': main_app.torch.cuda.is_available()
+    }
+
+
+def format_srt_time(seconds):
+    return main_app.format_timestamp(seconds)
+
+
+def generate_srt(lines, duration, seed=0):
+    """SRT deterministic: lines dòng rải đều trên duration giây"""
+    rng = random.Random(seed + lines)
+    step = duration / lines
+    blocks = []
+    for i in range(lines):
+        start = i * step
+        end = start + step * 0.9
+        text = ' '.join(rng.choice(SRT_WORDS) for _ in range(rng.randint(3, 9)))
+        blocks.append(f"{i + 1}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{text}\n")
+    return '\n'.join(blocks)
+
+
+def ensure_fixture(path, cmd):
+    """Tạo fixture bằng ffmpeg nếu chưa có (tên file chứa hash của lệnh => đổi spec là tạo lại)"""
+    if os.path.exists(path):
+        return path
+    result = run_ffmpeg(cmd + BITEXACT + [path, '-y'], job_class='interactive')
+    if result.returncode != 0:
+        raise RuntimeError(f"Fixture generation failed for {path}: {result.stderr[-300:]}")
+    return path
+
+
+def fixture_path(folder, name, cmd, ext):
+    digest = hashlib.sha1(' '.join(cmd).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(folder, f"{name}_{digest}.{ext}")
+
+
+def build_fixtures(spec, folder):
+    """Video testsrc2 + tone, audio giống giọng nói, các segment TTS giả và SRT"""
+    os.makedirs(folder, exist_ok=True)
+    fixtures = {}
+
+    video_cmd = [
+        'ffmpeg', '-f', 'lavfi', '-i', f"testsrc2=size={spec['video_size']}:rate=25:duration={spec['video_seconds']}",
+        '-f', 'lavfi', '-i', f"sine=frequency=330:sample_rate=44100:duration={spec['video_seconds']}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-threads', '1',
+        '-c:a', 'aac', '-shortest'
+    ]
+    fixtures['video'] = ensure_fixture(fixture_path(folder, 'video', video_cmd, 'mp4'), video_cmd)
+
+    # Giống giọng nói: hài âm của F0 ~140 Hz dao động nhẹ, envelope theo nhịp âm tiết ~4 Hz
+    speech_expr = ("(0.5*sin(2*PI*(140+15*sin(2*PI*0.5*t))*t)+0.25*sin(4*PI*(140+15*sin(2*PI*0.5*t))*t)"
+                   "+0.12*sin(6*PI*(140+15*sin(2*PI*0.5*t))*t))*(0.55+0.45*sin(2*PI*4*t))*lt(mod(t,3),2.4)")
+    speech_cmd = [
+        'ffmpeg', '-f', 'lavfi', '-i',
+        f"aevalsrc='{speech_expr}|{speech_expr}':s=44100:d={spec['speech_seconds']}",
+        '-c:a', 'pcm_s16le'
+    ]
+    fixtures['speech'] = ensure_fixture(fixture_path(folder, 'speech', speech_cmd, 'wav'), speech_cmd)
+    fixtures['speech_seconds'] = spec['speech_seconds']
+
+    # Segment TTS giả: 3 tone khác nhau, 1.2-2.4 s
+    fixtures['segments'] = []
+    for i, (freq, seconds) in enumerate([(220, 1.2), (262, 1.8), (330, 2.4)]):
+        cmd = ['ffmpeg', '-f', 'lavfi', '-i', f"sine=frequency={freq}:sample_rate=24000:duration={seconds}",
+               '-ac', '1', '-c:a', 'pcm_s16le']
+        fixtures['segments'].append((ensure_fixture(fixture_path(folder, f'segment{i}', cmd, 'wav'), cmd), seconds))
+
+    fixtures['srt'] = {lines: generate_srt(lines, max(lines * 2.0, spec['video_seconds'])) for lines in spec['srt_lines']}
+    render_srt = os.path.join(folder, f"render_{spec['render_srt_lines']}_{spec['video_seconds']}s.srt")
+    with open(render_srt, 'w', encoding='utf-8') as f:
+        f.write(generate_srt(spec['render_srt_lines'], spec['video_seconds']))
+    fixtures['render_srt'] = render_srt
+    fixtures['video_seconds'] = spec['video_seconds']
+    return fixtures
+
+
+# === STAGES ===
+# Mỗi stage trả về list case: (name, params, fn, work, unit); fn() chạy một lần đo
+
+def stage_parse_srt(fixtures, spec, workdir):
+    cases = []
+    for lines, text in fixtures['srt'].items():
+        cases.append((f'parse_srt_content[lines={lines}]', {'lines': lines},
+                      lambda text=text: parse_srt_content(text), lines, 'lines/s'))
+    return cases
+
+
+def stage_timeline_mix(fixtures, spec, workdir):
+    cases = []
+    output = os.path.join(workdir, 'timeline_mix.wav')
+    for count in spec['mix_segments']:
+        segments, position = [], 0.0
+        for i in range(count):
+            path, seconds = fixtures['segments'][i % len(fixtures['segments'])]
+            segments.append({'file': path, 'start': position})
+            position += seconds + 0.3
+        total = position
+
+        def run(segments=segments, total=total):
+            if not mix_timeline_in_process(segments, total, output):
+                raise RuntimeError('mix_timeline_in_process failed')
+        cases.append((f'timeline_mix[segments={count}]', {'segments': count, 'timeline_seconds': round(total, 1)},
+                      run, count, 'segments/s'))
+    return cases
+
+
+def stage_loudness(fixtures, spec, workdir):
+    return [('analyze_audio_levels', {'audio_seconds': fixtures['speech_seconds']},
+             lambda: analyze_audio_levels(fixtures['speech']), fixtures['speech_seconds'], 'audio_s/s')]
+
+
+def stage_overlay_filter(fixtures, spec, workdir):
+    width, height = (int(v) for v in spec['video_size'].split('x'))
+    builds = 200
+
+    def build():
+        for _ in range(builds):
+            create_overlay_bar_filter(OVERLAY_SETTINGS, width, height)
+
+    def render():
+        cmd = ['ffmpeg', '-i', fixtures['video'], '-vf', create_overlay_bar_filter(OVERLAY_SETTINGS, width, height),
+               '-an', '-f', 'null', '-']
+        result = run_ffmpeg(cmd, job_class='render')
+        if result.returncode != 0:
+            raise RuntimeError(f"Overlay render failed: {result.stderr[-300:]}")
+
+    return [
+        ('create_overlay_bar_filter[build]', {'builds': builds}, build, builds, 'filters/s'),
+        ('create_overlay_bar_filter[render]', {'video_seconds': fixtures['video_seconds']}, render,
+         fixtures['video_seconds'], 'video_s/s')
+    ]
+
+
+def stage_combine(fixtures, spec, workdir):
+    output = os.path.join(workdir, 'combined.mp4')
+
+    def run():
+        if not combine_video_audio_subtitles_with_overlay(
+                fixtures['video'], fixtures['speech'], fixtures['render_srt'], output,
+                voice_volume=80.0, overlay_settings=OVERLAY_SETTINGS):
+            raise RuntimeError('combine_video_audio_subtitles_with_overlay failed')
+    return [('combine_video_audio_subtitles_with_overlay', {'video_seconds': fixtures['video_seconds'],
+                                                            'srt_lines': spec['render_srt_lines']},
+             run, fixtures['video_seconds'], 'video_s/s')]
+
+
+def stage_transcribe(fixtures, spec, workdir):
+    # Model load nằm ngoài phép đo (warmup load và cache model)
+    state = {}
+
+    def run():
+        if 'engine' not in state:
+            state['engine'] = get_asr_engine('tiny', main_app.resolve_whisper_precision())
+            state['audio'] = main_app.whisper.load_audio(fixtures['speech']).astype(main_app.np.float32)
+        decode_profile, options = main_app.get_decode_options('fast')
+        options['verbose'] = None
+        state['engine'].transcribe(state['audio'], language='en', **options)
+    return [('transcribe[tiny]', {'model': 'tiny', 'audio_seconds': fixtures['speech_seconds']},
+             run, fixtures['speech_seconds'], 'audio_s/s')]
+
+
+STAGES = {
+    'parse_srt': stage_parse_srt,
+    'timeline_mix': stage_timeline_mix,
+    'loudness': stage_loudness,
+    'overlay_filter': stage_overlay_filter,
+    'combine': stage_combine,
+    'transcribe': stage_transcribe
+}
+
+
+def measure_case(task_id, name, fn, repeat, warmup, memory):
+    """Chạy warmup + repeat lần; mỗi lần là một stage trên job timeline (CPU, RSS, ffmpeg con)"""
+    for _ in range(warmup):
+        fn()
+
+    runs = []
+    for _ in range(repeat):
+        start_rss = main_app._current_rss_mb()
+        mark_job_stage(task_id, name, 'stage_benchmark')
+        record = processing_tasks[task_id]['timeline']['stages'][-1]
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            finish_job_stage(e)
+            raise
+        seconds = time.perf_counter() - start
+        finish_job_stage()
+        runs.append({
+            'seconds': seconds,
+            'cpu_seconds': record['cpu_seconds'] + record['subprocess_cpu_seconds'],
+            'rss_growth_mb': max(0.0, record['peak_rss_mb'] - start_rss),
+            'subprocess_peak_rss_mb': record['subprocess_peak_rss_mb'],
+            'subprocesses': record['subprocesses']
+        })
+
+    # Lần chạy riêng có tracemalloc: không làm sai lệch thời gian của các lần đo ở trên
+    peak_traced_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return runs, peak_traced_mb
+
+
+def summarize(name, stage, params, work, unit, runs, peak_traced_mb):
+    seconds = [run['seconds'] for run in runs]
+    median = statistics.median(seconds)
+    return {
+        'stage': stage,
+        'params': params,
+        'status': 'ok',
+        'runs': [round(s, 6) for s in seconds],
+        'median_seconds': round(median, 6),
+        'mean_seconds': round(statistics.mean(seconds), 6),
+        'stdev_seconds': round(statistics.stdev(seconds), 6) if len(seconds) > 1 else 0.0,
+        'min_seconds': round(min(seconds), 6),
+        'max_seconds': round(max(seconds), 6),
+        'throughput': round(work / median, 3) if median > 0 else None,
+        'throughput_unit': unit,
+        'cpu_seconds': round(statistics.median(run['cpu_seconds'] for run in runs), 4),
+        'rss_growth_mb': round(max(run['rss_growth_mb'] for run in runs), 1),
+        'subprocess_peak_rss_mb': round(max(run['subprocess_peak_rss_mb'] for run in runs), 1),
+        'peak_traced_mb': round(peak_traced_mb, 2) if peak_traced_mb is not None else None,
+        'subprocesses': max(run['subprocesses'] for run in runs)
+    }
+
+
+def run_benchmarks(stages=None, repeat=5, warmup=1, quick=False, memory=True,
+                   fixtures_dir=os.path.join('temp', 'bench_fixtures')):
+    """Chạy các stage và trả về report (dict JSON-serializable)"""
+    spec = FIXTURE_SPECS['quick' if quick else 'full']
+    stages = stages or list(STAGES)
+    workdir = os.path.join(fixtures_dir, 'work')
+    os.makedirs(workdir, exist_ok=True)
+
+    # Log INFO của từng stage (emoji logging) làm nhiễu phép đo
+    main_app.logger.setLevel('WARNING')
+    main_app.JOB_TIMELINE_CONFIG['rss_sample_interval'] = 0.05
+
+    print("📦 Preparing fixtures...")
+    fixtures = build_fixtures(spec, fixtures_dir)
+
+    task_id = f"bench-{int(time.time())}"
+    processing_tasks[task_id] = {'status': 'benchmark', 'created_at': time.time()}
+
+    report = {
+        'schema_version': SCHEMA_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'settings': {'repeat': repeat, 'warmup': warmup, 'quick': quick, 'memory': memory, 'fixtures': spec},
+        'results': {}
+    }
+
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}' (available: {', '.join(STAGES)})")
+        print(f"\n🔄 Stage: {stage}")
+        try:
+            cases = STAGES[stage](fixtures, spec, workdir)
+        except Exception as e:
+            print(f"   ⚠️ Skipped: {e}")
+            report['results'][stage] = {'stage': stage, 'status': 'skipped', 'error': str(e)}
+            continue
+        for name, params, fn, work, unit in cases:
+            try:
+                runs, peak_traced_mb = measure_case(task_id, name, fn, repeat, warmup, memory)
+            except Exception as e:
+                print(f"   ❌ {name}: {e}")
+                report['results'][name] = {'stage': stage, 'params': params, 'status': 'error', 'error': str(e)}
+                continue
+            result = summarize(name, stage, params, work, unit, runs, peak_traced_mb)
+            report['results'][name] = result
+            print(f"   ⏱️ {name}: median {result['median_seconds'] * 1000:.1f}ms "
+                  f"(±{result['stdev_seconds'] * 1000:.1f}), {result['throughput']} {unit}, "
+                  f"traced peak {result['peak_traced_mb']} MB")
+
+    processing_tasks.pop(task_id, None)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark từng stage của pipeline trên fixtures tổng hợp")
+    parser.add_argument('--stages', default=None, help=f"Comma-separated stages ({', '.join(STAGES)})")
+    parser.add_argument('--repeat', type=int, default=5, help="Measured runs per case")
+    parser.add_argument('--warmup', type=int, default=1, help="Unmeasured warmup runs per case")
+    parser.add_argument('--quick', action='store_true', help="Small fixtures for a fast run")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run")
+    parser.add_argument('--fixtures-dir', default=os.path.join('temp', 'bench_fixtures'), help="Fixture cache folder")
+    parser.add_argument('--output', default=None, help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    print("🧪 STAGE BENCHMARK")
+    print("=" * 60)
+    print(f"🖥️ Machine profile: {machine_profile()}")
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()] if args.stages else None
+    report = run_benchmarks(stages, args.repeat, args.warmup, args.quick, not args.no_memory, args.fixtures_dir)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report saved to {args.output}")
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ class VideoEditor {
         this.currentVideoFile = null;
         this.timelineZoom = 100;
         this.subtitleSegments = [];
+        this.streamedSegmentCount = 0;
         this.selectedSubtitleBlock = null;
         this.isDragging = false;
         this.isResizing = false;
@@ -518,6 +519,9 @@ class VideoEditor {
             const result = await response.json();
 
             if (response.ok) {
+                // Segments from the new run are streamed in from the first window
+                this.subtitleSegments = [];
+                this.streamedSegmentCount = 0;
                 this.showNotification(`Bắt đầu tạo phụ đề với model ${modelName}!`, 'info');
                 this.updateStatus('Đang phân tích âm thanh...');
             } else {
@@ -862,6 +866,32 @@ class VideoEditor {
         }
     }
 
+    appendStreamedSegments(serverSegments) {
+        const newSegments = serverSegments.slice(this.streamedSegmentCount || 0);
+        if (newSegments.length === 0) return;
+
+        newSegments.forEach(segment => {
+            this.subtitleSegments.push({
+                index: segment.id + 1,
+                start: segment.start,
+                end: segment.end,
+                text: segment.text.trim()
+            });
+        });
+        this.streamedSegmentCount = serverSegments.length;
+        this.displaySubtitlesInEditor(this.subtitleSegments);
+
+        console.log(`📡 Streamed ${newSegments.length} new segments (${this.subtitleSegments.length} total)`);
+
+        const timelineEditor = document.getElementById('timeline-editor');
+        if (timelineEditor) {
+            timelineEditor.style.display = 'block';
+            if (this.videoElement && this.videoElement.duration) {
+                this.renderTimeline();
+            }
+        }
+    }
+
     // Helper function to clean and normalize SRT content
     cleanSRTContent(srtText) {
         if (!srtText || typeof srtText !== 'string') {
@@ -1124,6 +1154,11 @@ class VideoEditor {
                 this.showProgress('subtitle-progress');
                 this.updateProgressBar('subtitle-progress', progress);
                 document.getElementById('generate-subtitles-btn').disabled = true;
+
+                // Show segments as soon as each transcription window finishes
+                if (status.segments_partial && Array.isArray(status.segments)) {
+                    this.appendStreamedSegments(status.segments);
+                }
                 break;
 
             case 'subtitles_completed':
@@ -1138,7 +1173,13 @@ class VideoEditor {
                 this.showNotification('✅ Phụ đề đã được tạo thành công!', 'success');
                 
                 // Auto-load subtitle segments and show timeline
-                this.loadSubtitleSegments();
+                if (status.segments_streamed && this.streamedSegmentCount > 0 && Array.isArray(status.segments)) {
+                    // Keep edits made while streaming, only add the remaining segments
+                    this.appendStreamedSegments(status.segments);
+                } else {
+                    this.loadSubtitleSegments();
+                }
+                this.streamedSegmentCount = 0;
                 break;
 
             case 'processing_voice':
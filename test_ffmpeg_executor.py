@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test FFmpegExecutor: rewrite lệnh (-threads, -f null -, -progress), giới hạn đồng thời, timeout
+Test rewrite không chạy ffmpeg thật: _execute được thay bằng hàm ghi lại lệnh cuối cùng
+
+Usage:
+    python -m pytest -q test_ffmpeg_executor.py
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append('.')
+from main_app import FFMPEG_CONFIG, FFMPEG_JOB_CLASSES, FFmpegExecutor, FFmpegResult
+
+
+def run_rewritten(cmd, job_class='render', threads=4):
+    """Trả về (lệnh sau khi rewrite, track) mà executor sẽ chạy"""
+    executor = FFmpegExecutor(dict(FFMPEG_CONFIG, threads=threads), FFMPEG_JOB_CLASSES)
+    captured = {}
+
+    def fake_execute(cmd, cls, track, *args):
+        captured.update(cmd=cmd, track=track)
+        return FFmpegResult(cmd, 0, '', '', 0.0)
+
+    executor._execute = fake_execute
+    executor.run(cmd, job_class=job_class, duration=1.0)
+    return captured['cmd'], captured['track']
+
+
+def test_threads_before_null_output_with_trailing_loglevel():
+    # analyze_audio_levels: lệnh kết thúc bằng '-v', 'info' sau output
+    cmd, track = run_rewritten(['ffmpeg', '-i', 'in.wav', '-af', 'volumedetect', '-f', 'null', '-', '-v', 'info'],
+                               job_class='analysis')
+    assert cmd[-2:] == ['-v', 'info']
+    assert cmd[-5:-2] == ['-threads', '4', os.devnull]
+    assert track and cmd[1:4] == ['-progress', 'pipe:1', '-nostats']
+
+
+def test_threads_before_output_followed_by_overwrite_flag():
+    cmd, _ = run_rewritten(['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx264', 'out.mp4', '-y'])
+    assert cmd[-4:] == ['-threads', '4', 'out.mp4', '-y']
+
+
+def test_threads_before_plain_output():
+    cmd, _ = run_rewritten(['ffmpeg', '-y', '-i', 'in.mp4', '-vf', 'scale=640:-2', '-shortest', 'out.mp4'])
+    assert cmd[-3:] == ['-threads', '4', 'out.mp4']
+
+
+def test_null_output_replaced_by_devnull():
+    cmd, track = run_rewritten(['ffmpeg', '-i', 'in.wav', '-f', 'null', '-'], threads=None)
+    assert cmd[-1] == os.devnull and '-threads' not in cmd
+    assert track
+
+
+def test_stdout_output_not_tracked():
+    cmd, track = run_rewritten(['ffmpeg', '-i', 'in.mp3', '-f', 's16le', '-ac', '2', 'pipe:1'], job_class='audio')
+    assert not track and '-progress' not in cmd
+    assert cmd[-3:] == ['-threads', '4', 'pipe:1']
+
+
+def test_existing_threads_and_light_classes_untouched():
+    cmd, _ = run_rewritten(['ffmpeg', '-i', 'in.mp4', '-threads', '2', 'out.mp4'])
+    assert cmd.count('-threads') == 1 and cmd[cmd.index('-threads') + 1] == '2'
+    cmd, _ = run_rewritten(['ffmpeg', '-i', 'in.srt', 'out.ass', '-y'], job_class='interactive')
+    assert '-threads' not in cmd
+    cmd, track = run_rewritten(['ffprobe', '-v', 'error', '-show_format', 'in.mp4'], job_class='probe')
+    assert cmd == ['ffprobe', '-v', 'error', '-show_format', 'in.mp4'] and not track
+
+
+def run_concurrently(executor, job_class, jobs=4):
+    """Chạy song song `jobs` lệnh giả; trả về số lệnh chạy cùng lúc nhiều nhất"""
+    lock, running, peak = threading.Lock(), [0], [0]
+
+    def fake_execute(cmd, *args):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return FFmpegResult(cmd, 0, '', '', 0.05)
+
+    executor._execute = fake_execute
+    threads = [threading.Thread(target=executor.run, args=(['ffmpeg', '-i', 'in.wav', f'out{k}.wav'],),
+                                kwargs={'job_class': job_class}) for k in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return peak[0]
+
+
+def test_class_and_global_concurrency_caps():
+    classes = {name: dict(cls) for name, cls in FFMPEG_JOB_CLASSES.items()}
+    classes['render']['max_concurrent'] = 1
+    executor = FFmpegExecutor(dict(FFMPEG_CONFIG, max_processes=2), classes)
+    assert run_concurrently(executor, 'render') == 1
+    assert run_concurrently(executor, 'audio') == 2  # Class cho 4 nhưng slot chung chỉ có 2
+    assert run_concurrently(executor, 'interactive') == 4  # Không chiếm slot chung
+    assert executor.stats()['active'] == {name: 0 for name in classes}
+
+
+def test_timeout_scales_with_media_duration():
+    executor = FFmpegExecutor(FFMPEG_CONFIG, FFMPEG_JOB_CLASSES)
+    render = FFMPEG_JOB_CLASSES['render']
+    assert executor._timeout_for(render, None) == render['base_timeout']
+    assert executor._timeout_for(render, 600) == render['base_timeout'] + 600 * render['per_media_second']
+
+
+def test_hung_process_is_killed_on_timeout():
+    executor = FFmpegExecutor(dict(FFMPEG_CONFIG, watchdog_interval=0.1, threads=None), FFMPEG_JOB_CLASSES)
+    cmd = ['ffmpeg', '-v', 'error', '-re', '-f', 'lavfi', '-i', 'anullsrc=r=8000:cl=mono', '-f', 'null', '-']
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        executor.run(cmd, job_class='analysis', timeout=1.0)
+    assert time.monotonic() - start < 10
+    assert executor.stats()['timeouts'] == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(['-q', __file__]))
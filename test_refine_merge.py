@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test merge_refined_segments (draft-then-refine transcription)
+
+Usage:
+    python -m pytest -q test_refine_merge.py
+"""
+
+import sys
+
+sys.path.append('.')
+from main_app import merge_refined_segments
+
+
+def seg(start, end, text, **extra):
+    return dict(start=start, end=end, text=text, **extra)
+
+
+def draft():
+    return [seg(0.0, 2.0, 'a'), seg(2.0, 4.0, 'b?'), seg(4.0, 6.0, 'c?'), seg(6.0, 8.0, 'd')]
+
+
+def texts(segments):
+    return [s['text'] for s in segments]
+
+
+def test_refined_segments_replace_draft_inside_window():
+    refined = [seg(1.8, 4.1, 'B', refined=True), seg(4.1, 6.0, 'C', refined=True)]
+    merged = merge_refined_segments(draft(), [((2.0, 6.0), refined)])
+    assert texts(merged) == ['a', 'B', 'C', 'd']
+    assert [s['id'] for s in merged] == [0, 1, 2, 3]
+
+
+def test_padding_segments_outside_window_are_dropped():
+    # Segment refine có midpoint nằm trong phần padding không được lặp lại
+    refined = [seg(1.7, 2.1, 'A-tail', refined=True), seg(2.1, 6.0, 'BC', refined=True)]
+    merged = merge_refined_segments(draft(), [((2.0, 6.0), refined)])
+    assert texts(merged) == ['a', 'BC', 'd']
+
+
+def test_empty_refine_keeps_draft():
+    merged = merge_refined_segments(draft(), [((2.0, 6.0), [])])
+    assert texts(merged) == ['a', 'b?', 'c?', 'd']
+
+
+def test_low_coverage_refine_keeps_draft():
+    refined = [seg(2.0, 2.5, 'B', refined=True)]  # 0.5s trên 4s của draft
+    merged = merge_refined_segments(draft(), [((2.0, 6.0), refined)])
+    assert texts(merged) == ['a', 'b?', 'c?', 'd']
+
+
+def test_windows_are_judged_independently():
+    refined_windows = [((2.0, 4.0), []), ((4.0, 6.0), [seg(4.0, 5.8, 'C', refined=True)])]
+    merged = merge_refined_segments(draft(), refined_windows)
+    assert texts(merged) == ['a', 'b?', 'C', 'd']
+
+
+def test_min_coverage_is_configurable():
+    refined = [seg(2.0, 2.5, 'B', refined=True)]
+    config = {'min_coverage': 0.1}
+    merged = merge_refined_segments(draft(), [((2.0, 6.0), refined)], config)
+    assert texts(merged) == ['a', 'B', 'd']
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main(['-q', __file__]))
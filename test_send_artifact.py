@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test /api/download (send_artifact): ETag / 304, Range, If-Range, multi-range, 416
+
+Usage:
+    python -m pytest -q test_send_artifact.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append('.')
+import main_app
+
+BODY = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = os.path.join(tmp_path, 'final.mp4')
+    with open(path, 'wb') as f:
+        f.write(BODY)
+    main_app.processing_tasks['artifact-test'] = {'final_video_path': path}
+    try:
+        yield main_app.app.test_client()
+    finally:
+        main_app.processing_tasks.pop('artifact-test', None)
+
+
+def download(client, **headers):
+    return client.get('/api/download/artifact-test/final', headers=headers)
+
+
+def test_full_download_has_etag_and_ranges(client):
+    response = download(client)
+    assert response.status_code == 200 and response.data == BODY
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] and 'attachment' in response.headers['Content-Disposition']
+
+
+def test_if_none_match_returns_304(client):
+    etag = download(client).headers['ETag']
+    response = download(client, **{'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+
+
+def test_single_range_returns_206(client):
+    response = download(client, Range='bytes=10-19')
+    assert response.status_code == 206 and response.data == BODY[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(BODY)}'
+
+
+def test_if_range_with_current_etag_returns_206(client):
+    etag = download(client).headers['ETag']
+    response = download(client, Range='bytes=0-3', **{'If-Range': etag})
+    assert response.status_code == 206 and response.data == BODY[:4]
+
+
+def test_if_range_with_stale_etag_returns_full_file(client):
+    response = download(client, Range='bytes=0-3', **{'If-Range': '"stale"'})
+    assert response.status_code == 200 and response.data == BODY
+
+
+def test_multi_range_returns_full_file(client):
+    response = download(client, Range='bytes=0-1,5-6')
+    assert response.status_code == 200 and response.data == BODY
+
+
+def test_unsatisfiable_range_returns_416(client):
+    response = download(client, Range=f'bytes={len(BODY) + 10}-')
+    assert response.status_code == 416
+
+
+def test_x_sendfile_leaves_ranges_to_the_proxy(client, monkeypatch):
+    monkeypatch.setitem(main_app.app.config, 'SENDFILE_MODE', 'x-sendfile')
+    monkeypatch.setitem(main_app.app.config, 'USE_X_SENDFILE', True)
+    response = download(client, Range='bytes=0-3')
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Sendfile'].endswith('final.mp4')
+    etag = response.headers['ETag']
+    response = download(client, **{'If-None-Match': etag})
+    assert response.status_code == 304 and 'X-Sendfile' not in response.headers
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(['-q', __file__]))
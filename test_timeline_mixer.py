@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test TimelineMixer (preallocate / grow / write) và TimelineSlot (retry trên timeline)
+
+Usage:
+    python -m pytest -q test_timeline_mixer.py
+"""
+
+import os
+import sys
+import wave
+
+import numpy as np
+
+sys.path.append('.')
+from main_app import TimelineMixer, TimelineSlot, commit_audio_output, discard_audio_output
+
+
+def tone(frames, value=0.25, channels=2):
+    return np.full((frames, channels), value, dtype=np.float32)
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+        return pcm.reshape(-1, wav_file.getnchannels())
+
+
+def test_preallocated_buffer_is_not_regrown():
+    mixer = TimelineMixer(100, 2, duration=10)
+    buffer = mixer.buffer
+    for k in range(10):
+        mixer.add_samples(tone(100), k)
+    assert mixer.buffer is buffer and len(buffer) == 1000
+    assert mixer.length == 1000
+
+
+def test_growth_is_geometric_and_keeps_audio():
+    mixer = TimelineMixer(100, 2)
+    capacities = set()
+    for k in range(64):
+        mixer.add_frames(tone(10, value=0.5), k * 10)
+        capacities.add(len(mixer.buffer))
+    # Mỗi lần grow ít nhất gấp đôi → số lần cấp phát là O(log N)
+    assert len(capacities) <= 8
+    assert mixer.length == 640
+    assert np.allclose(mixer.buffer[:640], 0.5) and not mixer.buffer[640:].any()
+
+
+def test_overlapping_segments_are_summed_with_gain():
+    mixer = TimelineMixer(100, 2, gain=0.5)
+    mixer.add_frames(tone(100, 0.4), 0)
+    mixer.add_frames(tone(100, 0.4), 50)
+    assert np.allclose(mixer.buffer[:50], 0.2)
+    assert np.allclose(mixer.buffer[50:100], 0.4)
+    assert np.allclose(mixer.buffer[100:150], 0.2)
+
+
+def test_write_pads_and_trims_to_duration(tmp_path):
+    mixer = TimelineMixer(100, 2)
+    mixer.add_frames(tone(50, 0.5), 0)
+    padded = os.path.join(tmp_path, 'padded.wav')
+    mixer.write(padded, 2)
+    pcm = read_wav(padded)
+    assert pcm.shape == (200, 2) and pcm[:50].min() > 0 and not pcm[50:].any()
+
+    mixer.add_frames(tone(300, 0.5), 0)
+    trimmed = os.path.join(tmp_path, 'trimmed.wav')
+    mixer.write(trimmed, 1)
+    assert read_wav(trimmed).shape == (100, 2)
+
+
+def test_slot_reaches_timeline_only_on_commit():
+    mixer = TimelineMixer(100, 2, duration=2)
+    mixer.add_frames(tone(100, 0.3), 50)  # Segment khác chồng lên slot
+    slot = TimelineSlot(mixer, 1.0)
+    slot.write_pcm(tone(40, 0.2))
+    assert slot.frames == 40 and np.allclose(mixer.buffer[100:150], 0.3)
+    commit_audio_output(slot)
+    assert np.allclose(mixer.buffer[100:140], 0.5) and np.allclose(mixer.buffer[140:150], 0.3)
+    assert slot.chunks == [] and slot.frames == 40
+
+
+def test_slot_reset_discards_only_the_failed_attempt():
+    mixer = TimelineMixer(100, 2, duration=2)
+    mixer.add_frames(tone(200, 0.1), 0)
+    before = mixer.buffer.copy()
+    slot = TimelineSlot(mixer, 0.5)
+    slot.write_pcm(tone(30, 0.7))
+    discard_audio_output(slot)  # Lần thử lỗi giữa chừng: timeline không bị động tới
+    assert slot.frames == 0 and np.array_equal(mixer.buffer, before)
+
+    slot.write_pcm(tone(20, 0.2))
+    slot.commit()
+    slot.write_pcm(tone(20, 0.4))
+    slot.reset()  # Chỉ bỏ phần chưa commit
+    assert slot.frames == 20
+    assert np.allclose(mixer.buffer[50:70], 0.3) and np.array_equal(mixer.buffer[70:], before[70:])
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main(['-q', __file__]))
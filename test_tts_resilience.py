@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test ProviderRateLimiter (AIMD + circuit breaker), HedgeTracker và request bị huỷ khi hedge
+
+Usage:
+    python -m pytest -q test_tts_resilience.py
+"""
+
+import asyncio
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('.')
+import main_app
+from main_app import (TTS_HEDGE_CONFIG, TTS_RATE_LIMIT_CONFIG, HedgeTracker, ProviderRateLimiter,
+                      TTSProvider, Voice, tts_manager)
+
+
+def limiter(**overrides):
+    return ProviderRateLimiter(TTSProvider.LOCAL_TTS, dict(TTS_RATE_LIMIT_CONFIG, **overrides))
+
+
+def open_circuit(rate_limiter):
+    for _ in range(rate_limiter.config['failure_threshold']):
+        rate_limiter.record_failure()
+    assert rate_limiter.circuit == 'open'
+
+
+def half_open(rate_limiter):
+    open_circuit(rate_limiter)
+    rate_limiter.opened_until = 0.0  # Hết cooldown
+    assert not rate_limiter.is_open() and rate_limiter.circuit == 'half_open'
+
+
+def test_circuit_opens_after_consecutive_failures():
+    rate_limiter = limiter(failure_threshold=3)
+    rate_limiter.record_failure()
+    rate_limiter.record_failure()
+    rate_limiter.record_success()  # Reset chuỗi lỗi
+    rate_limiter.record_failure()
+    rate_limiter.record_failure()
+    assert rate_limiter.circuit == 'closed'
+    rate_limiter.record_failure()
+    assert rate_limiter.circuit == 'open' and rate_limiter.is_open()
+    assert not asyncio.run(rate_limiter.acquire(wait_for_circuit=False))
+    assert rate_limiter.counters['rejected'] == 1
+
+
+def test_half_open_allows_a_single_probe():
+    rate_limiter = limiter()
+    half_open(rate_limiter)
+    assert asyncio.run(rate_limiter.acquire(wait_for_circuit=False))
+    assert rate_limiter.probe_in_flight
+    assert not asyncio.run(rate_limiter.acquire(wait_for_circuit=False))
+
+
+def test_probe_success_closes_and_failure_backs_off():
+    rate_limiter = limiter()
+    half_open(rate_limiter)
+    asyncio.run(rate_limiter.acquire())
+    rate_limiter.record_success()
+    assert rate_limiter.circuit == 'closed' and not rate_limiter.probe_in_flight
+
+    half_open(rate_limiter)
+    cooldown = rate_limiter.cooldown
+    asyncio.run(rate_limiter.acquire())
+    rate_limiter.record_failure()
+    assert rate_limiter.circuit == 'open' and rate_limiter.cooldown == 2 * cooldown
+
+
+def test_cancelled_probe_is_released():
+    rate_limiter = limiter()
+    half_open(rate_limiter)
+    asyncio.run(rate_limiter.acquire())
+    rate_limiter.record_cancelled()
+    assert rate_limiter.circuit == 'half_open' and not rate_limiter.probe_in_flight
+    assert asyncio.run(rate_limiter.acquire(wait_for_circuit=False))
+    assert rate_limiter.counters['cancelled'] == 1
+
+
+def test_throttle_halves_rate_and_success_adds_step():
+    rate_limiter = limiter(initial_rate=4.0)
+    rate_limiter.record_failure(throttled=True, retry_after=2.0)
+    assert rate_limiter.rate == 2.0 and rate_limiter.tokens == -4.0
+    rate_limiter.record_success()
+    assert rate_limiter.rate == 2.0 + TTS_RATE_LIMIT_CONFIG['increase_step']
+
+
+def test_hedge_delay_needs_samples_and_respects_extra_load():
+    tracker = HedgeTracker(TTSProvider.LOCAL_TTS, dict(TTS_HEDGE_CONFIG, min_samples=10, min_delay=0.1,
+                                                       max_extra_load=0.1))
+    assert tracker.hedge_delay() is None
+    for k in range(1, 11):
+        tracker.record_latency(k / 10)
+    assert tracker.hedge_delay() == 1.0  # p90 của 0.1..1.0
+    assert not tracker.try_reserve_hedge()  # 2 request → chưa đủ cho 10% hedge
+    for _ in range(8):
+        tracker.hedge_delay()
+    assert tracker.try_reserve_hedge() and not tracker.try_reserve_hedge()
+    tracker.record_hedge_result(won=True)
+    assert tracker.stats()['win_rate'] == 1.0
+
+
+def test_cancelled_request_releases_probe_and_records_latency(monkeypatch):
+    voice = Voice('local-vi-female', 'Local', 'vi', 'female', TTSProvider.LOCAL_TTS)
+    rate_limiter = limiter()
+    tracker = HedgeTracker(TTSProvider.LOCAL_TTS)
+    monkeypatch.setitem(tts_manager.rate_limiters, TTSProvider.LOCAL_TTS, rate_limiter)
+    monkeypatch.setitem(tts_manager.hedge_trackers, TTSProvider.LOCAL_TTS, tracker)
+
+    async def slow_local_tts(*args):
+        await asyncio.sleep(10)
+        return True
+
+    monkeypatch.setattr(tts_manager, '_generate_local_tts', slow_local_tts)
+    half_open(rate_limiter)
+
+    async def cancel_request():
+        request = asyncio.ensure_future(tts_manager._synthesize('xin chào', voice, main_app.BufferSink(), 1.0))
+        await asyncio.sleep(0.05)
+        assert rate_limiter.probe_in_flight
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+
+    asyncio.run(cancel_request())
+    assert not rate_limiter.probe_in_flight and rate_limiter.counters['cancelled'] == 1
+    assert len(tracker.latencies) == 1 and tracker.latencies[0] >= 0.05
+
+
+def test_hedged_batch_keeps_boundaries_of_the_winner(monkeypatch):
+    voice = Voice('local-vi-female', 'Local', 'vi', 'female', TTSProvider.LOCAL_TTS)
+    tracker = HedgeTracker(TTSProvider.LOCAL_TTS, dict(TTS_HEDGE_CONFIG, providers=[TTSProvider.LOCAL_TTS.value],
+                                                       enabled=True, min_samples=1, min_delay=0.05, max_extra_load=1.0))
+    tracker.record_latency(0.05)
+    monkeypatch.setitem(tts_manager.hedge_trackers, TTSProvider.LOCAL_TTS, tracker)
+    monkeypatch.setitem(tts_manager.rate_limiters, TTSProvider.LOCAL_TTS, limiter())
+    monkeypatch.setattr(tts_manager, 'get_voice_by_id', lambda voice_id: voice)
+
+    async def fake_synthesize(text, voice, output_path, speed, fail_fast=False, boundaries=None, attempt=()):
+        hedged = 'hedge' in attempt
+        boundaries.append((0.0, 0.1, 'hedge' if hedged else 'primary'))
+        await asyncio.sleep(0.01 if hedged else 10)
+        output_path.write_pcm(np.full((10, main_app.AUDIO_CHANNELS), 0.5, dtype=np.float32))
+        return True
+
+    monkeypatch.setattr(tts_manager, '_synthesize', fake_synthesize)
+    sink, boundaries = main_app.BufferSink(), []
+    assert asyncio.run(tts_manager.generate_speech('a b', voice.id, sink, 1.0, fail_fast=True, boundaries=boundaries))
+    assert boundaries == [(0.0, 0.1, 'hedge')] and sink.frames == 10
+    assert tracker.hedges == 1 and tracker.hedge_wins == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(['-q', __file__]))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test request shaping của TTS: gộp câu ngắn, tách text dài, cắt audio batch theo từng câu
+
+Usage:
+    python -m pytest -q test_tts_shaping.py
+"""
+
+import sys
+
+import numpy as np
+
+sys.path.append('.')
+from main_app import (TTS_SHAPING_CONFIG, find_cuts_from_boundaries, find_cuts_from_silence, join_batch_texts,
+                      shape_tts_requests, split_text_for_tts)
+
+
+def seg(start, end, text):
+    return {'start': start, 'end': end, 'text': text}
+
+
+def test_short_neighbours_are_batched_and_long_text_split():
+    segments = [seg(0.0, 0.5, 'Yes.'), seg(0.8, 1.2, 'Okay then'), seg(1.5, 4.0, 'This one is a normal sentence here.'),
+                seg(4.5, 30.0, 'word ' * 80)]
+    plan = shape_tts_requests(segments)
+    assert plan == [{'kind': 'batch', 'indices': [0, 1]}, {'kind': 'single', 'indices': [2]},
+                    {'kind': 'split', 'indices': [3]}]
+
+
+def test_batch_breaks_on_gap_size_and_empty_text():
+    config = dict(TTS_SHAPING_CONFIG, max_batch_segments=2)
+    segments = [seg(0, 0.5, 'a'), seg(0.6, 1, 'b'), seg(1.1, 1.5, 'c'), seg(5, 5.5, 'd'), seg(5.6, 6, '  '),
+                seg(6.1, 6.5, 'e')]
+    plan = shape_tts_requests(segments, config)
+    assert [p['indices'] for p in plan] == [[0, 1], [2], [3], [5]]
+    assert [p['kind'] for p in plan] == ['batch', 'single', 'single', 'single']
+
+
+def test_shaping_disabled_keeps_one_request_per_segment():
+    config = dict(TTS_SHAPING_CONFIG, enabled=False)
+    plan = shape_tts_requests([seg(0, 1, 'a'), seg(1, 2, 'b'), seg(2, 3, '')], config)
+    assert plan == [{'kind': 'single', 'indices': [0]}, {'kind': 'single', 'indices': [1]}]
+
+
+def test_split_text_prefers_sentences_then_commas():
+    text = 'First sentence here. Second one, with a clause, goes on. Third!'
+    assert split_text_for_tts(text, max_chars=100) == [text]
+    pieces = split_text_for_tts(text, max_chars=25)
+    assert pieces == ['First sentence here.', 'Second one,', 'with a clause, goes on.', 'Third!']
+    assert all(len(p) <= 25 for p in pieces)
+    assert ' '.join(pieces).split() == text.split()
+
+
+def test_split_text_hard_cuts_words_without_spaces():
+    pieces = split_text_for_tts('x' * 25, max_chars=10)
+    assert pieces == ['x' * 10, 'x' * 10, 'x' * 5]
+
+
+def test_join_keeps_original_punctuation():
+    joined, starts = join_batch_texts(['Yes', 'No!', 'Maybe,'])
+    assert joined == 'Yes No! Maybe,'
+    assert [joined[s:s + 2] for s in starts] == ['Ye', 'No', 'Ma']
+
+
+def test_cuts_from_word_boundaries():
+    joined, starts = join_batch_texts(['hello there', 'general', 'kenobi'])
+    boundaries = [(0.0, 0.4, 'hello'), (0.5, 0.4, 'there'), (1.2, 0.5, 'general'), (2.0, 0.6, 'kenobi')]
+    assert find_cuts_from_boundaries(boundaries, joined, starts) == [(0.9 + 1.2) / 2, (1.7 + 2.0) / 2]
+    # Một câu không có WordBoundary nào → không cắt được
+    assert find_cuts_from_boundaries(boundaries[:3], joined, starts) is None
+    assert find_cuts_from_boundaries([(0.0, 0.4, 'missing')], joined, starts) is None
+
+
+def test_cuts_from_silence_pick_gap_nearest_expected_position():
+    sample_rate = 1000
+    tone = np.sin(np.arange(300) * 0.3)[:, None].astype(np.float32)
+    silence = np.zeros((200, 1), dtype=np.float32)
+    samples = np.concatenate([tone, silence, tone, silence, tone, tone])
+    cuts = find_cuts_from_silence(samples, sample_rate, ['aaa', 'bbb', 'cccccc'])
+    assert cuts is not None and len(cuts) == 2
+    assert abs(cuts[0] - 0.4) < 0.02 and abs(cuts[1] - 0.9) < 0.02
+
+
+def test_cuts_from_silence_without_gaps():
+    samples = np.sin(np.arange(2000) * 0.3)[:, None].astype(np.float32)
+    assert find_cuts_from_silence(samples, 1000, ['a', 'b']) is None
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main(['-q', __file__]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test voice_volume được apply giống nhau trên cả 3 đường mix timeline:
+ffmpeg filter graph (fallback), mix in-process và stream mixer (TimelineSlot)
+
+Usage:
+    python -m pytest -q test_voice_mix_levels.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append('.')
+from main_app import (AUDIO_CHANNELS, AUDIO_SAMPLE_RATE, TimelineMixer, TimelineSlot, commit_audio_output,
+                      decode_audio_pcm, mix_timeline_in_process, mix_timeline_with_ffmpeg, write_wav_pcm)
+
+VOICE_VOLUME = 83.0
+TOTAL_DURATION = 1.5
+
+
+def make_segments(tmp_path):
+    """Hai segment sine chồng lên nhau một đoạn trên timeline"""
+    segments = []
+    for k, (start, freq) in enumerate([(0.2, 440.0), (0.6, 660.0)]):
+        t = np.arange(int(0.5 * AUDIO_SAMPLE_RATE)) / AUDIO_SAMPLE_RATE
+        wave_data = (0.3 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+        path = os.path.join(tmp_path, f'seg_{k}.wav')
+        write_wav_pcm(path, np.repeat(wave_data[:, None], AUDIO_CHANNELS, axis=1))
+        segments.append({'file': path, 'start': start})
+    return segments
+
+
+def mix_with_stream(segments, output_path, gain):
+    """Giống generate_voice_internal khi TTS_STREAM_CONFIG bật: mỗi segment ghi vào một TimelineSlot"""
+    mixer = TimelineMixer(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, gain, duration=TOTAL_DURATION)
+    for seg_audio in segments:
+        slot = TimelineSlot(mixer, seg_audio['start'])
+        slot.write_pcm(decode_audio_pcm(seg_audio['file']))
+        commit_audio_output(slot)
+    mixer.write(output_path, TOTAL_DURATION)
+
+
+def rms(samples):
+    return float(np.sqrt(np.mean(np.square(samples))))
+
+
+def test_all_mix_paths_apply_the_same_voice_volume(tmp_path):
+    segments = make_segments(tmp_path)
+    gain = VOICE_VOLUME / 100.0
+    outputs = {method: os.path.join(tmp_path, f'{method}.wav') for method in ('ffmpeg', 'in_process', 'stream')}
+
+    assert mix_timeline_with_ffmpeg(segments, TOTAL_DURATION, outputs['ffmpeg'], gain)
+    assert mix_timeline_in_process(segments, TOTAL_DURATION, outputs['in_process'], gain)
+    mix_with_stream(segments, outputs['stream'], gain)
+
+    mixed = {method: decode_audio_pcm(path) for method, path in outputs.items()}
+    reference = mixed['in_process']
+    for method, samples in mixed.items():
+        assert samples.shape == (int(TOTAL_DURATION * AUDIO_SAMPLE_RATE), AUDIO_CHANNELS), method
+        assert abs(rms(samples) - rms(reference)) <= 0.01 * rms(reference), method
+        assert np.abs(samples - reference).max() < 1e-3, method
+
+
+def test_voice_volume_scales_the_mixed_level(tmp_path):
+    segments = make_segments(tmp_path)
+    full = os.path.join(tmp_path, 'full.wav')
+    quiet = os.path.join(tmp_path, 'quiet.wav')
+    assert mix_timeline_in_process(segments, TOTAL_DURATION, full, 1.0)
+    assert mix_timeline_in_process(segments, TOTAL_DURATION, quiet, VOICE_VOLUME / 100.0)
+    ratio = rms(decode_audio_pcm(quiet)) / rms(decode_audio_pcm(full))
+    assert abs(ratio - VOICE_VOLUME / 100.0) < 0.01
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main(['-q', __file__]))
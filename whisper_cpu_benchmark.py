@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Whisper CPU Benchmark - FP32 vs INT8 (dynamic quantization)
+So sánh tốc độ và độ chính xác của Whisper trên CPU để chọn precision cho từng job
+
+Usage:
+    python whisper_cpu_benchmark.py audio.wav [--models small,medium] [--language vi] [--decode-profile fast] [--output report.json]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+sys.path.append('.')
+from main_app import (
+    WHISPER_CPU_CONFIG,
+    get_decode_options,
+    get_whisper_model,
+    whisper_models
+)
+
+import torch
+import whisper
+
+
+def word_error_rate(reference, hypothesis):
+    """WER giữa hai transcript (Levenshtein trên từ)"""
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            cost = 0 if ref_word == hyp_word else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run_transcription(model_name, precision, audio, language, decode_options):
+    """Load model với precision cho trước và đo thời gian transcribe"""
+    load_start = time.time()
+    model = get_whisper_model(model_name, precision)
+    load_seconds = time.time() - load_start
+    if model is None:
+        raise RuntimeError(f"Could not load {model_name} ({precision})")
+
+    start = time.time()
+    with torch.inference_mode():
+        result = model.transcribe(audio, language=language, fp16=False, **decode_options)
+    transcribe_seconds = time.time() - start
+
+    logprobs = [seg['avg_logprob'] for seg in result['segments']]
+    return {
+        'load_seconds': round(load_seconds, 2),
+        'transcribe_seconds': round(transcribe_seconds, 2),
+        'mean_avg_logprob': round(sum(logprobs) / len(logprobs), 4) if logprobs else None,
+        'text': result['text']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper CPU fp32 vs int8 benchmark")
+    parser.add_argument('audio', help="Audio/video file to transcribe")
+    parser.add_argument('--models', default='base,small', help="Comma-separated Whisper models")
+    parser.add_argument('--language', default=None, help="Language code (default: auto-detect)")
+    parser.add_argument('--decode-profile', default=None, help="Decode profile: fast, balanced, accurate")
+    parser.add_argument('--output', default=None, help="Write JSON report to this path")
+    args = parser.parse_args()
+
+    print("🧮 WHISPER CPU BENCHMARK: FP32 vs INT8")
+    print("=" * 60)
+    print(f"🖥️ Threads: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+    print(f"⚙️ Config: {WHISPER_CPU_CONFIG}")
+
+    decode_profile, decode_options = get_decode_options(args.decode_profile)
+    decode_options['verbose'] = None
+    print(f"🎛️ Decode profile: {decode_profile}")
+
+    audio = whisper.load_audio(args.audio)
+    audio_seconds = len(audio) / whisper.audio.SAMPLE_RATE
+    print(f"🎵 Audio: {args.audio} ({audio_seconds:.1f}s)")
+
+    report = {'audio': args.audio, 'audio_seconds': round(audio_seconds, 2),
+              'decode_profile': decode_profile, 'results': []}
+
+    for model_name in [m.strip() for m in args.models.split(',') if m.strip()]:
+        print(f"\n🔄 Model: {model_name}")
+        runs = {}
+        for precision in ['fp32', 'int8']:
+            runs[precision] = run_transcription(model_name, precision, audio, args.language, decode_options)
+            rtf = runs[precision]['transcribe_seconds'] / audio_seconds if audio_seconds > 0 else 0
+            print(f"   {precision}: {runs[precision]['transcribe_seconds']:.1f}s (RTF {rtf:.2f}), "
+                  f"avg_logprob {runs[precision]['mean_avg_logprob']}")
+
+        # FP32 transcript làm reference cho INT8
+        wer = word_error_rate(runs['fp32']['text'], runs['int8']['text'])
+        speedup = runs['fp32']['transcribe_seconds'] / max(runs['int8']['transcribe_seconds'], 1e-6)
+        print(f"   📊 Speedup int8: {speedup:.2f}x | WER int8 vs fp32: {wer * 100:.1f}%")
+
+        report['results'].append({
+            'model': model_name,
+            'fp32': runs['fp32'],
+            'int8': runs['int8'],
+            'int8_speedup': round(speedup, 2),
+            'int8_wer_vs_fp32': round(wer, 4)
+        })
+
+        # Giải phóng RAM trước model tiếp theo
+        whisper_models.clear()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report saved to {args.output}")
+
+    print("\n💡 Chọn precision cho từng job qua field 'precision' của /api/generate_subtitles")
+
+
+if __name__ == "__main__":
+    main()